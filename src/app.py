@@ -1,20 +1,66 @@
+import argparse
+import json
 import sys
+import threading
+import time
 import traceback
 
+from PyQt5.QtCore import QObject, QEvent, QTimer
 from PyQt5.QtWidgets import QApplication, QMessageBox
 
 from controller.main_window_controller import MainWindow
+from model.model import warm_up_imports
+from utils.trace_utils import enable_tracing
+
+
+class FirstPaintFilter(QObject):
+    """calls callback once widget is painted for the first time"""
+
+    def __init__(self, widget, callback):
+        super().__init__(widget)
+        self._callback = callback
+        widget.installEventFilter(self)
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Paint:
+            obj.removeEventFilter(self)
+            QTimer.singleShot(0, self._callback)  # after the paint
+        return False
 
 
 def main(argv):
-    if len(argv) == 2 and argv[1] == '-v':
-        pass
-    else:
+    main_time = time.time()
+    parser = argparse.ArgumentParser(prog='python app.py')
+    parser.add_argument('-v', action='store_true', help='print errors to the console instead of a message box')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='record the time of reading, rendering, painting and saving to FILE as Chrome trace json '
+                             'at exit, to be opened in chrome://tracing or https://ui.perfetto.dev')
+    parser.add_argument('--frame-times', action='store_true', help='show the render times of the views over them')
+    parser.add_argument('--startup-time', metavar='FILE',
+                        help='write the times the app started, showed and painted the window to FILE as json and '
+                             'quit, see scripts/measure_startup.py')
+    args, qt_argv = parser.parse_known_args(argv[1:])
+    if not args.v:
         sys.excepthook = error_handler
+    if args.trace is not None:
+        enable_tracing(args.trace)
 
-    app = QApplication(argv)
+    app = QApplication(argv[:1] + qt_argv)
     main_window = MainWindow()
+    main_window.actionShow_Frame_Times.setChecked(args.frame_times)
     main_window.show()
+    show_time = time.time()
+
+    def on_first_paint():
+        if args.startup_time is not None:
+            with open(args.startup_time, 'w') as f:
+                json.dump({'main': main_time, 'show': show_time, 'first_paint': time.time()}, f)
+            app.quit()
+            return
+        threading.Thread(target=warm_up_imports, name='warm up', daemon=True).start()
+        main_window.recover_last_session()
+
+    FirstPaintFilter(main_window, on_first_paint)
     sys.exit(app.exec_())
 
 
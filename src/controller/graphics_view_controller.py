@@ -1,18 +1,87 @@
 import math
+import time
+from collections import deque
+from functools import wraps
 
+import numpy as np
 from PyQt5 import QtGui, QtCore
-from PyQt5.QtCore import Qt, pyqtSignal, pyqtSlot, QRectF
-from PyQt5.QtGui import QPixmap, QPen, QTransform, QPolygonF
+from PyQt5.QtCore import Qt, pyqtSignal, pyqtSlot, QRectF, QRect, QTimer, QPoint
+from PyQt5.QtGui import QPixmap, QPen, QTransform, QPolygonF, QImage, QPainter
 from PyQt5.QtWidgets import QGraphicsView, QGraphicsScene, QGraphicsPixmapItem, QOpenGLWidget, QGraphicsLineItem, \
-    QGraphicsEllipseItem, QGraphicsPolygonItem, QScrollBar
+    QGraphicsEllipseItem, QGraphicsPolygonItem, QScrollBar, QLabel
+
+from model.brush import BRUSH_TYPE_NO_BRUSH, BRUSH_TYPE_CIRCLE_BRUSH, BRUSH_TYPE_RECT_BRUSH, BRUSH_TYPE_SPHERE_BRUSH, \
+    BRUSH_TYPE_CUBE_BRUSH, PAINT_BRUSH_TYPES
+from utils.trace_utils import is_tracing, trace_span
 
 item2scene_transform = {'a': QTransform(0, 1, 0, 1, 0, 0, 0, 0, 1),
                         's': QTransform(0, -1, 0, 1, 0, 0, 0, 0, 1),
                         'c': QTransform(0, -1, 0, 1, 0, 0, 0, 0, 1)}
 
-BRUSH_TYPE_NO_BRUSH = 0
-BRUSH_TYPE_CIRCLE_BRUSH = 1
-BRUSH_TYPE_RECT_BRUSH = 2
+STROKE_FLUSH_INTERVAL = 16  # ms, buffered brush samples are painted at about 60 fps
+TILE_SIZE = 512  # pixels per side of the tiles 2D maps are shown in, maps up to this size are one tile
+FRAME_TIME_REFRESH_INTERVAL = 500  # ms, the frames per second of the overlay decay while nothing is rendered
+
+
+class FrameTimeOverlay(QLabel):
+    """render time of the last frame of a view, the slowest one and the frames rendered in the last second, drawn
+    over the top left corner of the view"""
+
+    def __init__(self, parent=None):
+        super(FrameTimeOverlay, self).__init__(parent)
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.setStyleSheet('background-color: rgba(0, 0, 0, 160); color: white; padding: 2px; font: 9pt monospace;')
+        self.move(4, 4)
+        self._frame_ends = deque()  # perf_counter times of the frames in the last second
+        self._last_ms = 0.
+        self._max_ms = 0.
+        self._refresh_timer = QTimer(self)
+        self._refresh_timer.setInterval(FRAME_TIME_REFRESH_INTERVAL)
+        self._refresh_timer.timeout.connect(self.refresh)
+        self.setVisible(False)
+
+    def setVisible(self, visible):
+        super(FrameTimeOverlay, self).setVisible(visible)
+        if visible:
+            self._max_ms = 0.
+            self.refresh()
+            self.raise_()
+            self._refresh_timer.start()
+        else:
+            self._refresh_timer.stop()
+
+    def add_frame(self, seconds):
+        self._frame_ends.append(time.perf_counter())
+        self._last_ms = seconds * 1000
+        self._max_ms = max(self._max_ms, self._last_ms)
+        self.refresh()
+
+    def refresh(self):
+        now = time.perf_counter()
+        while len(self._frame_ends) > 0 and self._frame_ends[0] < now - 1:
+            self._frame_ends.popleft()
+        self.setText('%s  %6.1f ms  max %6.1f ms  %3d fps' % (self.parent().objectName()[:1], self._last_ms,
+                                                               self._max_ms, len(self._frame_ends)))
+        self.adjustSize()
+
+
+def timed_frame(fn):
+    """Time fn of ASCGraphicsView as a frame when the frame time overlay is shown or tracing is enabled. Calls
+    nested in it are part of its frame, and frames that rendered nothing are not counted"""
+    @wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        if self._frame_start is not None or not (self.frame_time_overlay.isVisibleTo(self) or is_tracing()):
+            return fn(self, *args, **kwargs)
+        self._frame_start = time.perf_counter()
+        self._frame_rendered = False
+        try:
+            with trace_span('ASCGraphicsView frame', view=self.objectName(), call=fn.__name__):
+                return fn(self, *args, **kwargs)
+        finally:
+            if self._frame_rendered:
+                self.frame_time_overlay.add_frame(time.perf_counter() - self._frame_start)
+            self._frame_start = None
+    return wrapper
 
 
 class ASCGraphicsView(QGraphicsView):
@@ -20,13 +89,16 @@ class ASCGraphicsView(QGraphicsView):
     set_focus_point_signal = pyqtSignal('int', 'int', 'int')
     set_focus_point_percent_signal = pyqtSignal('float', 'float', 'float')
     move_focus_point_signal = pyqtSignal('int', 'int', 'int')
-    # x, y, z, BRUSH_TYPE, BRUSH_SIZE, ERASE
-    paint_anno_on_point_signal = pyqtSignal('int', 'int', 'int', 'int', 'int', 'bool', 'bool')
+    # polyline [[x, y, z]], BRUSH_TYPE, BRUSH_SIZE, ERASE, NEW_STEP
+    paint_anno_stroke_signal = pyqtSignal('PyQt_PyObject', 'int', 'int', 'bool', 'bool')
+    # mouse move in pixels: delta_x for window width, delta_y for window level
+    adjust_window_signal = pyqtSignal('int', 'int')
 
     def __init__(self, parent=None):
         super(ASCGraphicsView, self).__init__(parent)
         self.scene = QGraphicsScene(self)
 
+        # parents of the tiles of the 2D maps, see set_img_source
         self.raw_img_item = QGraphicsPixmapItem()
         self.raw_img_item.setZValue(0)
         self.anno_img_item = QGraphicsPixmapItem()
@@ -61,26 +133,60 @@ class ASCGraphicsView(QGraphicsView):
         self._last_button_press = Qt.NoButton
         self._last_pos_middle_button = None
         self._last_pos_right_button = None
+        self._last_pos_window_drag = None
 
         self._brush_stats = {'type': BRUSH_TYPE_NO_BRUSH, 'size': 5}
 
+        # brush samples buffered until the next flush, the first one is the last sample already painted
+        self._stroke_points = []
+        self._stroke_erase = False
+        self._stroke_new_step = False
+        self._stroke_flush_timer = QTimer(self)
+        self._stroke_flush_timer.setSingleShot(True)
+        self._stroke_flush_timer.setInterval(STROKE_FLUSH_INTERVAL)
+        self._stroke_flush_timer.timeout.connect(self.flush_stroke)
+
         self.setResizeAnchor(QGraphicsView.AnchorViewCenter)
 
         self.slice_scroll_bar = None
         self.image_size = None
         self.is_valid = False
+        self._item_transform = QTransform()  # image (full resolution 2D map) to scene
+        self._image_rect = QRectF()  # full resolution 2D map in image coordinates
+
+        # preallocated C-contiguous slice buffers and the QImages wrapping them, reused while the shape is unchanged.
+        # only the parts of visible tiles are rendered to them
+        self._img_buffers = {'raw': None, 'anno': None}  # raw: [h, w] gray, anno: [h, w, 4] RGBA
+        self._img_buffer_qimages = {'raw': None, 'anno': None}
+        self._img_levels = {'raw': 0, 'anno': 0}  # pyramid levels of the maps
+        self._img_sources = {'raw': None, 'anno': None}  # (key, render_fn) of the maps, see set_img_source
+        # tile (row, col) -> pixmap item and key of the map it shows. tiles out of sight are kept while the key is
+        # unchanged, so panning back uploads nothing
+        self._img_tiles = {'raw': {}, 'anno': {}}
+        self._img_tile_keys = {'raw': {}, 'anno': {}}
+
+        self.frame_time_overlay = FrameTimeOverlay(self)
+        self._frame_start = None  # perf_counter time of the frame being rendered, see timed_frame
+        self._frame_rendered = False
 
     def clear(self):
         """before loading new image"""
         self._last_pos_middle_button = None
         self._last_pos_right_button = None
+        self._last_pos_window_drag = None
         self._last_button_press = Qt.NoButton
-        self.raw_img_item.setPixmap(QPixmap())
-        self.anno_img_item.setPixmap(QPixmap())
+        self._stroke_flush_timer.stop()
+        self._stroke_points = []
+        for img_type in ['raw', 'anno']:
+            self.remove_tiles(img_type)
         self.paint_brush_circle_item.setVisible(False)
         self.paint_brush_rect_item.setVisible(False)
         self.image_size = None
         self.is_valid = False
+        self._img_buffers = {'raw': None, 'anno': None}
+        self._img_buffer_qimages = {'raw': None, 'anno': None}
+        self._img_levels = {'raw': 0, 'anno': 0}
+        self._img_sources = {'raw': None, 'anno': None}
 
     def init_view(self, image_size):
         """after loading new image"""
@@ -88,17 +194,196 @@ class ASCGraphicsView(QGraphicsView):
         self.image_size = image_size
         self.slice_scroll_bar = self.parent().findChild(QScrollBar, self.objectName()[0] + 'SliceScrollBar')
 
+        x, y, z = image_size
+        self._image_rect = {'a': QRectF(0, 0, y, x), 's': QRectF(0, 0, z, y), 'c': QRectF(0, 0, z, x)}[
+            self.objectName()[0]]
         trans_mat = item2scene_transform[self.objectName()[0]]
-        self.raw_img_item.setTransform(trans_mat)
-        self.anno_img_item.setTransform(trans_mat)
+        self._item_transform = trans_mat
+        for img_type in ['raw', 'anno']:
+            self.set_img_item_level(img_type, self._img_levels[img_type])
         self.cross_bar_v_line_item.setTransform(trans_mat)
         self.cross_bar_h_line_item.setTransform(trans_mat)
         self.paint_brush_rect_item.setTransform(trans_mat)
         self.paint_brush_circle_item.setTransform(trans_mat)
 
-        self.fitInView(self.raw_img_item, Qt.KeepAspectRatio)
+        # tiles are added as they come into sight, they must not change the scene size
+        self.scene.setSceneRect(trans_mat.mapRect(self._image_rect))
+        self.fitInView(trans_mat.mapRect(self._image_rect), Qt.KeepAspectRatio)
         self.paint_brush_circle_item.setVisible(False)
         self.paint_brush_rect_item.setVisible(False)
+        self.update_tiles()
+
+    def get_img_buffer(self, img_type, shape):
+        """buffer the tiles of img_type are rendered to. shape: rows, cols"""
+        assert img_type in ['raw', 'anno']
+        buffer_shape = tuple(shape) if img_type == 'raw' else tuple(shape) + (4,)
+        img_buffer = self._img_buffers[img_type]
+        if img_buffer is None or img_buffer.shape != buffer_shape:
+            img_buffer = np.zeros(buffer_shape, np.uint8)
+            self._img_buffers[img_type] = img_buffer
+            self._img_buffer_qimages[img_type] = QImage(
+                img_buffer.data, buffer_shape[1], buffer_shape[0], img_buffer.strides[0],
+                QImage.Format_Grayscale8 if img_type == 'raw' else QImage.Format_RGBA8888)
+        return img_buffer
+
+    def map_to_image(self, pos):
+        """position in the view to the coordinates of the full resolution 2D map (column, row)"""
+        return self._item_transform.inverted()[0].map(self.mapToScene(pos))
+
+    def get_render_level(self, num_levels):
+        """the coarsest of num_levels pyramid levels whose pixels are not bigger than a screen pixel at the current
+        zoom. level k maps are downsampled by 2 ** k"""
+        zoom = math.sqrt(abs(self.transform().determinant())) * self.devicePixelRatioF()
+        if zoom <= 0 or num_levels == 0:
+            return 0
+        return min(max(int(math.floor(math.log2(1 / zoom))), 0), num_levels)
+
+    def get_img_level(self, img_type):
+        """pyramid level of the map shown for img_type"""
+        return self._img_levels[img_type]
+
+    def set_img_item_level(self, img_type, level):
+        """show the tiles of img_type, made of level maps, at full resolution size"""
+        img_item = self.raw_img_item if img_type == 'raw' else self.anno_img_item
+        img_item.setTransform(QTransform.fromScale(2 ** level, 2 ** level) * self._item_transform)
+        self._img_levels[img_type] = level
+
+    @timed_frame
+    def set_img_source(self, img_type, key, shape, level, render_fn):
+        """Show the 2D map identified by key, of shape (rows, cols) at pyramid level. render_fn(out=, region=)
+        renders region ((row0, row1), (col0, col1)) (closed interval) of the map to out, a buffer of shape.
+        Only the tiles in sight whose map is not key yet are rendered and uploaded, now and when they come into
+        sight"""
+        assert img_type in ['raw', 'anno']
+        buffer = self._img_buffers[img_type]
+        if level != self._img_levels[img_type] or buffer is None or buffer.shape[:2] != tuple(shape):
+            self.remove_tiles(img_type)
+            self.set_img_item_level(img_type, level)
+            self.get_img_buffer(img_type, shape)
+        self._img_sources[img_type] = (key, render_fn)
+        self.update_tiles([img_type])
+
+    @timed_frame
+    def update_img_region(self, img_type, key, region, render_fn):
+        """Show the 2D map identified by key, which differs from the shown one only in region ((row0, row1),
+        (col0, col1)) (closed interval). Tiles in sight are updated in region only, see set_img_source"""
+        assert self._img_sources[img_type] is not None
+        old_key = self._img_sources[img_type][0]
+        self._img_sources[img_type] = (key, render_fn)
+        tiles = self._img_tiles[img_type]
+        tile_keys = self._img_tile_keys[img_type]
+        visible_tiles = set(self.get_visible_tiles(img_type))
+        (row0, row1), (col0, col1) = region
+        changed_tiles = set((row, col) for row in range(row0 // TILE_SIZE, row1 // TILE_SIZE + 1)
+                            for col in range(col0 // TILE_SIZE, col1 // TILE_SIZE + 1))
+        for tile in list(tiles.keys()):
+            if tile_keys[tile] != old_key:
+                continue
+            if tile not in changed_tiles:
+                tile_keys[tile] = key
+            elif tile not in visible_tiles:
+                self.remove_tile(img_type, tile)
+        update_tiles = [tile for tile in changed_tiles & visible_tiles if tile_keys.get(tile) == old_key]
+        if len(update_tiles) > 0:
+            rows = [tile[0] for tile in update_tiles]
+            cols = [tile[1] for tile in update_tiles]
+            update_region = ((max(row0, min(rows) * TILE_SIZE), min(row1, (max(rows) + 1) * TILE_SIZE - 1)),
+                             (max(col0, min(cols) * TILE_SIZE), min(col1, (max(cols) + 1) * TILE_SIZE - 1)))
+            render_fn(out=self._img_buffers[img_type], region=update_region)
+            self._frame_rendered = True
+            (row0, row1), (col0, col1) = update_region
+            qimage = self._img_buffer_qimages[img_type]
+            num_rows, num_cols = self._img_buffers[img_type].shape[:2]
+            for tile in update_tiles:
+                tile_item = tiles[tile]
+                tile_pos = QPoint(tile[1] * TILE_SIZE, tile[0] * TILE_SIZE)
+                rect = QRect(col0, row0, col1 - col0 + 1, row1 - row0 + 1) & \
+                    ASCGraphicsView.get_tile_rect(num_rows, num_cols, tile)
+                pixmap = tile_item.pixmap()
+                # release the copy shared with the item, so painting on the pixmap does not detach it
+                tile_item.setPixmap(QPixmap())
+                painter = QPainter(pixmap)
+                painter.setCompositionMode(QPainter.CompositionMode_Source)
+                painter.drawImage(rect.translated(-tile_pos), qimage, rect)
+                painter.end()
+                tile_item.setPixmap(pixmap)
+                tile_keys[tile] = key
+        self.update_tiles([img_type])
+
+    @timed_frame
+    def update_tiles(self, img_types=('raw', 'anno')):
+        """render and upload the tiles in sight whose map is not the one of the source. meant to be called after
+        the view is scrolled, zoomed or resized"""
+        for img_type in img_types:
+            if self._img_sources[img_type] is None or self._img_buffers[img_type] is None:
+                continue
+            key, render_fn = self._img_sources[img_type]
+            tiles = self._img_tiles[img_type]
+            tile_keys = self._img_tile_keys[img_type]
+            visible_tiles = self.get_visible_tiles(img_type)
+            for tile in list(tiles.keys()):
+                if tile_keys[tile] != key and tile not in visible_tiles:
+                    self.remove_tile(img_type, tile)  # out of date and out of sight
+            missing_tiles = [tile for tile in visible_tiles if tile_keys.get(tile) != key]
+            if len(missing_tiles) == 0:
+                continue
+            # one render call for the bounding box of the missing tiles
+            rows = [tile[0] for tile in missing_tiles]
+            cols = [tile[1] for tile in missing_tiles]
+            num_rows, num_cols = self._img_buffers[img_type].shape[:2]
+            region = ((min(rows) * TILE_SIZE, min((max(rows) + 1) * TILE_SIZE, num_rows) - 1),
+                      (min(cols) * TILE_SIZE, min((max(cols) + 1) * TILE_SIZE, num_cols) - 1))
+            render_fn(out=self._img_buffers[img_type], region=region)
+            self._frame_rendered = True
+            qimage = self._img_buffer_qimages[img_type]
+            img_item = self.raw_img_item if img_type == 'raw' else self.anno_img_item
+            for tile in missing_tiles:
+                tile_item = tiles.get(tile)
+                if tile_item is None:
+                    tile_item = QGraphicsPixmapItem(img_item)
+                    tile_item.setPos(tile[1] * TILE_SIZE, tile[0] * TILE_SIZE)
+                    tiles[tile] = tile_item
+                if num_rows <= TILE_SIZE and num_cols <= TILE_SIZE:
+                    tile_item.setPixmap(QPixmap.fromImage(qimage))
+                else:
+                    tile_item.setPixmap(QPixmap.fromImage(qimage.copy(
+                        ASCGraphicsView.get_tile_rect(num_rows, num_cols, tile))))
+                tile_keys[tile] = key
+
+    @staticmethod
+    def get_tile_rect(rows, cols, tile):
+        """QRect of tile (row, col) in a 2D map of rows, cols"""
+        row0, col0 = tile[0] * TILE_SIZE, tile[1] * TILE_SIZE
+        return QRect(col0, row0, min(TILE_SIZE, cols - col0), min(TILE_SIZE, rows - row0))
+
+    def get_visible_tiles(self, img_type):
+        """[(row, col)] of the tiles of the 2D map of img_type in sight"""
+        if self._img_buffers[img_type] is None or self.viewport().width() <= 0 or self.viewport().height() <= 0:
+            return []
+        rows, cols = self._img_buffers[img_type].shape[:2]
+        img_item = self.raw_img_item if img_type == 'raw' else self.anno_img_item
+        visible_rect = img_item.mapFromScene(self.mapToScene(self.viewport().rect())).boundingRect()
+        row0 = max(int(math.floor(visible_rect.top())) // TILE_SIZE, 0)
+        row1 = min(int(math.floor(visible_rect.bottom())) // TILE_SIZE, (rows - 1) // TILE_SIZE)
+        col0 = max(int(math.floor(visible_rect.left())) // TILE_SIZE, 0)
+        col1 = min(int(math.floor(visible_rect.right())) // TILE_SIZE, (cols - 1) // TILE_SIZE)
+        return [(row, col) for row in range(row0, row1 + 1) for col in range(col0, col1 + 1)]
+
+    def remove_tile(self, img_type, tile):
+        self.scene.removeItem(self._img_tiles[img_type].pop(tile))
+        del self._img_tile_keys[img_type][tile]
+
+    def remove_tiles(self, img_type):
+        for tile in list(self._img_tiles[img_type].keys()):
+            self.remove_tile(img_type, tile)
+
+    def scrollContentsBy(self, dx, dy):
+        super(ASCGraphicsView, self).scrollContentsBy(dx, dy)
+        self.update_tiles()
+
+    def resizeEvent(self, event: QtGui.QResizeEvent):
+        super(ASCGraphicsView, self).resizeEvent(event)
+        self.update_tiles()
 
     @property
     def brush_stats(self):
@@ -107,7 +392,7 @@ class ASCGraphicsView(QGraphicsView):
     @brush_stats.setter
     def brush_stats(self, stats_tuple):
         b_type, size = stats_tuple
-        if b_type in [BRUSH_TYPE_NO_BRUSH, BRUSH_TYPE_CIRCLE_BRUSH, BRUSH_TYPE_RECT_BRUSH]:
+        if b_type == BRUSH_TYPE_NO_BRUSH or b_type in PAINT_BRUSH_TYPES:
             self._brush_stats['type'] = b_type
             self._brush_stats['size'] = size
         if b_type != BRUSH_TYPE_NO_BRUSH:
@@ -121,37 +406,61 @@ class ASCGraphicsView(QGraphicsView):
             self.paint_brush_circle_item.setVisible(False)
             return
 
-        center = self.anno_img_item.mapFromScene(self.mapToScene(x, y))
+        center = self.map_to_image(QPoint(x, y))
 
-        start_x = self.raw_img_item.boundingRect().topLeft().x()
-        start_y = self.raw_img_item.boundingRect().topLeft().y()
-        end_x = self.raw_img_item.boundingRect().bottomRight().x()
-        end_y = self.raw_img_item.boundingRect().bottomRight().y()
+        start_x = self._image_rect.topLeft().x()
+        start_y = self._image_rect.topLeft().y()
+        end_x = self._image_rect.bottomRight().x()
+        end_y = self._image_rect.bottomRight().y()
         center.setX(min(max(start_x, center.x()), end_x) + 0.5)
         center.setY(min(max(start_y, center.y()), end_y) + 0.5)
         top_left_x = int(center.x() - self.brush_stats['size'] / 2)
         top_left_y = int(center.y() - self.brush_stats['size'] / 2)
         rect = QRectF(top_left_x, top_left_y, self.brush_stats['size'], self.brush_stats['size'])
-        if self.brush_stats['type'] == BRUSH_TYPE_CIRCLE_BRUSH:
+        if self.brush_stats['type'] in [BRUSH_TYPE_CIRCLE_BRUSH, BRUSH_TYPE_SPHERE_BRUSH]:
             self.paint_brush_rect_item.setVisible(False)
             self.paint_brush_circle_item.setVisible(True)
             self.paint_brush_circle_item.setRect(rect)
-        if self.brush_stats['type'] == BRUSH_TYPE_RECT_BRUSH:
+        if self.brush_stats['type'] in [BRUSH_TYPE_RECT_BRUSH, BRUSH_TYPE_CUBE_BRUSH]:
             self.paint_brush_rect_item.setVisible(True)
             self.paint_brush_circle_item.setVisible(False)
             self.paint_brush_rect_item.setPolygon(QPolygonF(rect))
 
     def anno_paint(self, x, y, erase=False, new_step=False):
-        pos_on_item = self.raw_img_item.mapFromScene(self.mapToScene(x, y))
+        """buffer a brush sample. new_step starts a new stroke and paints at once, later samples of the stroke are
+        painted together by flush_stroke"""
+        pos_on_item = self.map_to_image(QPoint(x, y))
         if self.objectName() == 'aGraphicsView':
             paint_point = [pos_on_item.y(), pos_on_item.x(), 999999]
         if self.objectName() == 'sGraphicsView':
             paint_point = [999999, pos_on_item.y(), pos_on_item.x()]
         if self.objectName() == 'cGraphicsView':
             paint_point = [pos_on_item.y(), 999999, pos_on_item.x()]
-        self.paint_anno_on_point_signal.emit(
-            math.floor(paint_point[0]), math.floor(paint_point[1]), math.floor(paint_point[2]),
-            self.brush_stats['type'], self.brush_stats['size'], erase, new_step)
+        if new_step:
+            self.end_stroke()
+            self._stroke_new_step = True
+        self._stroke_erase = erase
+        self._stroke_points.append([math.floor(paint_point[0]), math.floor(paint_point[1]),
+                                    math.floor(paint_point[2])])
+        if new_step:
+            self.flush_stroke()
+        elif not self._stroke_flush_timer.isActive():
+            self._stroke_flush_timer.start()
+
+    @pyqtSlot()
+    def flush_stroke(self):
+        """paint the buffered samples as one polyline, continued from the last painted sample"""
+        self._stroke_flush_timer.stop()
+        if len(self._stroke_points) == 0 or (len(self._stroke_points) == 1 and not self._stroke_new_step):
+            return
+        self.paint_anno_stroke_signal.emit(self._stroke_points, self.brush_stats['type'], self.brush_stats['size'],
+                                           self._stroke_erase, self._stroke_new_step)
+        self._stroke_points = self._stroke_points[-1:]
+        self._stroke_new_step = False
+
+    def end_stroke(self):
+        self.flush_stroke()
+        self._stroke_points = []
 
     @pyqtSlot('int')
     def on_slice_scroll_bar_changed(self, value):
@@ -172,6 +481,19 @@ class ASCGraphicsView(QGraphicsView):
     def set_brush_stats(self, b_type, size):
         self.brush_stats = [b_type, size]
 
+    def set_frame_time_overlay(self, visible):
+        self.frame_time_overlay.setVisible(visible)
+
+    def get_view_state(self):
+        """json serializable zoom and center of the view, see set_view_state"""
+        center = self.mapToScene(self.viewport().rect().center())
+        return {'scale': [self.transform().m11(), self.transform().m22()], 'center': [center.x(), center.y()]}
+
+    def set_view_state(self, view_state):
+        """zoom and center of get_view_state, after init_view"""
+        self.setTransform(QTransform.fromScale(*view_state['scale']))
+        self.centerOn(*view_state['center'])
+
     @pyqtSlot('int', 'int', 'int')
     def set_cross_bar(self, x, y, z):
         if self.objectName() == 'aGraphicsView':
@@ -189,10 +511,10 @@ class ASCGraphicsView(QGraphicsView):
         # cross line in voxel center
         cross_bar_x = cross_bar_x + 0.5
         cross_bar_y = cross_bar_y + 0.5
-        start_x = self.raw_img_item.boundingRect().topLeft().x()
-        start_y = self.raw_img_item.boundingRect().topLeft().y()
-        end_x = self.raw_img_item.boundingRect().bottomRight().x()
-        end_y = self.raw_img_item.boundingRect().bottomRight().y()
+        start_x = self._image_rect.topLeft().x()
+        start_y = self._image_rect.topLeft().y()
+        end_x = self._image_rect.bottomRight().x()
+        end_y = self._image_rect.bottomRight().y()
         self.cross_bar_v_line_item.setLine(cross_bar_x, start_y, cross_bar_x, end_y)
         self.cross_bar_h_line_item.setLine(start_x, cross_bar_y, end_x, cross_bar_y)
 
@@ -204,8 +526,11 @@ class ASCGraphicsView(QGraphicsView):
         self._last_button_press = event.button()
 
         if self.brush_stats['type'] == BRUSH_TYPE_NO_BRUSH:
-            if event.button() == Qt.LeftButton:
-                item_coord_pos = self.raw_img_item.mapFromScene(self.mapToScene(event.pos()))
+            if event.button() == Qt.LeftButton and event.modifiers() & Qt.ControlModifier:
+                self._last_pos_window_drag = event.pos()
+                self.setCursor(Qt.SizeAllCursor)
+            elif event.button() == Qt.LeftButton:
+                item_coord_pos = self.map_to_image(event.pos())
                 if self.objectName() == 'aGraphicsView':
                     new_focus_point = [item_coord_pos.y(), item_coord_pos.x(), 999999]
                 if self.objectName() == 'sGraphicsView':
@@ -221,7 +546,7 @@ class ASCGraphicsView(QGraphicsView):
                 self._last_pos_right_button = event.pos()
             else:
                 super(ASCGraphicsView, self).mousePressEvent(event)
-        if self.brush_stats['type'] in [BRUSH_TYPE_CIRCLE_BRUSH, BRUSH_TYPE_RECT_BRUSH]:
+        if self.brush_stats['type'] in PAINT_BRUSH_TYPES:
             if event.button() == Qt.LeftButton:
                 self.anno_paint(event.x(), event.y(), erase=False, new_step=True)
             elif event.button() == Qt.MiddleButton:
@@ -232,8 +557,13 @@ class ASCGraphicsView(QGraphicsView):
 
     def mouseMoveEvent(self, event: QtGui.QMouseEvent):
         if self.brush_stats['type'] == BRUSH_TYPE_NO_BRUSH:
-            if self._last_button_press == Qt.LeftButton:
-                item_coord_pos = self.raw_img_item.mapFromScene(self.mapToScene(event.pos()))
+            if self._last_button_press == Qt.LeftButton and self._last_pos_window_drag is not None:
+                delta_x = event.x() - self._last_pos_window_drag.x()
+                delta_y = event.y() - self._last_pos_window_drag.y()
+                self.adjust_window_signal.emit(delta_x, delta_y)
+                self._last_pos_window_drag = event.pos()
+            elif self._last_button_press == Qt.LeftButton:
+                item_coord_pos = self.map_to_image(event.pos())
                 if self.objectName() == 'aGraphicsView':
                     new_focus_point = [item_coord_pos.y(), item_coord_pos.x(), 999999]
                 if self.objectName() == 'sGraphicsView':
@@ -255,7 +585,7 @@ class ASCGraphicsView(QGraphicsView):
                 self._last_pos_right_button = event.pos()
             else:
                 super(ASCGraphicsView, self).mouseMoveEvent(event)
-        if self.brush_stats['type'] in [BRUSH_TYPE_CIRCLE_BRUSH, BRUSH_TYPE_RECT_BRUSH]:
+        if self.brush_stats['type'] in PAINT_BRUSH_TYPES:
             self.update_brush_preview(event.x(), event.y())
             if self._last_button_press == Qt.LeftButton:
                 self.anno_paint(event.x(), event.y(), erase=False, new_step=False)
@@ -274,11 +604,12 @@ class ASCGraphicsView(QGraphicsView):
         if self.brush_stats['type'] == BRUSH_TYPE_NO_BRUSH:
             if event.button() == Qt.MiddleButton:
                 self.setCursor(Qt.ArrowCursor)
-        if self.brush_stats['type'] in [BRUSH_TYPE_CIRCLE_BRUSH, BRUSH_TYPE_RECT_BRUSH]:
-            if event.button() == Qt.LeftButton:
-                pass
-            elif event.button() == Qt.RightButton:
-                pass
+            if event.button() == Qt.LeftButton and self._last_pos_window_drag is not None:
+                self._last_pos_window_drag = None
+                self.setCursor(Qt.ArrowCursor)
+        if self.brush_stats['type'] in PAINT_BRUSH_TYPES:
+            if event.button() in [Qt.LeftButton, Qt.RightButton]:
+                self.end_stroke()
         else:
             super(ASCGraphicsView, self).mouseReleaseEvent(event)
 
@@ -302,6 +633,7 @@ class ASCGraphicsView(QGraphicsView):
 
     def leaveEvent(self, event: QtCore.QEvent):
         self._last_button_press = Qt.NoButton
+        self.end_stroke()
         if self.brush_stats['type'] == BRUSH_TYPE_NO_BRUSH:
             super(ASCGraphicsView, self).leaveEvent(event)
         else:
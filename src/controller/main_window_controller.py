@@ -1,15 +1,34 @@
+import math
 import os
 from enum import Enum
-
-from PyQt5.QtCore import pyqtSlot, pyqtSignal, Qt
-from PyQt5.QtGui import QPixmap, QImage, QIcon
-from PyQt5.QtWidgets import QMainWindow, QFileDialog, QMessageBox, QPushButton, QListWidgetItem, QSpinBox
-
-from controller.graphics_view_controller import BRUSH_TYPE_NO_BRUSH, BRUSH_TYPE_RECT_BRUSH, BRUSH_TYPE_CIRCLE_BRUSH
-from model.model import Model
-from utils.exception_utils import ImageTypeError, ChangeNotSavedError
+from functools import partial
+
+from PyQt5.QtCore import pyqtSlot, pyqtSignal, Qt, QTimer
+from PyQt5.QtWidgets import QMainWindow, QFileDialog, QMessageBox, QPushButton, QListWidgetItem, QSpinBox, \
+    QProgressBar
+
+from controller.target_list_model import TargetListModel, TARGET_ID_ROLE, TARGET_SORT_NAMES
+from controller.worker_thread import WorkerThread
+from model.brush import BRUSH_TYPE_NO_BRUSH, BRUSH_TYPE_RECT_BRUSH, BRUSH_TYPE_CIRCLE_BRUSH, BRUSH_TYPE_SPHERE_BRUSH, \
+    BRUSH_TYPE_CUBE_BRUSH
+from model.model import Model, VIEW_AXIS
+from utils.exception_utils import ImageTypeError, IllegalSizeError, JournalError
+from utils.trace_utils import traced
 from view.main_window_ui import Ui_MainWindow
 
+PREFETCH_NUM_SLICES = 8
+JOURNAL_SYNC_INTERVAL = 1000  # ms, unsaved edits older than this survive a system crash
+DEFAULT_HU_WINDOW = (0, 400)  # for CT images
+AUTO_WINDOW_PERCENTILES = (0.5, 99.5)
+CT_WINDOW_PRESETS = [  # name, level, width in HU
+    ('Abdomen', 40, 400),
+    ('Liver', 60, 160),
+    ('Mediastinum', 50, 350),
+    ('Lung', -600, 1500),
+    ('Bone', 400, 1800),
+    ('Brain', 40, 80),
+]
+
 
 class MainWindow(QMainWindow, Ui_MainWindow):
     set_cross_bar_signal = pyqtSignal('int', 'int', 'int')
@@ -27,87 +46,109 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.model = Model()
 
         self._focus_point = [0, 0, 0]  # w, h, d or x, y, z
-        self._hu_window = [0, 400]
+        self._hu_window = list(DEFAULT_HU_WINDOW)
+        self._ct_window = True  # whether _hu_window is for CT images, otherwise from the histogram of others
         self._label_opacity = 50  # 0-100
         self._operation_mode = self.OpMode.CURSOR
 
+        self._load_serial = 0  # increased by every open/close, results of older loading are dropped
+        self._load_thread = None
+        self._save_thread = None
+        self._worker_threads = []  # running WorkerThreads, kept referenced till finished
+        self.progress_bar = QProgressBar(self)
+        self.progress_bar.setMaximumWidth(200)
+        self.progress_bar.setVisible(False)
+        self.statusbar.addPermanentWidget(self.progress_bar)
+        self._progress_message = ''
+
+        self.windowPresetComboBox.addItem('Auto (%g%% - %g%%)' % AUTO_WINDOW_PERCENTILES)
+        self.windowPresetComboBox.addItem('Full range')
+        for name, level, width in CT_WINDOW_PRESETS:
+            self.windowPresetComboBox.addItem('CT %s (L %d, W %d)' % (name, level, width))
+        self.windowPresetComboBox.setCurrentIndex(-1)
+
+        self.target_list_model = TargetListModel(self.model.get_label_color, self)
+        self.targetList.setModel(self.target_list_model)
+        self.targetSortComboBox.addItems(TARGET_SORT_NAMES)
+        self.targetLabelFilterComboBox.addItem('All labels', 0)
+
+        self.journal_sync_timer = QTimer(self)
+        self.journal_sync_timer.timeout.connect(self.model.sync_journal)
+        self.journal_sync_timer.start(JOURNAL_SYNC_INTERVAL)
+
         self.clear_views()
 
+    @traced()
     def update_scenes(self, scenes='asc', raw=True, anno=True):
         if not self.model.is_valid():
             return
-        if 'a' in scenes:
-            if raw:
-                self.aGraphicsView.raw_img_item.setPixmap(QPixmap.fromImage(QImage(
-                    self.model.get_2D_map_in_window('a', self.focus_point[2], 'raw', self.window_bottom,
-                                                    self.window_top),
-                    self.model.get_size()[1],
-                    self.model.get_size()[0],
-                    self.model.get_size()[1] * 1,  # bytesperline = width*channel
-                    QImage.Format_Grayscale8)))  # x, y
-            if anno:
-                self.aGraphicsView.anno_img_item.setPixmap(QPixmap.fromImage(QImage(
-                    self.model.get_2D_map_in_window('a', self.focus_point[2], 'anno', colored_anno=True,
-                                                    alpha=self.label_opacity / 100),
-                    self.model.get_size()[1],
-                    self.model.get_size()[0],
-                    self.model.get_size()[1] * 4,  # bytesperline = width*channel
-                    QImage.Format_RGBA8888)))  # x, y
-
-        if 's' in scenes:
-            if raw:
-                self.sGraphicsView.raw_img_item.setPixmap(QPixmap.fromImage(QImage(
-                    self.model.get_2D_map_in_window('s', self.focus_point[0], 'raw', self.window_bottom,
-                                                    self.window_top),
-                    self.model.get_size()[2],
-                    self.model.get_size()[1],
-                    self.model.get_size()[2] * 1,  # bytesperline = width*channel
-                    QImage.Format_Grayscale8)))
-            if anno:
-                self.sGraphicsView.anno_img_item.setPixmap(QPixmap.fromImage(QImage(
-                    self.model.get_2D_map_in_window('s', self.focus_point[0], 'anno', colored_anno=True,
-                                                    alpha=self.label_opacity / 100),
-                    self.model.get_size()[2],
-                    self.model.get_size()[1],
-                    self.model.get_size()[2] * 4,  # bytesperline = width*channel
-                    QImage.Format_RGBA8888)))
-
-        if 'c' in scenes:
+        for view, graphics_view in [('a', self.aGraphicsView), ('s', self.sGraphicsView), ('c', self.cGraphicsView)]:
+            if view not in scenes:
+                continue
+            index = self.focus_point[VIEW_AXIS[view]]
+            level = self.get_render_level(graphics_view)
+            shape = self.model.get_2D_map_shape(view, level)
+            # the views render the tiles in sight when the map differs from the one they show
             if raw:
-                self.cGraphicsView.raw_img_item.setPixmap(QPixmap.fromImage(QImage(
-                    self.model.get_2D_map_in_window('c', self.focus_point[1], 'raw', self.window_bottom,
-                                                    self.window_top),
-                    self.model.get_size()[2],
-                    self.model.get_size()[0],
-                    self.model.get_size()[2] * 1,  # bytesperline = width*channel
-                    QImage.Format_Grayscale8)))
+                args = (view, index, 'raw', self.window_bottom, self.window_top)
+                graphics_view.set_img_source('raw', self.model.get_2D_map_key(*args, level=level), shape, level,
+                                             partial(self.model.get_2D_map_in_window, *args, level=level))
             if anno:
-                self.cGraphicsView.anno_img_item.setPixmap(QPixmap.fromImage(QImage(
-                    self.model.get_2D_map_in_window('c', self.focus_point[1], 'anno', colored_anno=True,
-                                                    alpha=self.label_opacity / 100),
-                    self.model.get_size()[2],
-                    self.model.get_size()[0],
-                    self.model.get_size()[2] * 4,  # bytesperline = width*channel
-                    QImage.Format_RGBA8888)))
+                args = (view, index, 'anno')
+                kwargs = {'colored_anno': True, 'alpha': self.label_opacity / 100, 'level': level}
+                graphics_view.set_img_source('anno', self.model.get_2D_map_key(*args, **kwargs), shape, level,
+                                             partial(self.model.get_2D_map_in_window, *args, **kwargs))
+
+    def get_render_level(self, graphics_view):
+        """pyramid level of the model matching the zoom of graphics_view"""
+        return min(graphics_view.get_render_level(self.model.get_num_pyramid_levels()),
+                   self.model.get_num_pyramid_levels())
+
+    def update_scene_levels(self):
+        """re-render the views whose zoom needs another pyramid level, the others render the tiles come into sight"""
+        for view, graphics_view in [('a', self.aGraphicsView), ('s', self.sGraphicsView), ('c', self.cGraphicsView)]:
+            level = self.get_render_level(graphics_view)
+            if level != graphics_view.get_img_level('raw') or level != graphics_view.get_img_level('anno'):
+                self.update_scenes(view)
+            else:
+                graphics_view.update_tiles()
+
+    @traced()
+    def update_anno_scenes_in_bbox(self, bbox):
+        """re-render only the part of the anno maps covered by bbox [[d0, d1], [h0, h1], [w0, w1]] (closed interval).
+        views whose slice does not pass through bbox are skipped"""
+        if not self.model.is_valid():
+            return
+        for view, graphics_view in [('a', self.aGraphicsView), ('s', self.sGraphicsView), ('c', self.cGraphicsView)]:
+            index = self.focus_point[VIEW_AXIS[view]]
+            level = graphics_view.get_img_level('anno')
+            region = self.model.get_2D_map_region(view, index, bbox, level)
+            if region is None:
+                continue
+            args = (view, index, 'anno')
+            kwargs = {'colored_anno': True, 'alpha': self.label_opacity / 100, 'level': level}
+            graphics_view.update_img_region('anno', self.model.get_2D_map_key(*args, **kwargs), region,
+                                            partial(self.model.get_2D_map_in_window, *args, **kwargs))
 
     def update_anno_targets_list(self):
-        self.model.compute_img_stats('anno')
-        self.targetList.clear()
-        num_labels = self.model.get_anno_num_labels()
-        for i_label in range(1, num_labels + 1):
-            # create icon
-            pixmap = QPixmap(100, 100)
-            pixmap.fill(self.model.label_colors[i_label - 1])
-            icon = QIcon(pixmap)
-            # items
-            target_centers = self.model.get_anno_target_centers_for_label(i_label)  # [n, (d, h, w)]
-            target_ids = self.model.get_anno_target_ids()
-            for i_centers in range(len(target_centers)):
-                item = QListWidgetItem('[Label_%d] #%d' % (i_label, i_centers + 1))
-                item.setIcon(icon)
-                item.target_id = target_ids[i_centers]
-                item.target_label = i_label
-                self.targetList.addItem(item)
+        self.model.update_anno_stats()
+        self.target_list_model.set_targets(self.model.get_anno_target_ids(), self.model.get_anno_target_labels(),
+                                           self.model.get_anno_target_voxel_counts())
+        self.update_target_label_filter()
+
+    def update_target_label_filter(self):
+        """labels of the label filter are the labels of the listed targets, the chosen one is kept if listed"""
+        label_filter = self.targetLabelFilterComboBox.currentData()
+        labels = self.target_list_model.get_labels()
+        self.targetLabelFilterComboBox.blockSignals(True)
+        self.targetLabelFilterComboBox.clear()
+        self.targetLabelFilterComboBox.addItem('All labels', 0)
+        for label in labels:
+            self.targetLabelFilterComboBox.addItem(self.target_list_model.get_icon(label), 'Label_%d' % label, label)
+        self.targetLabelFilterComboBox.setCurrentIndex(labels.index(label_filter) + 1 if label_filter in labels else 0)
+        self.targetLabelFilterComboBox.blockSignals(False)
+        if self.targetLabelFilterComboBox.currentData() != label_filter:
+            self.on_target_list_view_changed()
 
     def init_views(self):
         """after new file loaded"""
@@ -115,9 +156,15 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.aGraphicsView.init_view(self.model.get_size())
         self.sGraphicsView.init_view(self.model.get_size())
         self.cGraphicsView.init_view(self.model.get_size())
+        self.update_scene_levels()
         self.xSpinBox.setMaximum(self.model.get_size()[0])
         self.ySpinBox.setMaximum(self.model.get_size()[1])
         self.zSpinBox.setMaximum(self.model.get_size()[2])
+        value_min, value_max = self.model.get_voxel_value_bound()
+        for spin_box in [self.windowLevelSpinBox, self.windowBottomSpinBox, self.windowTopspinBox]:
+            spin_box.setRange(min(-10000, math.floor(value_min)), max(10000, math.ceil(value_max)))
+        self.windowWidthSpinBox.setMaximum(max(10000, math.ceil(value_max - value_min)))
+        self.set_hu_window(self.window_bottom, self.window_top, update=False)  # values clamped by the old ranges
         self.lineEditImageName.setText(self.model.get_img_filepath('raw'))
         self.lineEditAnnotationName.setText(self.model.get_img_filepath('anno'))
         self.lineEditImageSize.setText(
@@ -142,7 +189,8 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.lineEditImageSize.setText('(0, 0, 0)')
         for i in range(self.valueUnderCursorList.count()):
             self.valueUnderCursorList.item(0).setText('')
-        self.targetList.clear()
+        self.target_list_model.set_targets()
+        self.update_target_label_filter()
         self.operation_mode = self.OpMode.CURSOR
         self.opModeTab.setCurrentIndex(0)
         self.brushSizeSpinBox.setValue(5)
@@ -164,10 +212,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             if mode == self.OpMode.CURSOR:
                 self.set_brush_stats_signal.emit(BRUSH_TYPE_NO_BRUSH, 5)
             if mode == self.OpMode.BRUSH:
-                if self.circleRadioButton.isChecked():
-                    self.set_brush_stats_signal.emit(BRUSH_TYPE_CIRCLE_BRUSH, self.brushSizeSlider.value())
-                elif self.rectRadioButton.isChecked():
-                    self.set_brush_stats_signal.emit(BRUSH_TYPE_RECT_BRUSH, self.brushSizeSlider.value())
+                self.set_brush_stats_signal.emit(self.get_checked_brush_type(), self.brushSizeSlider.value())
             self._operation_mode = mode
 
     @property
@@ -195,6 +240,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             scenes += 's'
         if new_focus_point[1] != self._focus_point[1]:
             scenes += 'c'
+        old_focus_point = self._focus_point
         self._focus_point = new_focus_point
 
         # ui
@@ -206,6 +252,14 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             'annotation:\t%d' % self.model.get_voxel_value_at_point(self.focus_point, 'anno'))
         self.set_cross_bar_signal.emit(new_focus_point[0], new_focus_point[1], new_focus_point[2])
         self.update_scenes(scenes)
+        if len(scenes) == 1:
+            # scrolling through one view, render the next slices in the same direction in background
+            axis = VIEW_AXIS[scenes]
+            step = 1 if new_focus_point[axis] > old_focus_point[axis] else -1
+            graphics_view = {'a': self.aGraphicsView, 's': self.sGraphicsView, 'c': self.cGraphicsView}[scenes]
+            self.model.prefetch_2D_maps(scenes, new_focus_point[axis], step, PREFETCH_NUM_SLICES,
+                                        low_bound=self.window_bottom, up_bound=self.window_top,
+                                        alpha=self.label_opacity / 100, level=graphics_view.get_img_level('raw'))
 
     @property
     def label_opacity(self):
@@ -243,6 +297,39 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.windowBottomSpinBox.setValue(self.window_bottom)
         self.windowTopspinBox.setValue(self.window_top)
 
+    def set_hu_window(self, bottom, top, update=True):
+        """set both bounds with a single scene update, or none if not update"""
+        if bottom >= top:
+            return
+        self._hu_window = [bottom, top]
+        spin_boxes = [self.windowLevelSpinBox, self.windowWidthSpinBox, self.windowBottomSpinBox,
+                      self.windowTopspinBox]
+        for spin_box in spin_boxes:
+            spin_box.blockSignals(True)
+        self.set_hu_window_ui()
+        for spin_box in spin_boxes:
+            spin_box.blockSignals(False)
+        if update:
+            self.update_scenes('asc', anno=False)
+
+    def get_preset_window(self, index):
+        """(bottom, top) of item index of windowPresetComboBox"""
+        if index == 0:
+            bottom, top = self.model.get_percentile_window(*AUTO_WINDOW_PERCENTILES)
+        elif index == 1:
+            bottom, top = self.model.get_voxel_value_bound()
+        else:
+            _, level, width = CT_WINDOW_PRESETS[index - 2]
+            bottom, top = level - width // 2, level - width // 2 + width
+        bottom, top = math.floor(bottom), math.ceil(top)
+        return bottom, max(top, bottom + 1)
+
+    @pyqtSlot('int')
+    def on_window_preset_activated(self, index):
+        if not self.model.is_valid():
+            return
+        self.set_hu_window(*self.get_preset_window(index))
+
     @window_bottom.setter
     def window_bottom(self, bottom):
         if bottom < self.window_top:
@@ -278,6 +365,19 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.aGraphicsView.scale(scale_x, scale_y)
         self.sGraphicsView.scale(scale_x, scale_y)
         self.cGraphicsView.scale(scale_x, scale_y)
+        self.update_scene_levels()
+
+    @pyqtSlot('int', 'int')
+    def adjust_window(self, delta_x, delta_y):
+        """window/level drag like ITK-SNAP: moving right widens the window, moving up lowers the level"""
+        if not self.model.is_valid():
+            return
+        value_min, value_max = self.model.get_voxel_value_bound()
+        step = max((int(value_max) - int(value_min)) / 1000, 1)
+        width = max(self.window_width + round(delta_x * step), 1)
+        level = self.window_level + round(delta_y * step)
+        bottom = level - width // 2
+        self.set_hu_window(bottom, bottom + width)
 
     @pyqtSlot('int')
     def on_label_opacity_spin_box_changed(self, value):
@@ -331,18 +431,209 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         else:
             img_type = 'raw'
 
+        if self._load_thread is not None:
+            self.statusbar.showMessage('Still loading, please wait', 3000)
+            return
+        self.load_img(filename, img_type)
+
+    def load_img(self, filename, img_type, recover=False):
+        """load in background. recover: recover unsaved edits of the last session without asking"""
+        self._load_serial += 1
+        serial = self._load_serial
+        self._load_thread = self.start_worker(
+            lambda progress_callback: self.model.read_img_data(filename, img_type, progress_callback),
+            lambda result: self.on_img_loaded(serial, filename, img_type, result, recover),
+            lambda e: self.on_img_load_failed(serial, e))
+
+    def recover_last_session(self):
+        """at startup, offer to reopen the image whose edits were not saved in the last session"""
+        unsaved_edits = self.model.list_unsaved_edits()
+        if len(unsaved_edits) == 0 or not os.path.exists(unsaved_edits[0]['raw_filepath']):
+            return
+        raw_filepath = unsaved_edits[0]['raw_filepath']
+        reply = QMessageBox.question(
+            self, 'Recover unsaved edits',
+            'The annotation edits of %s were not saved in the last session.\nOpen the image and recover them?'
+            % raw_filepath, QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+        if reply == QMessageBox.Yes:
+            self.load_img(raw_filepath, 'raw', recover=True)
+
+    def start_worker(self, fn, result_slot, error_slot):
+        """run fn(progress_callback) in a WorkerThread reporting to the progress bar"""
+        thread = WorkerThread(fn, self)
+        thread.progress_signal.connect(self.show_progress)
+        thread.result_signal.connect(result_slot)
+        thread.error_signal.connect(error_slot)
+        thread.finished.connect(lambda: self.on_worker_finished(thread))
+        self._worker_threads.append(thread)
+        thread.start()
+        return thread
+
+    def on_worker_finished(self, thread):
+        self._worker_threads.remove(thread)
+        if thread is self._load_thread:
+            self._load_thread = None
+        if thread is self._save_thread:
+            self._save_thread = None
+        if len(self._worker_threads) == 0:
+            self.hide_progress()
+        thread.deleteLater()
+
+    @pyqtSlot('int', 'QString')
+    def show_progress(self, percent, message=''):
+        """percent None shows a busy progress bar"""
+        if percent is None:
+            self.progress_bar.setRange(0, 0)
+        else:
+            self.progress_bar.setRange(0, 100)
+            self.progress_bar.setValue(percent)
+        self.progress_bar.setVisible(True)
+        self.statusbar.showMessage(message)
+        self._progress_message = message
+
+    def hide_progress(self):
+        """messages shown after the progress are kept"""
+        self.progress_bar.setVisible(False)
+        if self.statusbar.currentMessage() == self._progress_message:
+            self.statusbar.clearMessage()
+
+    def on_img_loaded(self, serial, filename, img_type, result, recover=False):
+        """show the slices at once, target stats are computed afterwards in background"""
+        if serial != self._load_serial:
+            return
+        img, img_info = result
+        if img_type == 'raw':
+            self.store_session_view()
+            self.clear_views()
+            self.model.set_img(filename, img_type, img, img_info)
+            view_state = self.model.get_session_view()
+            # images opened before get their last window, other CT images keep the window of the last CT image,
+            # MR and PET images start with the auto window
+            if view_state is not None:
+                self.windowPresetComboBox.setCurrentIndex(-1)
+                self.set_hu_window(*view_state['window'], update=False)
+                self._ct_window = self.model.looks_like_ct()
+            elif not self.model.looks_like_ct():
+                self.windowPresetComboBox.setCurrentIndex(0)
+                self.set_hu_window(*self.get_preset_window(0), update=False)
+                self._ct_window = False
+            elif not self._ct_window:
+                self.windowPresetComboBox.setCurrentIndex(-1)
+                self.set_hu_window(*DEFAULT_HU_WINDOW, update=False)
+                self._ct_window = True
+            self.init_views()
+            self.focus_point = [item // 2 for item in self.model.get_size()]
+            if view_state is not None:
+                self.restore_session_view(view_state)
+            # zoomed out views of large images show downsampled levels once they are built
+            self.start_worker(lambda progress_callback: self.model.build_raw_pyramid(filename, img, progress_callback),
+                              lambda levels: self.on_raw_pyramid_built(img, levels),
+                              lambda e: self.on_raw_pyramid_failed(filename, e))
+            unsaved_edits = self.model.get_unsaved_edits_info()
+            if unsaved_edits is not None:
+                if not recover:
+                    reply = QMessageBox.question(
+                        self, 'Recover unsaved edits',
+                        'There are unsaved annotation edits of this image from the last session.\n'
+                        'Recover them? Otherwise they are discarded.',
+                        QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+                    recover = reply == QMessageBox.Yes
+                if not recover:
+                    self.model.discard_unsaved_edits()
+                elif unsaved_edits['base_filepath'] is not None:
+                    # edits of an annotation file, load it first
+                    if os.path.exists(unsaved_edits['base_filepath']):
+                        self.load_img(unsaved_edits['base_filepath'], 'anno', recover=True)
+                        return
+                    QMessageBox.warning(self, 'Failed to recover!', 'The annotation file %s does not exist!'
+                                        % unsaved_edits['base_filepath'])
+                    self.model.discard_unsaved_edits()
+                else:
+                    self.recover_unsaved_edits()
+        if img_type == 'anno':
+            view_states = self.get_view_states()  # the annotation is shown where the raw image is
+            self.model.set_img(filename, img_type, img, img_info)
+            if recover:
+                self.recover_unsaved_edits()
+            self.init_views()
+            self.set_view_states(view_states)
+        anno_img, session_key = self.model.get_anno_stats_job()
+        self.start_worker(lambda progress_callback: self.model.load_anno_stats(anno_img, session_key),
+                          lambda anno_stats: self.on_anno_stats_computed(serial, anno_stats),
+                          lambda e: self.on_img_load_failed(serial, e))
+        self.show_progress(None, 'Computing target statistics')
+
+    def get_view_states(self):
+        """zoom and center of the views, see set_view_states"""
+        return {view: graphics_view.get_view_state() for view, graphics_view in
+                [('a', self.aGraphicsView), ('s', self.sGraphicsView), ('c', self.cGraphicsView)]}
+
+    def set_view_states(self, view_states):
+        """zoom and center of get_view_states, after init_views"""
+        for view, graphics_view in [('a', self.aGraphicsView), ('s', self.sGraphicsView), ('c', self.cGraphicsView)]:
+            graphics_view.set_view_state(view_states[view])
+        self.update_scene_levels()
+
+    def store_session_view(self):
+        """keep the view of the raw image, restored when it is opened again unchanged"""
+        if not self.model.is_valid():
+            return
+        self.model.store_session_view({
+            'focus_point': self.focus_point,
+            'window': [self.window_bottom, self.window_top],
+            'label_opacity': self.label_opacity,
+            'views': self.get_view_states()
+        })
+
+    def restore_session_view(self, view_state):
+        """focus point, label opacity and zoom of view_state of store_session_view, after init_views"""
+        self.set_view_states(view_state['views'])
+        self.focus_point = view_state['focus_point']
+        self.label_opacity = view_state['label_opacity']
+
+    def on_raw_pyramid_built(self, img, levels):
+        """annotations loaded meanwhile keep the levels, they are dropped if the raw image has changed"""
+        if len(levels) > 0 and self.model.set_raw_pyramid(img, levels):
+            self.update_scene_levels()
+
+    def on_raw_pyramid_failed(self, filename, e):
+        """full resolution is still shown"""
+        if filename == self.model.get_img_filepath('raw'):
+            self.statusbar.showMessage('Failed to build the downsampled image: %s' % e, 5000)
+
+    def recover_unsaved_edits(self):
         try:
-            if img_type == 'raw':
-                self.clear_views()
-                self.model.read_img(filename, img_type)
-                self.init_views()
-                self.focus_point = [item // 2 for item in self.model.get_size()]
-            if img_type == 'anno':
-                self.model.read_img(filename, img_type)
-                self.init_views()
-        except ImageTypeError as e:
+            num_edits = self.model.recover_unsaved_edits()
+        except JournalError as e:
+            QMessageBox.warning(self, 'Failed to recover!', e.__str__())
+            self.model.discard_unsaved_edits()
+            return
+        self.update_scenes('asc', raw=False)
+        self.statusbar.showMessage('Recovered %d unsaved edits' % num_edits, 5000)
+
+    def on_anno_stats_computed(self, serial, anno_stats):
+        if serial != self._load_serial:
+            return
+        self.model.set_anno_stats(anno_stats)
+        self.update_anno_targets_list()
+
+    def on_img_load_failed(self, serial, e):
+        if serial != self._load_serial:
+            return
+        if isinstance(e, ImageTypeError):
             QMessageBox.warning(self, 'Wrong image type!', e.__str__())
-            self.clear_views()
+        elif isinstance(e, IllegalSizeError):
+            QMessageBox.warning(self, 'Illegal size!', e.__str__())
+        else:
+            QMessageBox.warning(self, 'Failed to open!', e.__str__())
+
+    def closeEvent(self, event):
+        self.store_session_view()
+        self._load_serial += 1
+        for thread in list(self._worker_threads):
+            thread.wait()
+        self.model.sync_journal()
+        super(MainWindow, self).closeEvent(event)
 
     @pyqtSlot()
     def menu_save_triggered(self):
@@ -355,10 +646,30 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
         filename, _ = QFileDialog.getSaveFileName(
             self, 'select where to save the annotation file', default_filename, filter='*.nii.gz')
-        self.model.save_anno(filename)
+        if not filename:
+            return
+        if self._save_thread is not None:
+            self.statusbar.showMessage('Still saving, please wait', 3000)
+            return
+        serial = self._load_serial
+        journal_mark = self.model.get_journal_mark()
+        save_job = self.model.get_anno_save_job(filename)
+        self._save_thread = self.start_worker(
+            lambda progress_callback: Model.write_anno(*save_job, progress_callback=progress_callback),
+            lambda result: self.on_anno_saved(serial, filename, journal_mark),
+            lambda e: QMessageBox.warning(self, 'Failed to save!', e.__str__()))
+
+    def on_anno_saved(self, serial, filename, journal_mark):
+        if serial == self._load_serial:
+            # edits up to the start of saving are in the file now, which write_anno has fsynced. not called if
+            # write_anno raised, then the journal keeps them
+            self.model.compact_journal(filename, journal_mark)
+        self.statusbar.showMessage('Saved %s' % filename, 5000)
 
     @pyqtSlot()
     def menu_close_triggered(self):
+        self.store_session_view()
+        self._load_serial += 1
         self.model.clear()
         self.clear_views()
 
@@ -426,10 +737,12 @@ class MainWindow(QMainWindow, Ui_MainWindow):
                          self.windowTopspinBox]:
             spin_box.blockSignals(False)
 
-    @pyqtSlot('QListWidgetItem*')
-    def on_target_list_item_clicked(self, item):
-        target_centers = self.model.get_anno_target_centers_for_label(item.target_label)
-        d, h, w = target_centers[item.target_id - 1]
+    @pyqtSlot('QModelIndex')
+    def on_target_list_item_clicked(self, index):
+        target_center = self.model.get_anno_target_center(index.data(TARGET_ID_ROLE))
+        if target_center is None:
+            return
+        d, h, w = target_center
         self.set_focus_point(w, h, d)
 
     @pyqtSlot('int')
@@ -439,58 +752,67 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         if current_index == 1:
             self.operation_mode = self.OpMode.BRUSH
 
+    def get_checked_brush_type(self):
+        if self.rectRadioButton.isChecked():
+            return BRUSH_TYPE_RECT_BRUSH
+        if self.cubeRadioButton.isChecked():
+            return BRUSH_TYPE_CUBE_BRUSH
+        if self.sphereRadioButton.isChecked():
+            return BRUSH_TYPE_SPHERE_BRUSH
+        return BRUSH_TYPE_CIRCLE_BRUSH
+
     @pyqtSlot('int')
     def on_brush_size_changed(self, size):
         if self.operation_mode == self.OpMode.CURSOR:
             return
-        if self.circleRadioButton.isChecked():
-            self.set_brush_stats_signal.emit(BRUSH_TYPE_CIRCLE_BRUSH, size)
-        elif self.rectRadioButton.isChecked():
-            self.set_brush_stats_signal.emit(BRUSH_TYPE_RECT_BRUSH, size)
+        self.set_brush_stats_signal.emit(self.get_checked_brush_type(), size)
 
     @pyqtSlot()
     def on_brush_type_clicked(self):
         if self.operation_mode == self.OpMode.CURSOR:
             return
-        size = self.brushSizeSlider.value()
-        if self.circleRadioButton.isChecked():
-            self.set_brush_stats_signal.emit(BRUSH_TYPE_CIRCLE_BRUSH, size)
-        elif self.rectRadioButton.isChecked():
-            self.set_brush_stats_signal.emit(BRUSH_TYPE_RECT_BRUSH, size)
-
-    @pyqtSlot('int', 'int', 'int', 'int', 'int', 'bool', 'bool')
-    def on_paint_on_point(self, x, y, z, brush_type, brush_size, erase, new_step):
+        self.set_brush_stats_signal.emit(self.get_checked_brush_type(), self.brushSizeSlider.value())
+
+    @pyqtSlot('PyQt_PyObject', 'int', 'int', 'bool', 'bool')
+    def on_paint_stroke(self, points, brush_type, brush_size, erase, new_step):
+        """points: polyline [[x, y, z]] on one view, its slice coordinate is bigger than 100000"""
+        x, y, z = points[0]
         if x > 100000:  # bigger than this value means painting axis
             axis = 'x'
-            x = self.focus_point[0]
         if y > 100000:
-            axis = 'xy'
-            y = self.focus_point[1]
+            axis = 'y'
         if z > 100000:
             axis = 'z'
-            z = self.focus_point[2]
+        points = [[self.focus_point[i] if point[i] > 100000 else point[i] for i in range(3)] for point in points]
         label = 1
-        self.model.anno_paint(x, y, z, axis, label, brush_type, brush_size, erase, new_step)
-        self.update_scenes('asc', raw=False)
+        changed_bbox = self.model.anno_paint_stroke(points, axis, label, brush_type, brush_size, erase, new_step)
+        if changed_bbox is not None:
+            self.update_anno_scenes_in_bbox(changed_bbox)
 
     @pyqtSlot()
     def on_refresh_list_button_clicked(self):
         self.update_anno_targets_list()
 
+    @pyqtSlot()
+    def on_target_list_view_changed(self):
+        self.target_list_model.set_view(self.targetLabelFilterComboBox.currentData(),
+                                        self.targetMinSizeSpinBox.value(), self.targetSortComboBox.currentIndex())
+
     @pyqtSlot()
     def on_delete_target_button_clicked(self):
-        selected_target = self.targetList.currentItem()
-        row = self.targetList.currentRow()
-        if selected_target is None:
+        selected_target = self.targetList.currentIndex()
+        if not selected_target.isValid():
             return
-        target_id = selected_target.target_id
+        target_id = selected_target.data(TARGET_ID_ROLE)
         try:
             self.model.delete_target(target_id)
-            self.update_scenes('asc', raw=False)
-            self.targetList.takeItem(row)
-        except ChangeNotSavedError as e:
-            QMessageBox.warning(self, 'Refresh before Delete!', e.__str__())
-        pass
+        except KeyError:
+            QMessageBox.warning(self, 'Target not found!',
+                                'The selected target no longer exists, please select it again!')
+            self.update_anno_targets_list()
+            return
+        self.update_scenes('asc', raw=False)
+        self.target_list_model.remove_target(target_id)
 
     @pyqtSlot()
     def menu_undo_paint_triggered(self):
@@ -508,3 +830,9 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             self.label_opacity = 0
         else:
             self.label_opacity = 50
+
+    @pyqtSlot('bool')
+    def set_frame_time_overlay(self, visible):
+        """show the render times and frames per second of the views over them"""
+        for view in [self.aGraphicsView, self.sGraphicsView, self.cGraphicsView]:
+            view.set_frame_time_overlay(visible)
@@ -0,0 +1,110 @@
+import numpy as np
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex
+from PyQt5.QtGui import QPixmap, QIcon, QColor
+
+TARGET_ID_ROLE = Qt.UserRole
+TARGET_SORT_NAMES = ['Label', 'Size, largest first', 'Size, smallest first']
+TARGET_SORT_BY_LABEL, TARGET_SORT_BY_SIZE_DESCENDING, TARGET_SORT_BY_SIZE_ASCENDING = range(3)
+
+
+class TargetListModel(QAbstractListModel):
+    """Rows of the target list read from the target arrays of the model only when the view shows them, so a
+    refresh builds no item per target. Rows are filtered by label and size and sorted with numpy, and targets of
+    the same color share one icon."""
+
+    def __init__(self, get_label_color, parent=None):
+        """get_label_color(label) is the 0xAARRGGBB color of the icon of label"""
+        super().__init__(parent)
+        self._get_label_color = get_label_color
+        self._icons = {}  # rgba of color to QIcon
+        self._target_ids = np.zeros(0, np.intp)
+        self._target_labels = np.zeros(0, np.intp)
+        self._target_voxel_counts = np.zeros(0, np.intp)
+        self._target_numbers = np.zeros(0, np.intp)  # #number of the target in its label, in order of target ids
+        self._rows = np.zeros(0, np.intp)  # target index of each row
+        self._label_filter = 0  # 0 shows all labels
+        self._min_voxel_count = 0
+        self._sort = TARGET_SORT_BY_LABEL
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._rows):
+            return None
+        target_index = self._rows[index.row()]
+        if role == Qt.DisplayRole:
+            return '[Label_%d] #%d  (%d voxels)' % (self._target_labels[target_index],
+                                                    self._target_numbers[target_index],
+                                                    self._target_voxel_counts[target_index])
+        if role == Qt.DecorationRole:
+            return self.get_icon(int(self._target_labels[target_index]))
+        if role == TARGET_ID_ROLE:
+            return int(self._target_ids[target_index])
+        return None
+
+    def get_icon(self, label):
+        color = self._get_label_color(label)
+        icon = self._icons.get(color)
+        if icon is None:
+            pixmap = QPixmap(100, 100)
+            pixmap.fill(QColor.fromRgba(color))
+            icon = self._icons[color] = QIcon(pixmap)
+        return icon
+
+    def get_labels(self):
+        """labels that have targets, ascending"""
+        return np.unique(self._target_labels).tolist()
+
+    def set_targets(self, target_ids=None, target_labels=None, target_voxel_counts=None):
+        """show targets of the target arrays of the model (None for no target)"""
+        self.beginResetModel()
+        if target_ids is None:
+            target_ids = target_labels = target_voxel_counts = np.zeros(0, np.intp)
+        self._target_ids = np.asarray(target_ids)
+        self._target_labels = np.asarray(target_labels)
+        self._target_voxel_counts = np.asarray(target_voxel_counts)
+        # targets of a label are numbered in order of target ids
+        label_order = np.argsort(self._target_labels, kind='stable')
+        label_starts = np.searchsorted(self._target_labels[label_order], self._target_labels[label_order], 'left')
+        self._target_numbers = np.empty(len(target_ids), np.intp)
+        self._target_numbers[label_order] = np.arange(len(target_ids)) - label_starts + 1
+        self._rows = self._get_rows()
+        self.endResetModel()
+
+    def set_view(self, label_filter=0, min_voxel_count=0, sort=TARGET_SORT_BY_LABEL):
+        """show targets of label_filter (0 for all labels) with at least min_voxel_count voxels, ordered by sort"""
+        self.beginResetModel()
+        self._label_filter = label_filter
+        self._min_voxel_count = min_voxel_count
+        self._sort = sort
+        self._rows = self._get_rows()
+        self.endResetModel()
+
+    def remove_target(self, target_id):
+        """remove the row of a deleted target, other targets keep their numbers"""
+        target_index = np.flatnonzero(self._target_ids == target_id)
+        if len(target_index) == 0:
+            return
+        target_index = target_index[0]
+        row = np.flatnonzero(self._rows == target_index)
+        for k in ['_target_ids', '_target_labels', '_target_voxel_counts', '_target_numbers']:
+            setattr(self, k, np.delete(getattr(self, k), target_index))
+        if len(row) == 0:
+            self._rows[self._rows > target_index] -= 1
+            return
+        self.beginRemoveRows(QModelIndex(), row[0], row[0])
+        self._rows = np.delete(self._rows, row[0])
+        self._rows[self._rows > target_index] -= 1
+        self.endRemoveRows()
+
+    def _get_rows(self):
+        is_shown = self._target_voxel_counts >= self._min_voxel_count
+        if self._label_filter != 0:
+            is_shown &= self._target_labels == self._label_filter
+        shown = np.flatnonzero(is_shown)
+        if self._sort == TARGET_SORT_BY_SIZE_DESCENDING:
+            return shown[np.argsort(-self._target_voxel_counts[shown], kind='stable')]
+        if self._sort == TARGET_SORT_BY_SIZE_ASCENDING:
+            return shown[np.argsort(self._target_voxel_counts[shown], kind='stable')]
+        return shown[np.lexsort((self._target_numbers[shown], self._target_labels[shown]))]
@@ -0,0 +1,22 @@
+from PyQt5.QtCore import QThread, pyqtSignal
+
+
+class WorkerThread(QThread):
+    """Runs fn(progress_callback) out of the GUI thread.
+    progress_callback(percent, message) emits progress_signal, the return value of fn is emitted by result_signal
+    and an exception raised by fn by error_signal. All signals are received in the thread of the connected slots."""
+    progress_signal = pyqtSignal('int', 'QString')
+    result_signal = pyqtSignal('PyQt_PyObject')
+    error_signal = pyqtSignal('PyQt_PyObject')
+
+    def __init__(self, fn, parent=None):
+        super(WorkerThread, self).__init__(parent)
+        self._fn = fn
+
+    def run(self):
+        try:
+            result = self._fn(self.progress_signal.emit)
+        except Exception as e:
+            self.error_signal.emit(e)
+            return
+        self.result_signal.emit(result)
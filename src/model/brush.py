@@ -0,0 +1,117 @@
+from functools import lru_cache
+
+import numpy as np
+
+BRUSH_TYPE_NO_BRUSH = 0
+BRUSH_TYPE_CIRCLE_BRUSH = 1
+BRUSH_TYPE_RECT_BRUSH = 2
+BRUSH_TYPE_SPHERE_BRUSH = 3
+BRUSH_TYPE_CUBE_BRUSH = 4
+PAINT_BRUSH_TYPES = [BRUSH_TYPE_CIRCLE_BRUSH, BRUSH_TYPE_RECT_BRUSH, BRUSH_TYPE_SPHERE_BRUSH, BRUSH_TYPE_CUBE_BRUSH]
+PLANE_BRUSH_TYPES = [BRUSH_TYPE_CIRCLE_BRUSH, BRUSH_TYPE_RECT_BRUSH]  # painted on the current slice only
+ROUND_BRUSH_TYPES = [BRUSH_TYPE_CIRCLE_BRUSH, BRUSH_TYPE_SPHERE_BRUSH]
+STAMP_SUBDIVISIONS = 4  # brush centers are quantized to 1 / STAMP_SUBDIVISIONS voxel
+
+
+def get_brush_extent(brush_type, brush_size, axis_dim):
+    """low and high offsets [d, h, w] of the voxels a brush may cover around its center voxel"""
+    if brush_type in ROUND_BRUSH_TYPES:
+        # the center of a round brush may be half a voxel off its center voxel
+        low = [(brush_size + 1) // 2] * 3
+        high = [(brush_size + 1) // 2] * 3
+    else:
+        low = [brush_size // 2] * 3
+        high = [brush_size - 1 - brush_size // 2] * 3
+    if brush_type in PLANE_BRUSH_TYPES:
+        low[axis_dim] = high[axis_dim] = 0
+    return low, high
+
+
+@lru_cache(maxsize=256)
+def get_brush_stamp(brush_type, brush_size, axis_dim, offset=(0, 0, 0)):
+    """Read-only boolean stamp (d, h, w) covering [center voxel - low, center voxel + high] of get_brush_extent.
+    offset: sub-voxel shift (in multiples of 1 / STAMP_SUBDIVISIONS) of the brush center from its center voxel,
+    round brushes take voxels within brush_size / 2 to the shifted center."""
+    low, high = get_brush_extent(brush_type, brush_size, axis_dim)
+    shape = tuple(low[i] + high[i] + 1 for i in range(3))
+    if brush_type in ROUND_BRUSH_TYPES:
+        coords = np.ogrid[tuple(slice(-low[i], high[i] + 1) for i in range(3))]
+        squared_distance = sum((coords[i] - offset[i]) ** 2 for i in range(3))
+        stamp = 4 * squared_distance <= brush_size ** 2
+    else:
+        stamp = np.ones(shape, bool)
+    stamp.flags.writeable = False
+    return stamp
+
+
+@lru_cache(maxsize=256)
+def get_stamp_rows(brush_type, brush_size, axis_dim, offset=(0, 0, 0)):
+    """Read-only rows [n, 2] (d, h) of the stamp of get_brush_stamp as offsets from its center voxel, and the
+    w offsets [n] of their first voxels and after their last voxels. Every row of a stamp is one run of voxels"""
+    low, _ = get_brush_extent(brush_type, brush_size, axis_dim)
+    stamp = get_brush_stamp(brush_type, brush_size, axis_dim, offset)
+    row_lengths = stamp.sum(axis=2)
+    rows = np.argwhere(row_lengths > 0)
+    row_starts = stamp.argmax(axis=2)[rows[:, 0], rows[:, 1]]
+    rows = (rows - low[:2], row_starts - low[2], row_starts + row_lengths[rows[:, 0], rows[:, 1]] - low[2])
+    for array in rows:
+        array.flags.writeable = False
+    return rows
+
+
+def sweep_brush(shape, segment_starts, segment_ends, brush_type, brush_size, axis_dim):
+    """Boolean mask of shape covered by the brush moved along the segments [n, 3] (d, h, w in mask coordinates).
+    Centers are taken along every segment at most one voxel apart. The cached stamp rows of each distinct sub-voxel
+    offset are placed at all the center voxels of that offset at once as runs of flat mask indices, which are
+    sorted and merged so that every covered voxel is written once."""
+    segment_starts = np.asarray(segment_starts, np.float64)
+    directions = np.asarray(segment_ends, np.float64) - segment_starts
+    num_steps = np.maximum(np.ceil(np.abs(directions).max(axis=1)).astype(np.int64), 1)
+    segment_ids = np.repeat(np.arange(len(num_steps)), num_steps + 1)
+    steps = np.arange(len(segment_ids)) - np.repeat(np.cumsum(num_steps + 1) - (num_steps + 1), num_steps + 1)
+    centers = segment_starts[segment_ids] + (steps / num_steps[segment_ids])[:, np.newaxis] * directions[segment_ids]
+    center_voxels = np.rint(centers).astype(np.int64)
+    if brush_type in ROUND_BRUSH_TYPES:
+        offsets = np.rint((centers - center_voxels) * STAMP_SUBDIVISIONS).astype(np.int64)
+    else:
+        offsets = np.zeros_like(center_voxels)
+    centers = np.unique(np.concatenate([offsets, center_voxels], axis=1), axis=0)  # grouped by offset
+
+    low, high = get_brush_extent(brush_type, brush_size, axis_dim)
+    # centers whose stamp reaches out of the mask, where the runs of their stamps are clipped
+    clipped = np.any(np.logical_or(centers[:, 3:] - low < 0, centers[:, 3:] + high >= shape), axis=1)
+    runs = []  # flat index of the first voxel * (w + 1) + number of voxels
+    group_starts = np.flatnonzero(np.concatenate([[True], np.any(centers[1:, :3] != centers[:-1, :3], axis=1)]))
+    for group_start, group_end in zip(group_starts, np.append(group_starts[1:], len(centers))):
+        offset = tuple(float(o) / STAMP_SUBDIVISIONS for o in centers[group_start, :3])
+        rows, row_starts, row_ends = get_stamp_rows(brush_type, brush_size, axis_dim, offset)
+        group_centers = centers[group_start:group_end, 3:]
+        group_clipped = clipped[group_start:group_end]
+        inner_centers = group_centers[~group_clipped]
+        row_runs = (((rows[:, 0] * shape[1] + rows[:, 1]) * shape[2] + row_starts) * (shape[2] + 1) +
+                    row_ends - row_starts)
+        center_runs = np.ravel_multi_index(inner_centers.T, shape) * (shape[2] + 1)
+        runs.append((center_runs[:, np.newaxis] + row_runs).ravel())
+        if group_clipped.any():
+            clipped_centers = group_centers[group_clipped, np.newaxis]
+            d = (clipped_centers[..., 0] + rows[:, 0]).ravel()
+            h = (clipped_centers[..., 1] + rows[:, 1]).ravel()
+            w_start = np.maximum(clipped_centers[..., 2] + row_starts, 0).ravel()
+            w_end = np.minimum(clipped_centers[..., 2] + row_ends, shape[2]).ravel()
+            inside = (d >= 0) & (d < shape[0]) & (h >= 0) & (h < shape[1]) & (w_start < w_end)
+            flat_starts = (d[inside] * shape[1] + h[inside]) * shape[2] + w_start[inside]
+            runs.append(flat_starts * (shape[2] + 1) + w_end[inside] - w_start[inside])
+    mask = np.zeros(shape, bool)
+    runs = np.sort(np.concatenate(runs))  # by start and then by length
+    if len(runs) == 0:
+        return mask
+    # merge the sorted runs into disjoint ones
+    run_starts = runs // (shape[2] + 1)
+    run_ends = np.maximum.accumulate(run_starts + runs % (shape[2] + 1))
+    is_first = np.concatenate([[True], run_starts[1:] > run_ends[:-1]])
+    is_last = np.append(is_first[1:], True)
+    run_starts = run_starts[is_first]
+    run_lengths = run_ends[is_last] - run_starts
+    voxels = np.arange(run_lengths.sum()) + np.repeat(run_starts - (np.cumsum(run_lengths) - run_lengths), run_lengths)
+    mask.reshape(-1)[voxels] = True
+    return mask
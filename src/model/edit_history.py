@@ -0,0 +1,136 @@
+from collections import deque
+
+import numpy as np
+
+DEFAULT_HISTORY_BUDGET = 512 * 1024 ** 2  # bytes
+
+
+class EditStep:
+    """Voxel changes of one undo step, stored sparsely as flat indices with old and new values.
+    A step may consist of several changes (e.g. every mouse move of one stroke), kept in painting order."""
+
+    def __init__(self):
+        self._changes = []  # [(flat indices, old values, new values)]
+        self.bbox = None  # [[d0, d1], [h0, h1], [w0, w1]] closed interval of all changed voxels
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self._changes)
+
+    def add(self, indices, old_values, new_values, bbox):
+        self._changes.append((indices, old_values, new_values))
+        self.nbytes += indices.nbytes + old_values.nbytes + new_values.nbytes
+        if self.bbox is None:
+            self.bbox = [list(bbox[i]) for i in range(3)]
+        else:
+            self.bbox = [[min(bbox[i][0], self.bbox[i][0]), max(bbox[i][1], self.bbox[i][1])] for i in range(3)]
+
+    def undo(self, img, journal=None):
+        flat_img = img.reshape(-1)
+        assert np.shares_memory(flat_img, img)
+        for indices, old_values, _ in reversed(self._changes):
+            flat_img[indices] = old_values
+            if journal is not None:
+                journal.append(indices, old_values)
+
+    def redo(self, img, journal=None):
+        flat_img = img.reshape(-1)
+        assert np.shares_memory(flat_img, img)
+        for indices, _, new_values in self._changes:
+            flat_img[indices] = new_values
+            if journal is not None:
+                journal.append(indices, new_values)
+
+
+class EditHistory:
+    """Undo/redo history of a label map. Its depth is limited by the memory of the recorded steps
+    (budget_bytes) instead of a fixed number of steps. The newest undo step is always kept.
+    Every change of voxels, including undo and redo, is also appended to journal (EditJournal) if given."""
+
+    def __init__(self, budget_bytes=DEFAULT_HISTORY_BUDGET, journal=None):
+        self._budget_bytes = budget_bytes
+        self.journal = journal
+        self._undo_stack = deque()
+        self._redo_stack = deque()
+        self._nbytes = 0
+
+    @property
+    def budget_bytes(self):
+        return self._budget_bytes
+
+    @budget_bytes.setter
+    def budget_bytes(self, budget_bytes):
+        self._budget_bytes = budget_bytes
+        self._enforce_budget()
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def clear(self):
+        self._undo_stack.clear()
+        self._redo_stack.clear()
+        self._nbytes = 0
+
+    def new_step(self):
+        """start a new undo step. redo steps are dropped"""
+        for step in self._redo_stack:
+            self._nbytes -= step.nbytes
+        self._redo_stack.clear()
+        if len(self._undo_stack) == 0 or len(self._undo_stack[-1]) > 0:
+            self._undo_stack.append(EditStep())
+
+    def record(self, indices, old_values, new_values, bbox):
+        """add changed voxels to the current step"""
+        if len(self._undo_stack) == 0:
+            self.new_step()
+        self._undo_stack[-1].add(indices, old_values, new_values, bbox)
+        if self.journal is not None:
+            self.journal.append(indices, new_values)
+        self._nbytes += indices.nbytes + old_values.nbytes + new_values.nbytes
+        self._enforce_budget()
+
+    def record_region(self, img_shape, region_bbox, old_region, new_region):
+        """add the voxels of region that differ between old_region and new_region to the current step.
+        region_bbox: [[d0, d1], [h0, h1], [w0, w1]] closed interval of the region in an image of img_shape"""
+        changed = old_region != new_region
+        return self.record_mask(img_shape, region_bbox, changed, old_region[changed], new_region[changed])
+
+    def record_mask(self, img_shape, region_bbox, changed, old_values, new_values):
+        """add the voxels of region where changed is True to the current step, with their old and new values in
+        the order of changed.nonzero(). return the bbox of changed voxels or None if there is none"""
+        local_coords = np.nonzero(changed)
+        if len(local_coords[0]) == 0:
+            return None
+        coords = tuple(local_coords[i] + region_bbox[i][0] for i in range(3))
+        index_dtype = np.uint32 if np.prod(img_shape, dtype=np.int64) <= np.iinfo(np.uint32).max else np.int64
+        indices = np.ravel_multi_index(coords, img_shape).astype(index_dtype)
+        bbox = [[int(coords[i].min()), int(coords[i].max())] for i in range(3)]
+        self.record(indices, old_values, new_values, bbox)
+        return bbox
+
+    def undo(self, img):
+        """revert the last step on img in place. return the bbox of reverted voxels or None if nothing to undo"""
+        while len(self._undo_stack) > 0 and len(self._undo_stack[-1]) == 0:
+            self._undo_stack.pop()
+        if len(self._undo_stack) == 0:
+            return None
+        step = self._undo_stack.pop()
+        step.undo(img, self.journal)
+        self._redo_stack.append(step)
+        return step.bbox
+
+    def redo(self, img):
+        """reapply the last undone step on img in place. return the bbox of changed voxels or None"""
+        if len(self._redo_stack) == 0:
+            return None
+        step = self._redo_stack.pop()
+        step.redo(img, self.journal)
+        self._undo_stack.append(step)
+        return step.bbox
+
+    def _enforce_budget(self):
+        while self._nbytes > self._budget_bytes and len(self._redo_stack) > 0:
+            self._nbytes -= self._redo_stack.popleft().nbytes
+        while self._nbytes > self._budget_bytes and len(self._undo_stack) > 1:
+            self._nbytes -= self._undo_stack.popleft().nbytes
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+
+from utils.cache_utils import get_cache_dir
+from utils.exception_utils import JournalError
+from utils.file_utils import fsync_dir
+
+JOURNAL_MAGIC = b'MLJ1'
+RECORD_HEADER = struct.Struct('<II')  # compressed payload bytes, crc32 of compressed payload
+INDEX_DTYPES = {b'I': np.uint32, b'q': np.int64}
+
+
+def get_file_stamp(filepath):
+    """[size, mtime_ns] of filepath, None if it does not exist"""
+    if filepath is None or not os.path.exists(filepath):
+        return None
+    stat = os.stat(filepath)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class EditJournal:
+    """Append-only journal of the label map edits of one raw image, for recovery after a crash.
+    Every change of voxels (painting, deleting targets, undo and redo) is appended as the flat indices and new
+    values of the changed voxels, so replaying all records in order onto the base annotation (the annotation
+    file the edits started from, or an empty label map) restores the label map.
+    Records are written to the file at once and fsynced by sync, which is meant to be called at short intervals.
+    The journal file is created at the first record, so opening images without editing leaves no journal."""
+
+    def __init__(self, journal_dir=None):
+        self.journal_dir = get_cache_dir('journals') if journal_dir is None else journal_dir
+        self._header = None  # raw_filepath, raw_stamp, base_filepath, base_stamp, shape, time
+        self._file = None
+        self._synced = True
+        self._created = False  # the journal file is new, its directory entry is not fsynced yet
+
+    @staticmethod
+    def get_journal_filepath(journal_dir, raw_filepath):
+        name = hashlib.sha1(os.path.abspath(raw_filepath).encode('utf-8')).hexdigest()
+        return os.path.join(journal_dir, name + '.journal')
+
+    @staticmethod
+    def list_journals(journal_dir=None):
+        """headers of all journals in journal_dir, the latest modified first"""
+        if journal_dir is None:
+            journal_dir = get_cache_dir('journals')
+        if not os.path.isdir(journal_dir):
+            return []
+        headers = []
+        for filename in os.listdir(journal_dir):
+            if not filename.endswith('.journal'):
+                continue
+            filepath = os.path.join(journal_dir, filename)
+            header = EditJournal.read_header(filepath)
+            if header is not None:
+                header['modified_time'] = os.path.getmtime(filepath)
+                headers.append(header)
+        return sorted(headers, key=lambda header: -header['modified_time'])
+
+    @staticmethod
+    def read_header(filepath):
+        """header dict of a journal file, None if it is missing, broken or has no record"""
+        try:
+            with open(filepath, 'rb') as f:
+                header, header_end = EditJournal._read_header(f)
+                if header is None or os.path.getsize(filepath) <= header_end:
+                    return None
+                return header
+        except OSError:
+            return None
+
+    @staticmethod
+    def _read_header(f):
+        if f.read(len(JOURNAL_MAGIC)) != JOURNAL_MAGIC:
+            return None, 0
+        header_size_bytes = f.read(4)
+        if len(header_size_bytes) < 4:
+            return None, 0
+        header_size = struct.unpack('<I', header_size_bytes)[0]
+        try:
+            header = json.loads(f.read(header_size).decode('utf-8'))
+        except ValueError:
+            return None, 0
+        return header, len(JOURNAL_MAGIC) + 4 + header_size
+
+    @property
+    def filepath(self):
+        if self._header is None:
+            return None
+        return EditJournal.get_journal_filepath(self.journal_dir, self._header['raw_filepath'])
+
+    def start(self, raw_filepath, base_filepath, shape):
+        """journal the edits of raw image from base annotation file (None means an empty label map).
+        An old journal of the raw image is kept till the first record, so that it can still be replayed"""
+        self.close()
+        self._header = {
+            'raw_filepath': os.path.abspath(raw_filepath),
+            'raw_stamp': get_file_stamp(raw_filepath),
+            'base_filepath': None if base_filepath is None else os.path.abspath(base_filepath),
+            'base_stamp': get_file_stamp(base_filepath),
+            'shape': list(shape)
+        }
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+        self._header = None
+
+    def discard(self):
+        """remove the journal file of the current raw image"""
+        filepath = self.filepath
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if filepath is not None and os.path.exists(filepath):
+            os.remove(filepath)
+
+    def append(self, indices, values):
+        """add the new values of voxels at flat indices"""
+        if self._header is None:
+            return
+        if self._file is None:
+            self._file = self._create_file(self.filepath, self._header)
+            self._created = True
+        index_dtype = b'I' if indices.dtype == np.uint32 else b'q'
+        indices = indices.astype(INDEX_DTYPES[index_dtype], copy=False)
+        payload = index_dtype + struct.pack('<Q', len(indices)) + indices.tobytes() + \
+            values.astype(np.int8, copy=False).tobytes()
+        payload = zlib.compress(payload, 1)
+        self._file.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        self._file.flush()  # in the OS at once, so that only a system crash before the next sync loses it
+        self._synced = False
+
+    def sync(self):
+        if self._file is not None and not self._synced:
+            os.fsync(self._file.fileno())
+            if self._created:
+                fsync_dir(self.journal_dir)
+                self._created = False
+            self._synced = True
+
+    def mark(self):
+        """position of the next record, see compact"""
+        if self._file is None:
+            return None
+        return self._file.tell()
+
+    def compact(self, base_filepath, mark):
+        """base annotation has been saved to base_filepath with the edits before mark. keep only the later ones"""
+        if self._header is None:
+            return
+        header = dict(self._header)
+        header['base_filepath'] = os.path.abspath(base_filepath)
+        header['base_stamp'] = get_file_stamp(base_filepath)
+        if self._file is None:
+            self._header = header
+            return
+        self._file.flush()
+        filepath = self.filepath
+        with open(filepath, 'rb') as f:
+            if mark is None:  # no record before
+                _, mark = EditJournal._read_header(f)
+            f.seek(mark)
+            tail = f.read()
+        self._file.close()
+        self._file = None
+        self._header = header
+        if len(tail) == 0:
+            os.remove(filepath)
+            return
+        tmp_filepath = filepath + '.tmp'
+        with self._create_file(tmp_filepath, header) as f:
+            f.write(tail)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filepath, filepath)
+        fsync_dir(os.path.dirname(filepath))
+        self._file = open(filepath, 'ab')
+
+    def replay(self, img):
+        """Apply the records of the existing journal of the current raw image to img (the base annotation), and
+        continue journaling after them. A broken record at the end (interrupted writing) is dropped.
+        raise JournalError if the header is broken or the base annotation has changed.
+        return the number of replayed records"""
+        filepath = self.filepath
+        with open(filepath, 'rb') as f:
+            header, header_end = EditJournal._read_header(f)
+            if header is None:
+                raise JournalError('The unsaved annotation edits are broken and can not be recovered!')
+            if header['shape'] != list(img.shape) or header['base_filepath'] != self._header['base_filepath'] or \
+                    header['base_stamp'] != self._header['base_stamp']:
+                raise JournalError('The annotation file has been changed after the unsaved annotation edits, '
+                                   'they can not be recovered!')
+            flat_img = img.reshape(-1)
+            assert np.shares_memory(flat_img, img)
+            num_records = 0
+            valid_end = header_end
+            while True:
+                record_header = f.read(RECORD_HEADER.size)
+                if len(record_header) < RECORD_HEADER.size:
+                    break
+                payload_size, crc = RECORD_HEADER.unpack(record_header)
+                payload = f.read(payload_size)
+                if len(payload) < payload_size or zlib.crc32(payload) != crc:
+                    break
+                payload = zlib.decompress(payload)
+                index_dtype = INDEX_DTYPES[payload[:1]]
+                num_voxels = struct.unpack('<Q', payload[1:9])[0]
+                indices_end = 9 + num_voxels * np.dtype(index_dtype).itemsize
+                indices = np.frombuffer(payload[9:indices_end], index_dtype)
+                flat_img[indices] = np.frombuffer(payload[indices_end:], np.int8)
+                num_records += 1
+                valid_end = f.tell()
+        self._header = header
+        self._file = open(filepath, 'r+b')
+        self._file.truncate(valid_end)
+        self._file.seek(valid_end)
+        return num_records
+
+    @staticmethod
+    def _create_file(filepath, header):
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        header = dict(header, time=time.time())
+        header_bytes = json.dumps(header).encode('utf-8')
+        f = open(filepath, 'wb')
+        f.write(JOURNAL_MAGIC + struct.pack('<I', len(header_bytes)) + header_bytes)
+        f.flush()
+        return f
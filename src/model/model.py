@@ -1,194 +1,769 @@
 import os
-from collections import deque
+import threading
+from collections import OrderedDict
 
-import SimpleITK as sitk
-import cc3d
 import numpy as np
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QColor
 
-from controller.graphics_view_controller import BRUSH_TYPE_NO_BRUSH, BRUSH_TYPE_RECT_BRUSH, BRUSH_TYPE_CIRCLE_BRUSH
-from utils.exception_utils import IllegalSizeError, ImageTypeError, ChangeNotSavedError
+from model.brush import BRUSH_TYPE_NO_BRUSH, get_brush_extent, sweep_brush
+from model.edit_history import EditHistory, DEFAULT_HISTORY_BUDGET
+from model.edit_journal import EditJournal
+from model.session_cache import SessionCache
+from model.slice_cache import SliceCache, SlicePrefetcher, DEFAULT_SLICE_CACHE_BUDGET
+from model.volume_cache import VolumeCache, set_img_info
+from utils.exception_utils import IllegalSizeError, ImageTypeError
+from utils.file_utils import fsync_dir, fsync_file
+from utils.gzip_utils import parallel_gzip_file
+from utils.trace_utils import traced
+
+VIEW_AXIS = {'a': 2, 's': 0, 'c': 1}  # view to its slice axis in x, y, z
+HISTOGRAM_NUM_SAMPLES = 2 ** 20  # voxels sampled on a regular grid for the intensity histogram
+HISTOGRAM_MAX_BINS = 4096
+PYRAMID_MIN_SIDE = 256  # no more pyramid levels once the longest side of a level would be shorter
+MAX_LABEL = 50  # label maps have labels 0 (background) to MAX_LABEL
+ANNO_STATS_ARRAYS = ['target_ids', 'target_labels', 'target_centers', 'target_voxel_counts', 'target_bboxes',
+                     'target_id_map']
+
+
+def warm_up_imports():
+    """SimpleITK and cc3d take long to import, so they are imported on first use and the window shows before
+    them. Importing them here in a background thread once the window shows makes the first use fast"""
+    import SimpleITK  # noqa: F401
+    import cc3d  # noqa: F401
 
 
 class Model:
-    def __init__(self):
-        self._raw_img = None
-        self._anno_img = None
+    def __init__(self, history_budget=DEFAULT_HISTORY_BUDGET, slice_cache_budget=DEFAULT_SLICE_CACHE_BUDGET,
+                 volume_cache=None, edit_journal=None, session_cache=None):
+        """history_budget: max bytes of undo/redo history
+        slice_cache_budget: max bytes of rendered 2D maps kept for scrolling
+        volume_cache: VolumeCache of decompressed images, default one in get_cache_dir('volumes') if None
+        edit_journal: EditJournal of unsaved edits, default one in get_cache_dir('journals') if None
+        session_cache: SessionCache of stats and view states, default one in get_cache_dir('sessions') if None"""
+        self._raw_img = None  # d, h, w. may be a read-only memory map
+        self._raw_pyramid = []  # raw image downsampled by 2 ** k at [k - 1], see build_raw_pyramid
+        self._img_info = None  # geometry of raw image, see get_img_info. anno image shares it
         self._anno_img_edit = None  # d, h, w
-        self._anno_img_edit_undo_stack = deque(maxlen=5)
-        self._anno_img_edit_redo_stack = deque(maxlen=5)
+        self._volume_cache = VolumeCache() if volume_cache is None else volume_cache
+        self._edit_journal = EditJournal() if edit_journal is None else edit_journal
+        self._session_cache = SessionCache() if session_cache is None else session_cache
+        self._anno_img_edit_history = EditHistory(history_budget, self._edit_journal)
         self._raw_img_filepath = None
         self._anno_img_filepath = None
+        self._raw_session_key = None  # session cache key of the raw image file
+        # session cache key of the annotation file till target stats are taken for it, see get_anno_stats_job
+        self._anno_session_key = None
         self.last_read_dir = os.getcwd()
         self.last_save_dir = os.getcwd()
 
-        self.label_colors = [QColor(Qt.red), QColor(Qt.green), QColor(Qt.yellow), QColor(Qt.magenta), QColor(Qt.blue)]
+        # 0xAARRGGBB of red, green, yellow, magenta and blue
+        self.label_colors = [0xffff0000, 0xff00ff00, 0xffffff00, 0xffff00ff, 0xff0000ff]
+        self._anno_color_lut = None  # [256, 4]
+        self._anno_color_lut_key = None
+        self._window_luts = OrderedDict()  # (low_bound, up_bound, dtype) -> lut
+        self._lut_lock = threading.Lock()  # luts are also built by the prefetch thread
+
+        # rendered 2D maps are cached by (img_version, anno_img_version, view, index, render args)
+        self._img_version = 0  # increased when images are loaded or cleared
+        self._anno_img_edit_version = 0  # increased when voxels of _anno_img_edit change
+        self._slice_cache = SliceCache(slice_cache_budget)
+        self._slice_prefetcher = SlicePrefetcher(self._render_2D_map_for_cache, self._slice_cache)
 
         self._raw_img_stats = {
             'min_val': None,
-            'max_val': None
+            'max_val': None,
+            'histogram': None  # see compute_histogram
         }
         self._anno_img_stats = {
             'num_positive_labels': None,  # label 0 is background
             'target_ids': None,  # [n_target]. target id in target_id_map
             'target_labels': None,  # [n_targets]. order of target_ids.
-            'target_centers': None,  # [n_targets]. order of target_ids.
-            'target_id_map': None  # [d, h, w]
+            'target_centers': None,  # [n_targets, 3]. (d, h, w), order of target_ids.
+            'target_voxel_counts': None,  # [n_targets]. order of target_ids.
+            'target_bboxes': None,  # [n_targets, 3, 2]. (d, h, w) closed interval, order of target_ids.
+            'target_id_map': None,  # [d, h, w]
+            'max_target_id': None  # largest target id ever assigned in target_id_map. ids are never reused
         }
-        self._anno_img_edit_change_flag = False
+        self._anno_img_edit_dirty_bbox = None  # [[d0, d1], [h0, h1], [w0, w1]] closed interval. not in target stats
 
     def clear(self):
+        self._slice_prefetcher.cancel()
+        self._slice_cache.clear()
+        self._img_version += 1
         self._raw_img = None
-        self._anno_img = None
+        self._raw_pyramid = []
+        self._img_info = None
         self._anno_img_edit = None
-        self._anno_img_edit_undo_stack.clear()
-        self._anno_img_edit_redo_stack.clear()
+        self._anno_img_edit_history.clear()
+        self._edit_journal.close()
         self._raw_img_filepath = None
         self._anno_img_filepath = None
+        self._raw_session_key = None
+        self._anno_session_key = None
 
         self._raw_img_stats = {
             'min_val': None,
-            'max_val': None
+            'max_val': None,
+            'histogram': None  # see compute_histogram
         }
         self._anno_img_stats = {
             'num_positive_labels': None,  # label 0 is background
             'target_ids': None,  # [n_target]. target id in target_id_map
             'target_labels': None,  # [n_targets]. order of target_ids.
-            'target_centers': None,  # [n_targets]. order of target_ids.
-            'target_id_map': None  # [d, h, w]
+            'target_centers': None,  # [n_targets, 3]. (d, h, w), order of target_ids.
+            'target_voxel_counts': None,  # [n_targets]. order of target_ids.
+            'target_bboxes': None,  # [n_targets, 3, 2]. (d, h, w) closed interval, order of target_ids.
+            'target_id_map': None,  # [d, h, w]
+            'max_target_id': None  # largest target id ever assigned in target_id_map. ids are never reused
         }
-        self._anno_img_edit_change_flag = False
+        self._anno_img_edit_dirty_bbox = None  # [[d0, d1], [h0, h1], [w0, w1]] closed interval. not in target stats
 
     def read_img(self, filepath, img_type):
+        self.set_img(filepath, img_type, *self.read_img_data(filepath, img_type))
+        self.compute_img_stats('anno')
+
+    @traced()
+    def read_img_data(self, filepath, img_type, progress_callback=None):
+        """Read and check voxels of filepath without changing the model, so it may run in a worker thread.
+        progress_callback(percent, message) is called between the steps.
+        return (img, img_info with the session cache key of the file) to be passed to set_img"""
         assert img_type in ['raw', 'anno']
         if not os.path.exists(filepath):
             raise FileNotFoundError('%s do not exist' % filepath)
+        if progress_callback is not None:
+            progress_callback(0, 'Reading %s' % os.path.basename(filepath))
+        # the label map is allocated once as int8, the checks below use min_val and max_val of the file voxels
+        img, img_info = self._volume_cache.read_img(filepath, np.int8 if img_type == 'anno' else None)
+        img_info['session_key'] = self._session_cache.get_key(filepath)
+        if img_type == 'raw' and 'histogram' not in img_info:
+            # kept with the view of the last session if the volume is not cached
+            raw_stats = self._session_cache.load(img_info['session_key']).get('raw_stats', {})
+            if raw_stats.get('histogram') is not None:
+                img_info['histogram'] = raw_stats['histogram']
+        if img_type == 'raw' and 'histogram' not in img_info:
+            if progress_callback is not None:
+                progress_callback(80, 'Computing histogram of %s' % os.path.basename(filepath))
+            img_info['histogram'] = Model.compute_histogram(img, img_info['min_val'], img_info['max_val'])
+            self._volume_cache.update_info(filepath, histogram=img_info['histogram'])
+        if progress_callback is not None:
+            progress_callback(90, 'Checking %s' % os.path.basename(filepath))
+        if img_type == 'anno':
+            Model.check_anno_img_info(img_info, self._img_info)
+        if progress_callback is not None:
+            progress_callback(100, 'Read %s' % os.path.basename(filepath))
+        return img, img_info
+
+    @staticmethod
+    def check_anno_img_info(img_info, raw_img_info):
+        """raise if img_info (with min_val and max_val) is not of a label map of the raw image of raw_img_info"""
+        if img_info['min_val'] < 0 or img_info['max_val'] > MAX_LABEL:
+            raise ImageTypeError(img_type='raw image', preferred_img_type='anno image')
+        if raw_img_info is None or img_info['size'] != raw_img_info['size']:
+            raise IllegalSizeError(tuple(img_info['size']),
+                                   None if raw_img_info is None else tuple(raw_img_info['size']))
+
+    def set_img(self, filepath, img_type, img, img_info):
+        """use img read by read_img_data. anno target stats are left to compute_img_stats('anno') or
+        set_anno_stats, till then only the number of labels is known"""
+        assert img_type in ['raw', 'anno']
         self.last_read_dir = os.path.dirname(filepath)
+        self._slice_prefetcher.cancel()
+        self._slice_cache.clear()
+        self._img_version += 1
         if img_type == 'raw':
-            self._raw_img = sitk.ReadImage(filepath)
+            self._raw_img, self._img_info = img, img_info
+            self._raw_pyramid = []
             self._raw_img_filepath = filepath
+            self._raw_session_key = img_info.get('session_key')
             self.compute_img_stats('raw')
-            self._anno_img = sitk.Image(self.get_size(), sitk.sitkInt16)
-            self._anno_img.CopyInformation(self._raw_img)
-            self._anno_img_edit = sitk.GetArrayFromImage(self._anno_img).astype(np.int8)
+            self._anno_img_edit = np.zeros(self._raw_img.shape, np.int8)
             self._anno_img_filepath = '[newly created]'
         elif img_type == 'anno':
-            anno_img = sitk.ReadImage(filepath)
-            if sitk.GetArrayViewFromImage(anno_img).min() < 0 or sitk.GetArrayViewFromImage(anno_img).max() > 50:
-                raise ImageTypeError(img_type='raw image', preferred_img_type='anno image')
-            if anno_img.GetSize() != self._raw_img.GetSize():
-                raise IllegalSizeError(anno_img.GetSize(), self._raw_img.GetSize())
+            self._anno_img_edit = img
+            self._anno_img_filepath = filepath
+        self._anno_session_key = img_info.get('session_key') if img_type == 'anno' else None
+        self._edit_journal.start(self._raw_img_filepath, filepath if img_type == 'anno' else None,
+                                 self._anno_img_edit.shape)
+        for k in self._anno_img_stats.keys():
+            self._anno_img_stats[k] = None
+        self._anno_img_stats['num_positive_labels'] = int(img_info['max_val']) if img_type == 'anno' else 0
+        self._anno_img_edit_dirty_bbox = None
+        self._anno_img_edit_history.clear()
+
+    def build_raw_pyramid(self, filepath, img, progress_callback=None):
+        """Downsampled levels of raw image img (d, h, w) read from filepath, each half the size of the former one,
+        without changing the model, so it may run in a worker thread. Levels are kept in the volume cache with
+        the image and read from it if there.
+        return levels to be passed to set_raw_pyramid"""
+        shapes = []
+        shape = img.shape
+        while max(shape) // 2 >= PYRAMID_MIN_SIDE:
+            shape = tuple((n + 1) // 2 for n in shape)
+            shapes.append(shape)
+        levels = []
+        level_img = img
+        for level, shape in enumerate(shapes, 1):
+            if progress_callback is not None:
+                progress_callback(100 * (level - 1) // len(shapes), 'Building pyramid level %d' % level)
+            cached = self._volume_cache.load_level(filepath, level)
+            if cached is not None and cached.shape == shape and cached.dtype == img.dtype:
+                level_img = cached
             else:
-                self._anno_img = anno_img
-                self._anno_img_edit = sitk.GetArrayFromImage(self._anno_img).astype(np.int8)
-                self._anno_img_filepath = filepath
-        self.compute_img_stats('anno')
-        self._anno_img_edit_undo_stack.clear()
-        self._anno_img_edit_redo_stack.clear()
+                level_img = Model.downsample_volume(level_img)
+                if self._volume_cache.store_level(filepath, level, level_img):
+                    # the memory map of the cache instead, whose pages can be dropped by the system
+                    level_img = self._volume_cache.load_level(filepath, level)
+            levels.append(level_img)
+        if progress_callback is not None:
+            progress_callback(100, 'Built %d pyramid levels' % len(levels))
+        return levels
+
+    def set_raw_pyramid(self, img, levels):
+        """use levels built by build_raw_pyramid from img. return False and ignore them if img is no longer the raw
+        image"""
+        if img is not self._raw_img:
+            return False
+        self._raw_pyramid = levels
+        return True
+
+    def get_num_pyramid_levels(self):
+        """number of downsampled levels, besides the full resolution level 0"""
+        return len(self._raw_pyramid)
+
+    @staticmethod
+    def downsample_volume(img):
+        """img (d, h, w) downsampled by 2 on every axis as the means of 2 x 2 x 2 voxels, odd sides padded by
+        the edge voxels. return new array (ceil(d / 2), ceil(h / 2), ceil(w / 2)) of the dtype of img"""
+        d, h, w = img.shape
+        out = np.empty(((d + 1) // 2, (h + 1) // 2, (w + 1) // 2), img.dtype)
+        mean_dtype = np.float64 if img.dtype == np.float64 else np.float32
+        for i in range(out.shape[0]):
+            # one output slice at a time, so that memory maps are read once in order
+            slab = img[2 * i:2 * i + 2].astype(mean_dtype).mean(0)
+            slab = np.pad(slab, ((0, h % 2), (0, w % 2)), 'edge')
+            slab = slab.reshape(out.shape[1], 2, out.shape[2], 2).mean((1, 3))
+            if np.issubdtype(img.dtype, np.integer):
+                np.rint(slab, out=slab)
+            out[i] = slab
+        return out
 
     def save_anno(self, filename):
+        journal_mark = self.get_journal_mark()
+        Model.write_anno(*self.get_anno_save_job(filename))
+        self.compact_journal(filename, journal_mark)
+
+    def get_anno_save_job(self, filename):
+        """arguments of write_anno with a snapshot of the label map, so that painting may go on while saving"""
         self.last_save_dir = os.path.dirname(filename)
-        anno_img = sitk.GetImageFromArray(self._anno_img_edit.astype(np.int16))
-        anno_img.CopyInformation(self._anno_img)
-        self._anno_img = anno_img
-        sitk.WriteImage(self._anno_img, filename)
+        return filename, self._anno_img_edit.copy(), dict(self._img_info)
+
+    @staticmethod
+    @traced()
+    def write_anno(filename, anno_img, img_info, progress_callback=None, num_workers=None):
+        """Write label map anno_img (d, h, w) as int16 with geometry img_info. .gz files are compressed in
+        parallel blocks. filename is replaced atomically by a temporary file of the same directory, so a failed
+        or interrupted save never leaves a broken file. The file is on the disk when this returns, even after a
+        system crash.
+        progress_callback(percent, message) is called while compressing. num_workers threads compress, None for
+        one per CPU."""
+        import SimpleITK as sitk
+
+        anno_itk_img = sitk.GetImageFromArray(anno_img.astype(np.int16))
+        set_img_info(anno_itk_img, img_info)
+        # temporary files next to filename, created with the usual permissions
+        tmp_filepath_prefix = '%s.%d.%d.tmp' % (filename, os.getpid(), threading.get_ident())
+        nii_filepath = tmp_filepath_prefix + '.nii'
+        gz_filepath = tmp_filepath_prefix + '.nii.gz'
+        gzip_progress_callback = None
+        if progress_callback is not None:
+            progress_callback(0, 'Saving %s' % os.path.basename(filename))
+            gzip_progress_callback = lambda fraction: progress_callback(int(10 + 90 * fraction),
+                                                                        'Saving %s' % os.path.basename(filename))
+        try:
+            sitk.WriteImage(anno_itk_img, nii_filepath, False)
+            if filename.endswith('.gz'):
+                parallel_gzip_file(nii_filepath, gz_filepath, num_workers=num_workers,
+                                   progress_callback=gzip_progress_callback)
+                os.replace(gz_filepath, filename)
+            else:
+                fsync_file(nii_filepath)
+                os.replace(nii_filepath, filename)
+            fsync_dir(os.path.dirname(filename))
+        finally:
+            for filepath in [nii_filepath, gz_filepath]:
+                if os.path.exists(filepath):
+                    os.remove(filepath)
+
+    def get_unsaved_edits_info(self):
+        """header (see EditJournal) of the journal of unsaved edits of the raw image, None if there is none"""
+        if self._raw_img_filepath is None:
+            return None
+        return EditJournal.read_header(self._edit_journal.filepath)
+
+    def list_unsaved_edits(self):
+        """headers of all journals of unsaved edits, the latest first"""
+        return EditJournal.list_journals(self._edit_journal.journal_dir)
+
+    def recover_unsaved_edits(self):
+        """replay the journal of unsaved edits onto the current label map, which must be its base annotation.
+        return the number of replayed edits"""
+        num_edits = self._edit_journal.replay(self._anno_img_edit)
+        self._anno_session_key = None  # the label map is no longer the file
+        self._anno_img_edit_history.clear()
+        self.mark_anno_dirty()
+        return num_edits
+
+    def discard_unsaved_edits(self):
+        self._edit_journal.discard()
+
+    def sync_journal(self):
+        """make journaled edits durable, meant to be called at short intervals"""
+        self._edit_journal.sync()
 
+    def get_journal_mark(self):
+        """journal position before the next edit, to be passed to compact_journal after saving"""
+        return self._edit_journal.mark()
+
+    def compact_journal(self, filename, journal_mark):
+        """the label map with edits before journal_mark has been saved to filename"""
+        self._edit_journal.compact(filename, journal_mark)
+
+    @traced()
     def compute_img_stats(self, img_type):
         assert img_type in ['raw', 'anno']
         if img_type == 'raw':
             if self._raw_img is None:
                 for k in self._raw_img_stats.keys():
                     self._raw_img_stats[k] = None
+            elif 'min_val' in self._img_info:  # computed by read_img_data or cached with the volume
+                self._raw_img_stats['min_val'] = self._img_info['min_val']
+                self._raw_img_stats['max_val'] = self._img_info['max_val']
             else:
-                img = sitk.GetArrayViewFromImage(self._raw_img)
-                self._raw_img_stats['min_val'] = img.min()
-                self._raw_img_stats['max_val'] = img.max()
+                self._raw_img_stats['min_val'] = self._raw_img.min().item()
+                self._raw_img_stats['max_val'] = self._raw_img.max().item()
+            if self._raw_img is not None:
+                self._raw_img_stats['histogram'] = self._img_info['histogram'] if 'histogram' in self._img_info \
+                    else Model.compute_histogram(self._raw_img, self._raw_img_stats['min_val'],
+                                                 self._raw_img_stats['max_val'])
         if img_type == 'anno':
-            if self._anno_img is None:
+            if self._anno_img_edit is None:
                 for k in self._anno_img_stats.keys():
                     self._anno_img_stats[k] = None
             else:
-                self._anno_img_stats['num_positive_labels'] = self._anno_img_edit.max()
-                all_targets_map = cc3d.connected_components(self._anno_img_edit, connectivity=26, out_dtype=np.uint16)
-                num_all_targets = all_targets_map.max()
-
-                target_centers = []
-                target_labels = []
-                target_ids = []
-                for i_target in range(1, num_all_targets + 1):
-                    binary_map = all_targets_map == i_target
-                    target_ids.append(i_target)
-                    target_centers.append(Model.get_target_center(binary_map))
-                    target_labels.append(
-                        int(self._anno_img_edit[np.unravel_index(binary_map.argmax(), binary_map.shape)]))
-                self._anno_img_stats['target_ids'] = target_ids
-                self._anno_img_stats['target_labels'] = target_labels
-                self._anno_img_stats['target_centers'] = target_centers
-                self._anno_img_stats['target_id_map'] = all_targets_map
-            self._anno_img_edit_change_flag = False
+                self.set_anno_stats(self.load_anno_stats(self._anno_img_edit, self._anno_session_key))
+                self._anno_session_key = None
+            self._anno_img_edit_dirty_bbox = None
+
+    @staticmethod
+    def compute_histogram(img, min_val, max_val):
+        """Intensity histogram of about HISTOGRAM_NUM_SAMPLES voxels sampled with the same stride along every
+        axis. return {'range': [low, high], 'counts': [n_bins]} of equal width bins, json serializable to be
+        cached with the volume. Integer images of small value range get one bin per value."""
+        stride = max(int(round((img.size / HISTOGRAM_NUM_SAMPLES) ** (1 / 3))), 1)
+        samples = np.asarray(img[::stride, ::stride, ::stride])
+        if np.issubdtype(img.dtype, np.integer):
+            value_range = [min_val, max_val + 1]
+            num_bins = min(int(max_val) - int(min_val) + 1, HISTOGRAM_MAX_BINS)
+        else:
+            value_range = [min_val, max_val if max_val > min_val else min_val + 1]
+            num_bins = HISTOGRAM_MAX_BINS
+        counts, _ = np.histogram(samples, num_bins, value_range)
+        return {'range': value_range, 'counts': counts.tolist()}
+
+    def get_percentile_window(self, low_percentile, high_percentile):
+        """window (bottom, top) covering voxel values from low_percentile to high_percentile by the histogram"""
+        counts = np.cumsum(self._raw_img_stats['histogram']['counts'])
+        low, high = self._raw_img_stats['histogram']['range']
+        bin_width = (high - low) / len(counts)
+        low_bin = np.searchsorted(counts, counts[-1] * low_percentile / 100)
+        high_bin = min(np.searchsorted(counts, counts[-1] * high_percentile / 100), len(counts) - 1)
+        return float(low + low_bin * bin_width), float(low + (high_bin + 1) * bin_width)
+
+    def looks_like_ct(self):
+        """CT images in HU have air at about -1000, MR and PET images have no negative values"""
+        return np.issubdtype(self._raw_img.dtype, np.integer) and self._raw_img_stats['min_val'] <= -500
+
+    def get_anno_img_snapshot(self):
+        """copy of the label map for computing target stats in a worker thread, see set_anno_stats"""
+        self._anno_img_edit_dirty_bbox = None
+        return self._anno_img_edit.copy()
+
+    def get_anno_stats_job(self):
+        """arguments of load_anno_stats with a snapshot of the label map, see get_anno_img_snapshot"""
+        session_key = self._anno_session_key
+        self._anno_session_key = None
+        return self.get_anno_img_snapshot(), session_key
+
+    @traced()
+    def load_anno_stats(self, anno_img, session_key=None):
+        """Target stats of label map anno_img, see compute_anno_stats. If anno_img is the content of the
+        annotation file of session_key, they are read from the session cache, or computed and stored to it if
+        not there. It does not change the model, so it may run in a worker thread"""
+        arrays = self._session_cache.load_arrays(session_key)
+        items = self._session_cache.load(session_key)
+        if arrays is not None and 'anno_stats' in items and set(arrays.keys()) == set(ANNO_STATS_ARRAYS) and \
+                arrays['target_id_map'].shape == anno_img.shape:
+            return dict(arrays, **items['anno_stats'])
+        anno_stats = Model.compute_anno_stats(anno_img)
+        self._session_cache.update(session_key, {k: anno_stats[k] for k in ANNO_STATS_ARRAYS}, anno_stats={
+            'num_positive_labels': anno_stats['num_positive_labels'], 'max_target_id': anno_stats['max_target_id']})
+        return anno_stats
+
+    def get_session_view(self):
+        """view state stored by store_session_view when the raw image was closed, None if there is none or the
+        file has changed since"""
+        return self._session_cache.load(self._raw_session_key).get('view')
+
+    def store_session_view(self, view_state):
+        """keep json serializable view_state of the raw image, and its stats, for the next time it is opened"""
+        if self._raw_img is None:
+            return
+        raw_stats = {k: self._raw_img_stats[k] for k in ['min_val', 'max_val', 'histogram']}
+        self._session_cache.update(self._raw_session_key, view=view_state, raw_stats=raw_stats)
+
+    def set_anno_stats(self, anno_stats):
+        """use target stats of compute_anno_stats. Voxels painted since the label map was taken (by
+        get_anno_img_snapshot) are still in the dirty bbox and updated by update_anno_stats"""
+        self._anno_img_stats.update(anno_stats)
+
+    @staticmethod
+    @traced()
+    def compute_anno_stats(anno_img):
+        """target stats of all targets in label map anno_img, see _anno_img_stats"""
+        import cc3d
+
+        all_targets_map = cc3d.connected_components(anno_img, connectivity=26, out_dtype=np.uint16)
+        anno_stats = Model.get_targets_stats(all_targets_map, anno_img)
+        target_labels = anno_stats['target_labels']
+        anno_stats['num_positive_labels'] = int(target_labels.max()) if len(target_labels) > 0 else 0
+        anno_stats['target_id_map'] = all_targets_map
+        anno_stats['max_target_id'] = int(all_targets_map.max()) if all_targets_map.size > 0 else 0
+        return anno_stats
+
+    @staticmethod
+    def clean_anno(anno_img, label_map=None, min_target_size=0, keep_largest=None):
+        """Clean up label map anno_img for batch tools. Labels are first changed by label_map {label: new label}
+        (new label 0 drops them), then targets of the new labels are removed if they have fewer voxels than
+        min_target_size or are not among the keep_largest largest targets of their label. min_target_size and
+        keep_largest are an int for all labels or {label: int}, None or a missing label means no limit.
+        anno_img is not changed.
+        return (new label map, [{'label', 'source_labels', 'voxels', 'targets', 'removed_targets',
+        'removed_voxels'}] of every new label ordered by label, label 0 is for the voxels dropped by label_map)"""
+        def get_limit(limit, label):
+            return limit.get(label) if isinstance(limit, dict) else limit
+
+        # labels are 0 to MAX_LABEL, so the uint8 view indexes a lookup table
+        label_counts = np.bincount(anno_img.view(np.uint8).ravel(), minlength=256)
+        label_lut = np.arange(256, dtype=np.uint8)
+        for label, new_label in (label_map or {}).items():
+            label_lut[label] = new_label
+        if np.any(label_lut[label_counts > 0] != np.flatnonzero(label_counts > 0)):
+            anno_img = label_lut[anno_img.view(np.uint8)].view(np.int8)
+
+        anno_stats = Model.compute_anno_stats(anno_img)
+        target_labels, target_voxel_counts = anno_stats['target_labels'], anno_stats['target_voxel_counts']
+        is_removed = np.zeros(len(target_labels), bool)
+        report = []
+        for label in sorted(set(label_lut[np.flatnonzero(label_counts)].tolist())):
+            source_labels = [source for source in np.flatnonzero(label_counts).tolist()
+                             if label_lut[source] == label and (label != 0 or source != 0)]
+            if label == 0:
+                if len(source_labels) > 0:
+                    voxels = int(label_counts[source_labels].sum())
+                    report.append({'label': 0, 'source_labels': source_labels, 'voxels': voxels, 'targets': 0,
+                                   'removed_targets': 0, 'removed_voxels': voxels})
+                continue
+            label_indices = np.flatnonzero(target_labels == label)
+            label_counts_of_targets = target_voxel_counts[label_indices]
+            min_size = get_limit(min_target_size, label)
+            if min_size is not None:
+                is_removed[label_indices[label_counts_of_targets < min_size]] = True
+            num_kept = get_limit(keep_largest, label)
+            if num_kept is not None:
+                is_removed[label_indices[np.argsort(-label_counts_of_targets, kind='stable')[num_kept:]]] = True
+            report.append({'label': label, 'source_labels': source_labels,
+                           'voxels': int(label_counts_of_targets.sum()), 'targets': len(label_indices),
+                           'removed_targets': int(is_removed[label_indices].sum()),
+                           'removed_voxels': int(target_voxel_counts[label_indices[is_removed[label_indices]]].sum())})
+
+        if np.any(is_removed):
+            is_removed_id = np.zeros(anno_stats['max_target_id'] + 1, bool)
+            is_removed_id[anno_stats['target_ids'][is_removed]] = True
+            anno_img = np.where(is_removed_id[anno_stats['target_id_map']], np.int8(0), anno_img)
+        return anno_img, report
+
+    @traced()
+    def update_anno_stats(self):
+        """Bring the target stats up to date with the painted voxels since last update.
+        Only the dirty bbox and the targets touching it are relabeled, other targets keep their ids.
+        Relabeled targets get new ids so that stale ids never point to a different target."""
+        dirty_bbox = self._anno_img_edit_dirty_bbox
+        if dirty_bbox is None or self._anno_img_edit is None or self._anno_img_stats['target_id_map'] is None:
+            return
+        import cc3d
+
+        anno_size = self._anno_img_edit.shape
+        if all([dirty_bbox[i][0] == 0 and dirty_bbox[i][1] == anno_size[i] - 1 for i in range(3)]):
+            self.compute_img_stats('anno')
+            return
+        target_id_map = self._anno_img_stats['target_id_map']
+        # targets in the dirty bbox or 26-connected to it
+        outer_bbox = [[max(dirty_bbox[i][0] - 1, 0), min(dirty_bbox[i][1] + 1, anno_size[i] - 1)] for i in range(3)]
+        touched_ids = np.unique(target_id_map[Model.bbox2slice(outer_bbox)])
+        touched_ids = touched_ids[touched_ids != 0]
+        is_touched = np.isin(self._anno_img_stats['target_ids'], touched_ids)
+        # region that contains all voxels of touched targets and painted voxels
+        region_bbox = [[min([outer_bbox[i][0]] + list(self._anno_img_stats['target_bboxes'][is_touched, i, 0])),
+                        max([outer_bbox[i][1]] + list(self._anno_img_stats['target_bboxes'][is_touched, i, 1]))]
+                       for i in range(3)]
+        region_slice = Model.bbox2slice(region_bbox)
+        region_target_id_map = target_id_map[region_slice]
+        region_anno_img = self._anno_img_edit[region_slice]
+
+        was_touched = np.isin(region_target_id_map, touched_ids)
+        relabel_mask = was_touched.copy()
+        dirty_bbox_in_region = [[dirty_bbox[i][0] - region_bbox[i][0], dirty_bbox[i][1] - region_bbox[i][0]]
+                                for i in range(3)]
+        relabel_mask[Model.bbox2slice(dirty_bbox_in_region)] = True
+        relabel_mask &= region_anno_img != 0
+        region_new_targets_map = cc3d.connected_components(np.where(relabel_mask, region_anno_img, 0),
+                                                           connectivity=26, out_dtype=np.uint32)
+        new_target_stats = Model.get_targets_stats(region_new_targets_map, region_anno_img)
+        num_new_targets = len(new_target_stats['target_ids'])
+        id_offset = self._anno_img_stats['max_target_id']
+        if id_offset + num_new_targets > np.iinfo(target_id_map.dtype).max:
+            self.compute_img_stats('anno')
+            return
+
+        region_target_id_map[was_touched] = 0
+        region_target_id_map[relabel_mask] = region_new_targets_map[relabel_mask] + id_offset
+        new_target_stats['target_ids'] = new_target_stats['target_ids'] + id_offset
+        new_target_stats['target_centers'] += np.array(region_bbox)[:, 0]
+        new_target_stats['target_bboxes'] += np.array(region_bbox)[:, :1]
+        for k, v in new_target_stats.items():
+            self._anno_img_stats[k] = np.concatenate([self._anno_img_stats[k][~is_touched], v])
+        target_labels = self._anno_img_stats['target_labels']
+        self._anno_img_stats['num_positive_labels'] = int(target_labels.max()) if len(target_labels) > 0 else 0
+        self._anno_img_stats['max_target_id'] = id_offset + num_new_targets
+        self._anno_img_edit_dirty_bbox = None
+
+    def mark_anno_dirty(self, bbox=None):
+        """bbox: [[d0, d1], [h0, h1], [w0, w1]] closed interval of changed voxels, None means the whole volume"""
+        if bbox is None:
+            anno_size = self._anno_img_edit.shape
+            bbox = [[0, anno_size[i] - 1] for i in range(3)]
+        self._anno_img_edit_version += 1
+        if self._anno_img_edit_dirty_bbox is not None:
+            bbox = [[min(bbox[i][0], self._anno_img_edit_dirty_bbox[i][0]),
+                     max(bbox[i][1], self._anno_img_edit_dirty_bbox[i][1])] for i in range(3)]
+        self._anno_img_edit_dirty_bbox = [list(bbox[i]) for i in range(3)]
+
+    @staticmethod
+    def bbox2slice(bbox):
+        """closed interval bbox to slices"""
+        return tuple(slice(b[0], b[1] + 1, 1) for b in bbox)
 
     @staticmethod
-    def get_target_center(target_binary_map):
-        assert target_binary_map.ndim == 3
-        target_binary_map = target_binary_map.astype(np.int16)
-        center = [-1, -1, -1]
-        if target_binary_map.max() < 1:
-            return center
-        yz = np.sum(target_binary_map, 0)
-        xz = np.sum(target_binary_map, 1)
-        x = np.sum(xz, 1)
-        z = np.sum(xz, 0)
-        y = np.sum(yz, 1)
-        return [np.argmax(x), np.argmax(y), np.argmax(z)]
+    def get_targets_stats(target_id_map, anno_img, max_hist_entries=2 ** 24):
+        """Stats of all targets in target_id_map (0 is background) computed together from its foreground voxels.
+        Instead of one full volume mask per target, per-target histograms of voxel coordinates along each axis are
+        accumulated with bincount, from which counts, centers (the index of the largest histogram bin on each
+        axis) and bboxes follow.
+        max_hist_entries bounds the histogram memory, targets are processed in chunks beyond it."""
+        assert target_id_map.ndim == 3 and target_id_map.shape == anno_img.shape
+        fg_indices = np.flatnonzero(target_id_map)
+        fg_ids = target_id_map.ravel()[fg_indices].astype(np.intp)
+        id_counts = np.bincount(fg_ids)
+        id_counts[:1] = 0
+        target_ids = np.flatnonzero(id_counts)
+        num_targets = len(target_ids)
+
+        # compact target index in order of target_ids
+        id2index = np.zeros(len(id_counts), np.intp)
+        id2index[target_ids] = np.arange(num_targets)
+        fg_target_indices = id2index[fg_ids]
+        del fg_ids
+
+        target_labels = np.zeros(num_targets, anno_img.dtype)
+        target_labels[fg_target_indices] = anno_img.ravel()[fg_indices]
+        target_centers = np.zeros([num_targets, 3], np.intp)
+        target_bboxes = np.zeros([num_targets, 3, 2], np.intp)
+
+        fg_coords = np.unravel_index(fg_indices, target_id_map.shape)
+        del fg_indices
+        chunk_size = max(max_hist_entries // max(target_id_map.shape), 1)
+        for chunk_start in range(0, num_targets, chunk_size):
+            chunk_end = min(chunk_start + chunk_size, num_targets)
+            if chunk_start == 0 and chunk_end == num_targets:
+                in_chunk = slice(None)
+            else:
+                in_chunk = np.logical_and(fg_target_indices >= chunk_start, fg_target_indices < chunk_end)
+            chunk_target_indices = fg_target_indices[in_chunk] - chunk_start
+            for axis in range(3):
+                axis_len = target_id_map.shape[axis]
+                hist = np.bincount(chunk_target_indices * axis_len + fg_coords[axis][in_chunk],
+                                   minlength=(chunk_end - chunk_start) * axis_len)
+                hist = hist.reshape([chunk_end - chunk_start, axis_len])
+                occupied = hist > 0
+                target_centers[chunk_start:chunk_end, axis] = np.argmax(hist, 1)
+                target_bboxes[chunk_start:chunk_end, axis, 0] = np.argmax(occupied, 1)
+                target_bboxes[chunk_start:chunk_end, axis, 1] = axis_len - 1 - np.argmax(occupied[:, ::-1], 1)
+
+        return {
+            'target_ids': target_ids,
+            'target_labels': target_labels,
+            'target_centers': target_centers,
+            'target_voxel_counts': id_counts[target_ids],
+            'target_bboxes': target_bboxes
+        }
 
+    @traced()
     def get_2D_map_in_window(self, view, index, img_type='raw', low_bound=None, up_bound=None, colored_anno=True,
-                             alpha=None):
+                             alpha=None, out=None, region=None, level=0):
         """colored_anno=True transit anno to RGB map, else grayscale.
-        alpha only applied to foreground label(!=0) when colored_anno=True. """
+        alpha only applied to foreground label(!=0) when colored_anno=True.
+        out: optional buffer the map is written to, else the returned map is read-only (shared by the slice cache).
+        region: ((row0, row1), (col0, col1)) closed interval of the map at level. only this part of out (required)
+        is rendered, or copied if the map is in the slice cache. a region of the whole map is cached as without it
+        level: pyramid level, the map is downsampled by 2 ** level. clipped to the built levels, see
+        get_2D_map_shape"""
+        key = self.get_2D_map_key(view, index, img_type, low_bound, up_bound, colored_anno, alpha, level)
+        if key is None:
+            return None
+        if region is not None:
+            assert out is not None
+            (row0, row1), (col0, col1) = region
+            if (row0, col0) != (0, 0) or (row1, col1) != (out.shape[0] - 1, out.shape[1] - 1):
+                img_slice = self._slice_cache.get(key)
+                if img_slice is None:
+                    return self._render_2D_map(view, index, img_type, low_bound, up_bound, colored_anno, alpha,
+                                               level, out=out, region=region)
+                region_slice = Model.bbox2slice(region)
+                np.copyto(out[region_slice], img_slice[region_slice])
+                return out
+        img_slice = self._slice_cache.get(key)
+        if img_slice is None:
+            img_slice = self._render_2D_map(view, index, img_type, low_bound, up_bound, colored_anno, alpha, level,
+                                            out=out)
+            self._slice_cache.put(key, img_slice, copy=out is not None)
+            return img_slice
+        if out is None:
+            return img_slice
+        np.copyto(out, img_slice)
+        return out
+
+    def get_2D_map_region(self, view, index, bbox, level=0):
+        """region of the 2D map of view at index and pyramid level covered by bbox [[d0, d1], [h0, h1], [w0, w1]]
+        (closed interval of full resolution). None if the slice does not pass through bbox"""
+        assert view in ['a', 's', 'c']
+        (d0, d1), (h0, h1), (w0, w1) = bbox
+        slice_range = {'a': (d0, d1), 's': (w0, w1), 'c': (h0, h1)}[view]
+        if index < slice_range[0] or index > slice_range[1]:
+            return None
+        region = {'a': ((w0, w1), (h0, h1)), 's': ((h0, h1), (d0, d1)), 'c': ((w0, w1), (d0, d1))}[view]
+        level = self._clip_pyramid_level(level)
+        return tuple((start >> level, end >> level) for start, end in region)
+
+    def get_2D_map_shape(self, view, level=0):
+        """rows, cols of the 2D maps of view at pyramid level, which is clipped to the built levels"""
+        assert view in ['a', 's', 'c']
+        x, y, z = self.get_size()
+        factor = 2 ** self._clip_pyramid_level(level)
+        rows, cols = {'a': (x, y), 's': (y, z), 'c': (x, z)}[view]
+        return -(-rows // factor), -(-cols // factor)
+
+    def _clip_pyramid_level(self, level):
+        return min(max(level, 0), len(self._raw_pyramid))
+
+    def prefetch_2D_maps(self, view, index, step, num, img_types=('raw', 'anno'), low_bound=None, up_bound=None,
+                         colored_anno=True, alpha=None, level=0):
+        """render the num maps after index in the direction of step (+1 or -1) in background.
+        replaces former prefetch requests"""
+        jobs = []
+        num_slices = self.get_size()[VIEW_AXIS[view]]
+        for i in range(1, num + 1):
+            prefetch_index = index + step * i
+            if prefetch_index < 0 or prefetch_index >= num_slices:
+                break
+            for img_type in img_types:
+                args = (view, prefetch_index, img_type, low_bound, up_bound, colored_anno, alpha, level)
+                key = self.get_2D_map_key(*args)
+                if key is not None:
+                    jobs.append((key, args))
+        self._slice_prefetcher.request(jobs)
+
+    def get_2D_map_key(self, view, index, img_type='raw', low_bound=None, up_bound=None, colored_anno=True, alpha=None,
+                       level=0):
+        """key identifying the map of get_2D_map_in_window with the same arguments, changed when the map changes.
+        clipped index, bounds and level, None if there is no image"""
         assert view in ['a', 's', 'c']
         assert img_type in ['raw', 'anno']
+        if img_type == 'raw' and self._raw_img is None or img_type == 'anno' and self._anno_img_edit is None:
+            return None
+        index = min(max(index, 0), self.get_size()[VIEW_AXIS[view]] - 1)
+        level = self._clip_pyramid_level(level)
+        if img_type == 'raw':
+            value_min, value_max = self.get_voxel_value_bound()
+            if low_bound is None or low_bound < value_min:
+                low_bound = value_min
+            if up_bound is None or up_bound > value_max:
+                up_bound = value_max
+            return self._img_version, view, index, img_type, low_bound, up_bound, level
+        color_lut_key = self._get_anno_color_lut_key(alpha) if colored_anno else None
+        return self._img_version, self._anno_img_edit_version, view, index, img_type, color_lut_key, level
+
+    def _render_2D_map_for_cache(self, *args):
+        """render in prefetch thread. return (key, map), key is None if images changed during rendering"""
+        key = self.get_2D_map_key(*args)
+        img_slice = self._render_2D_map(*args)
+        if key != self.get_2D_map_key(*args):
+            return None, None
+        return key, img_slice
+
+    def _render_2D_map(self, view, index, img_type='raw', low_bound=None, up_bound=None, colored_anno=True,
+                       alpha=None, level=0, out=None, region=None):
         if index < 0:
             index = 0
+        level = self._clip_pyramid_level(level)
         if img_type == 'raw':
-            itk_img = self._raw_img
+            img = self._raw_img if level == 0 else self._raw_pyramid[level - 1]
         if img_type == 'anno':
-            itk_img = self._anno_img
+            img = self._anno_img_edit
 
-        if itk_img is None:
+        if img is None:
             return None
 
-        if img_type == 'raw':
-            img = sitk.GetArrayViewFromImage(itk_img)
-        if img_type == 'anno':
-            img = self._anno_img_edit
         img = np.transpose(img, (2, 1, 0))  # d, h, w to w, h, d
-
+        if img_type == 'raw':
+            index = index >> level
+        index = min(index, img.shape[VIEW_AXIS[view]] - 1)
         if view == 'a':
-            if index >= itk_img.GetSize()[2]:
-                index = itk_img.GetSize()[2] - 1
             img_slice = img[:, :, index]  # x, y
         if view == 's':
-            if index >= itk_img.GetSize()[0]:
-                index = itk_img.GetSize()[0] - 1
             img_slice = img[index, :, :]  # y, z
         if view == 'c':
-            if index >= itk_img.GetSize()[1]:
-                index = itk_img.GetSize()[1] - 1
             img_slice = img[:, index, :]  # x, z
+        if img_type == 'anno' and level > 0:
+            # labels are not averaged, the label map is sampled every 2 ** level voxels instead
+            img_slice = img_slice[::2 ** level, ::2 ** level]
+        if region is not None:
+            region_slice = Model.bbox2slice(region)
+            img_slice = img_slice[region_slice]
+            out = out[region_slice]
 
         value_min, value_max = self.get_voxel_value_bound()
         if img_type == 'anno':
             if colored_anno:
-                img_slice = self.color_anno_img(img_slice, alpha)
-            return img_slice.copy()
+                return self.color_anno_img(img_slice, alpha, out=out)
+            if out is None:
+                return img_slice.copy()
+            np.copyto(out, img_slice)
+            return out
         if img_type == 'raw':
             if low_bound is None or low_bound < value_min:
                 low_bound = value_min
             if up_bound is None or up_bound > value_max:
                 up_bound = value_max
-            img_slice = self.clip_img_in_window(img_slice, low_bound, up_bound, normalization=True)
-            return img_slice.copy()
+            return self.clip_img_in_window(img_slice, low_bound, up_bound, normalization=True, out=out)
 
     def get_voxel_value_at_point(self, point, img_type):
         assert img_type in ['raw', 'anno']
@@ -197,52 +772,109 @@ class Model:
             if self._raw_img is None:
                 return 0
             else:
-                return sitk.GetArrayViewFromImage(self._raw_img)[z, y, x]
+                return self._raw_img[z, y, x]
         if img_type == 'anno':
-            if self._anno_img is None:
+            if self._anno_img_edit is None:
                 return 0
             else:
                 return self._anno_img_edit[z, y, x]
 
-    def clip_img_in_window(self, img, low_bound, up_bound, normalization=False):
+    def clip_img_in_window(self, img, low_bound, up_bound, normalization=False, out=None):
+        """normalization maps [low_bound, up_bound] to uint8 [0, 255], written to out if given.
+        Integer images of at most 16 bits are mapped by one gather from a cached lookup table."""
         value_min, value_max = self.get_voxel_value_bound()
         assert low_bound >= value_min and up_bound <= value_max
-        img = np.clip(img, low_bound, up_bound)
-        if normalization:
-            img = (255 * (img.astype(np.float32) - low_bound) / (up_bound - low_bound)).astype(np.uint8)
-        return img
-
-    def color_anno_img(self, anno_img, alpha):
-        anno_img = anno_img.copy().astype(np.int16)
-        num_colors = max(min(len(self.label_colors), self._anno_img_stats['num_positive_labels']), 1)
-        anno_img = np.where(anno_img == 0, anno_img, ((anno_img - 1) % num_colors + 1))
-
-        # color_img = (255*label2rgb(anno_img, colors=self.label_colors, bg_label=0)).astype(np.uint8)  # too slow
-        anno_img_expanded = np.expand_dims(anno_img, -1)
-        tiled_anno_img = np.tile(anno_img_expanded, (1, 1, 3))
-        bg_img = np.zeros(tiled_anno_img.shape, np.uint8)
-        color_img = bg_img
-        for i in range(num_colors):
-            fg_img = np.ones(tiled_anno_img.shape, np.uint8)
-            fg_img[:, :, 0] = self.label_colors[i].red()
-            fg_img[:, :, 1] = self.label_colors[i].green()
-            fg_img[:, :, 2] = self.label_colors[i].blue()
-            color_img = np.where(anno_img_expanded == (i + 1), fg_img, color_img)
-
-        if alpha is None:
-            alpha_channel = 255 * np.ones(anno_img_expanded.shape, np.uint8)
+        if not normalization:
+            return np.clip(img, low_bound, up_bound, out=out)
+        if img.dtype.kind in 'iu' and img.dtype.itemsize <= 2:
+            window_lut = self.get_window_lut(low_bound, up_bound, img.dtype)
+            return Model.apply_lut(window_lut, img.view('u%d' % img.dtype.itemsize), out=out)
+        img = np.clip(img, low_bound, up_bound).astype(np.float32)
+        img -= low_bound
+        img *= 255
+        img /= up_bound - low_bound
+        if out is None:
+            return img.astype(np.uint8)
+        np.copyto(out, img, casting='unsafe')
+        return out
+
+    def get_window_lut(self, low_bound, up_bound, dtype):
+        """uint8 lookup table indexed by the voxel values of an integer dtype (at most 16 bits) viewed as unsigned.
+        The last few tables are cached by (low_bound, up_bound, dtype)."""
+        dtype = np.dtype(dtype)
+        lut_key = (low_bound, up_bound, dtype.str)
+        with self._lut_lock:
+            if lut_key in self._window_luts:
+                self._window_luts.move_to_end(lut_key)
+                return self._window_luts[lut_key]
+            values = np.arange(2 ** (8 * dtype.itemsize), dtype='u%d' % dtype.itemsize).view(dtype)
+            values = np.clip(values, low_bound, up_bound).astype(np.float32)
+            window_lut = (255 * (values - low_bound) / (up_bound - low_bound)).astype(np.uint8)
+            self._window_luts[lut_key] = window_lut
+            while len(self._window_luts) > 8:
+                self._window_luts.popitem(last=False)
+            return window_lut
+
+    def color_anno_img(self, anno_img, alpha, out=None):
+        """anno_img [h, w] to RGBA [h, w, 4] by one gather from the color lookup table, written to out if given"""
+        color_lut = self.get_anno_color_lut(alpha)
+        if anno_img.dtype.itemsize == 1:
+            lut_indices = anno_img.view(np.uint8)
         else:
-            alpha_channel = np.where(anno_img_expanded == 0,
-                                     np.zeros(anno_img_expanded.shape, np.uint8),
-                                     round(alpha * 255) * np.ones(anno_img_expanded.shape, np.uint8))
-        color_img = np.concatenate([color_img, alpha_channel], -1)
-        return color_img
+            lut_indices = anno_img.astype(np.uint8)
+        if out is None:
+            out = np.empty(anno_img.shape + (4,), np.uint8)
+        # gather RGBA as one uint32 per pixel
+        Model.apply_lut(color_lut.view(np.uint32)[:, 0], lut_indices, out=out.view(np.uint32)[..., 0])
+        return out
+
+    @staticmethod
+    def apply_lut(lut, indices, out=None, chunk_size=2 ** 16):
+        """lut[indices] for 2D indices, written to out if given.
+        np.take copies the indices to intp first, so it is applied on row blocks to keep that copy small."""
+        if out is None:
+            out = np.empty(indices.shape, lut.dtype)
+        rows_per_chunk = max(chunk_size // max(indices.shape[1], 1), 1)
+        for row in range(0, indices.shape[0], rows_per_chunk):
+            np.take(lut, indices[row:row + rows_per_chunk], out=out[row:row + rows_per_chunk], mode='clip')
+        return out
+
+    def get_anno_color_lut(self, alpha):
+        """RGBA lookup table [256, 4] indexed by label value (as uint8). Rebuilt only if colors or alpha change.
+        alpha only applied to foreground label(!=0), None means opaque including background."""
+        lut_key = self._get_anno_color_lut_key(alpha)
+        with self._lut_lock:
+            if self._anno_color_lut_key == lut_key:
+                return self._anno_color_lut
+            color_lut = self._build_anno_color_lut(*lut_key)
+            self._anno_color_lut = color_lut
+            self._anno_color_lut_key = lut_key
+            return color_lut
+
+    def _get_anno_color_lut_key(self, alpha):
+        num_colors = max(min(len(self.label_colors), self.get_anno_num_labels()), 1)
+        return tuple(self.label_colors[:num_colors]), alpha
+
+    @staticmethod
+    def _build_anno_color_lut(colors, alpha):
+        """colors: 0xAARRGGBB ints of colors used cyclically for labels 1, 2, ..."""
+        num_colors = len(colors)
+        color_lut = np.zeros([256, 4], np.uint8)
+        labels = np.arange(256, dtype=np.uint8).view(np.int8).astype(np.int16)
+        color_indices = (labels - 1) % num_colors
+        rgb = np.array([[(color >> 16) & 255, (color >> 8) & 255, color & 255] for color in colors], np.uint8)
+        color_lut[:, :3] = rgb[color_indices]
+        color_lut[:, 3] = 255 if alpha is None else round(alpha * 255)
+        color_lut[0, :3] = 0
+        if alpha is not None:
+            color_lut[0, 3] = 0
+        return color_lut
 
     def get_size(self):
         """return x, y, z"""
         if self._raw_img is None:
             return None
-        return list(self._raw_img.GetSize())
+        return list(self._img_info['size'])
 
     def get_voxel_value_bound(self):
         return self._raw_img_stats['min_val'], self._raw_img_stats['max_val']
@@ -262,102 +894,134 @@ class Model:
     def get_anno_target_ids(self):
         return self._anno_img_stats['target_ids']
 
+    def get_anno_target_labels(self):
+        return self._anno_img_stats['target_labels']
+
+    def get_anno_target_voxel_counts(self):
+        return self._anno_img_stats['target_voxel_counts']
+
+    def get_label_color(self, label):
+        """0xAARRGGBB color of label, colors are used cyclically as in colored anno maps"""
+        return self.label_colors[(label - 1) % len(self.label_colors)]
+
     def get_anno_num_labels(self):
         if self._anno_img_stats['num_positive_labels'] is None:
             return 0
         return self._anno_img_stats['num_positive_labels']
 
+    def get_anno_target_ids_for_label(self, label=1):
+        if self._anno_img_stats['target_labels'] is None:
+            return []
+        is_label = self._anno_img_stats['target_labels'] == label
+        return self._anno_img_stats['target_ids'][is_label].tolist()
+
+    def get_anno_target_center(self, target_id):
+        """return d, h, w, or None if target_id does not exist"""
+        if self._anno_img_stats['target_ids'] is None:
+            return None
+        target_index = np.flatnonzero(self._anno_img_stats['target_ids'] == target_id)
+        if len(target_index) == 0:
+            return None
+        return self._anno_img_stats['target_centers'][target_index[0]].tolist()
+
     def get_anno_target_centers_for_label(self, label=1):
         if self._anno_img_stats['target_labels'] is None:
             return []
-        target_centers = []
-        all_target_centers = self._anno_img_stats['target_centers']
-        for i, target_label in enumerate(self._anno_img_stats['target_labels']):
-            if target_label == label:
-                target_centers.append(all_target_centers[i])
-        return target_centers
+        is_label = self._anno_img_stats['target_labels'] == label
+        return self._anno_img_stats['target_centers'][is_label].tolist()
 
     def anno_paint(self, x, y, z, axis, label, brush_type, brush_size, erase=False, new_step=False):
-        if brush_type == BRUSH_TYPE_NO_BRUSH:
-            return
-        pos = [z, y, x]  # d, h, w
-        anno_size = [self.get_size()[2], self.get_size()[1], self.get_size()[0]]
-        for i in range(3):
-            if pos[i] < 0 or pos[i] > anno_size[i] - 1:
-                return
-        size = [brush_size, brush_size, brush_size]  # d, h, w
-        if axis == 'x':
-            size[2] = 1
-        if axis == 'y':
-            size[1] = 1
-        if axis == 'z':
-            size[0] = 1
-        paint_area_bbox = [[0, 0], [0, 0], [0, 0]]  # d, h, w. closed interval
-        pos_in_paint_area = [0, 0, 0]
-        for i in range(3):
-            paint_area_bbox[i][0] = pos[i] - size[i] // 2
-            paint_area_bbox[i][1] = paint_area_bbox[i][0] + size[i] - 1
-            pos_in_paint_area[i] = pos[i] - paint_area_bbox[i][0]
-            # boundary check
-            if paint_area_bbox[i][0] < 0:
-                pos_in_paint_area[i] += 0 - paint_area_bbox[i][0]
-                paint_area_bbox[i][0] = 0
-            if paint_area_bbox[i][1] > anno_size[i] - 1:
-                paint_area_bbox[i][1] = anno_size[i] - 1
-
-        paint_area_shape = [paint_area_bbox[0][1] - paint_area_bbox[0][0] + 1,
-                            paint_area_bbox[1][1] - paint_area_bbox[1][0] + 1,
-                            paint_area_bbox[2][1] - paint_area_bbox[2][0] + 1]
-        new_paint_area_anno_img = np.zeros(paint_area_shape, self._anno_img_edit.dtype)
-        if brush_type == BRUSH_TYPE_CIRCLE_BRUSH:
-            indices_img = np.indices(new_paint_area_anno_img.shape).transpose([1, 2, 3, 0]).astype(np.float32)
-            radius_img = np.linalg.norm(indices_img - pos_in_paint_area, axis=-1)
-            new_paint_area_anno_img = np.where(2 * radius_img <= brush_size,
-                                               label * np.ones(radius_img.shape, new_paint_area_anno_img.dtype),
-                                               new_paint_area_anno_img)
-        if brush_type == BRUSH_TYPE_RECT_BRUSH:
-            new_paint_area_anno_img[:] = label
-
-        paint_area_slice = (slice(paint_area_bbox[0][0], paint_area_bbox[0][1] + 1, 1),
-                            slice(paint_area_bbox[1][0], paint_area_bbox[1][1] + 1, 1),
-                            slice(paint_area_bbox[2][0], paint_area_bbox[2][1] + 1, 1))
+        """return the bbox [[d0, d1], [h0, h1], [w0, w1]] (closed interval) of changed voxels, None if unchanged"""
+        return self.anno_paint_stroke([(x, y, z)], axis, label, brush_type, brush_size, erase, new_step)
+
+    @traced()
+    def anno_paint_stroke(self, points, axis, label, brush_type, brush_size, erase=False, new_step=False):
+        """Paint the brush swept along the polyline through points [(x, y, z)] of the slice normal to axis
+        ('x', 'y' or 'z'). Circle and rect brushes paint on this slice only, sphere and cube brushes through it.
+        Points out of the image break the polyline.
+        return the bbox [[d0, d1], [h0, h1], [w0, w1]] (closed interval) of changed voxels, None if unchanged"""
+        if brush_type == BRUSH_TYPE_NO_BRUSH or len(points) == 0:
+            return None
+        anno_size = self._anno_img_edit.shape  # d, h, w
+        axis_dim = {'z': 0, 'y': 1, 'x': 2}[axis]
+        points = np.array(points, np.int64).reshape(-1, 3)[:, ::-1]  # d, h, w
+        inside = np.all(np.logical_and(points >= 0, points <= np.array(anno_size) - 1), axis=1)
+        if not inside.any():
+            return None
+        # segments between successive points in the image, and every point as a degenerated one
+        inside_pair = np.logical_and(inside[:-1], inside[1:])
+        segment_starts = np.concatenate([points[:-1][inside_pair], points[inside]])
+        segment_ends = np.concatenate([points[1:][inside_pair], points[inside]])
+
+        low, high = get_brush_extent(brush_type, brush_size, axis_dim)
+        paint_area_bbox = [[max(int(segment_starts[:, i].min()) - low[i], 0),
+                            min(int(segment_starts[:, i].max()) + high[i], anno_size[i] - 1)]
+                           for i in range(3)]  # d, h, w. closed interval
+        origin = np.array([b[0] for b in paint_area_bbox])
+        paint_area_shape = tuple(b[1] - b[0] + 1 for b in paint_area_bbox)
+        brush_mask = sweep_brush(paint_area_shape, segment_starts - origin, segment_ends - origin,
+                                 brush_type, brush_size, axis_dim)
 
         if new_step:
-            self._anno_img_edit_undo_stack.append(self._anno_img_edit.copy())
-            self._anno_img_edit_redo_stack.clear()
+            self._anno_img_edit_history.new_step()
 
+        paint_area_anno_img = self._anno_img_edit[Model.bbox2slice(paint_area_bbox)]
         if not erase:
-            self._anno_img_edit[paint_area_slice] = np.where(new_paint_area_anno_img > 0,
-                                                             new_paint_area_anno_img,
-                                                             self._anno_img_edit[paint_area_slice]).copy()
+            changed = np.logical_and(brush_mask, paint_area_anno_img != label)
         else:
-            self._anno_img_edit[paint_area_slice] = np.where(
-                np.logical_and(self._anno_img_edit[paint_area_slice] == label, new_paint_area_anno_img > 0),
-                np.zeros(new_paint_area_anno_img.shape, self._anno_img_edit.dtype),
-                self._anno_img_edit[paint_area_slice])
-        self._anno_img_edit_change_flag = True
+            changed = np.logical_and(brush_mask, paint_area_anno_img == label)
+        old_values = paint_area_anno_img[changed]
+        new_values = np.full(old_values.shape, 0 if erase else label, old_values.dtype)
+        changed_bbox = self._anno_img_edit_history.record_mask(anno_size, paint_area_bbox, changed,
+                                                               old_values, new_values)
+        if changed_bbox is None:
+            return None
+        paint_area_anno_img[changed] = new_values
+        self.mark_anno_dirty(changed_bbox)
+        return changed_bbox
 
     def delete_target(self, target_id):
-        if self._anno_img_edit_change_flag:
-            raise ChangeNotSavedError('You must press the "Refresh" button for the target list before target deletion!')
-        self._anno_img_edit_undo_stack.append(self._anno_img_edit.copy())
-        self._anno_img_edit_redo_stack.clear()
-        self._anno_img_edit = np.where(self._anno_img_stats['target_id_map'] == target_id,
-                                       np.zeros(self._anno_img_edit.shape, self._anno_img_edit.dtype),
-                                       self._anno_img_edit)
+        """erase the voxels of target target_id as one undo step. raise KeyError if there is no such target"""
+        self.update_anno_stats()
+        target_index = np.flatnonzero(self._anno_img_stats['target_ids'] == target_id)
+        if len(target_index) == 0:
+            raise KeyError('No target %d' % target_id)
+        target_index = target_index[0]
+        target_bbox = self._anno_img_stats['target_bboxes'][target_index]
+        target_slice = Model.bbox2slice(target_bbox)
+        target_mask = self._anno_img_stats['target_id_map'][target_slice] == target_id
+        target_anno_img = self._anno_img_edit[target_slice]
+        self._anno_img_edit_history.new_step()
+        self._anno_img_edit_history.record_region(self._anno_img_edit.shape, target_bbox, target_anno_img,
+                                                  np.where(target_mask, 0, target_anno_img).astype(target_anno_img.dtype))
+        target_anno_img[target_mask] = 0
+        self._anno_img_edit_version += 1
+        self._anno_img_stats['target_id_map'][target_slice][target_mask] = 0
+        for k in ['target_ids', 'target_labels', 'target_centers', 'target_voxel_counts', 'target_bboxes']:
+            self._anno_img_stats[k] = np.delete(self._anno_img_stats[k], target_index, 0)
+        target_labels = self._anno_img_stats['target_labels']
+        self._anno_img_stats['num_positive_labels'] = int(target_labels.max()) if len(target_labels) > 0 else 0
 
     def undo_paint(self):
-        if len(self._anno_img_edit_undo_stack) > 0:
-            self._anno_img_edit_redo_stack.append(self._anno_img_edit)
-            self._anno_img_edit = self._anno_img_edit_undo_stack.pop()
-            self._anno_img_edit_change_flag = True
-            return True
-        return False
+        changed_bbox = self._anno_img_edit_history.undo(self._anno_img_edit)
+        if changed_bbox is None:
+            return False
+        self.mark_anno_dirty(changed_bbox)
+        return True
 
     def redo_paint(self):
-        if len(self._anno_img_edit_redo_stack) > 0:
-            self._anno_img_edit_undo_stack.append(self._anno_img_edit)
-            self._anno_img_edit = self._anno_img_edit_redo_stack.pop()
-            self._anno_img_edit_change_flag = True
-            return True
-        return False
+        changed_bbox = self._anno_img_edit_history.redo(self._anno_img_edit)
+        if changed_bbox is None:
+            return False
+        self.mark_anno_dirty(changed_bbox)
+        return True
+
+    def set_slice_cache_budget(self, slice_cache_budget):
+        """max bytes of cached 2D maps, 0 disables the slice cache"""
+        self._slice_cache.budget_bytes = slice_cache_budget
+        if slice_cache_budget == 0:
+            self._slice_cache.clear()
+
+    def set_history_budget(self, history_budget):
+        """max bytes of undo/redo history, oldest steps are dropped beyond it"""
+        self._anno_img_edit_history.budget_bytes = history_budget
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from utils.cache_utils import get_cache_dir
+
+DEFAULT_SESSION_CACHE_BUDGET = 2 * 1024 ** 3  # bytes
+KEY_BLOCK_SIZE = 1024 ** 2  # bytes of the start and the end of a file hashed into its key
+
+
+def get_content_key(filepath):
+    """Key of the content of an image file: sha1 of its size, mtime and first and last KEY_BLOCK_SIZE bytes.
+    They hold the image header and, for .gz files, the CRC32 of all the uncompressed content, so the key changes
+    with the file but not with its path"""
+    stat = os.stat(filepath)
+    sha1 = hashlib.sha1(('%d|%d|' % (stat.st_size, stat.st_mtime_ns)).encode('utf-8'))
+    with open(filepath, 'rb') as f:
+        sha1.update(f.read(KEY_BLOCK_SIZE))
+        if stat.st_size > KEY_BLOCK_SIZE:
+            f.seek(max(stat.st_size - KEY_BLOCK_SIZE, KEY_BLOCK_SIZE))
+            sha1.update(f.read())
+    return sha1.hexdigest()
+
+
+class SessionCache:
+    """On-disk records of the cases opened before, keyed by get_content_key of their image files, so that an
+    unchanged case reopens without computing its stats again and with the view it was left in.
+    A record is a .json file of json serializable items and an optional compressed .npz file of arrays. Records are
+    evicted least recently used first when the cache directory exceeds budget_bytes.
+    A budget of 0 disables the cache."""
+
+    def __init__(self, cache_dir=None, budget_bytes=DEFAULT_SESSION_CACHE_BUDGET):
+        self.cache_dir = get_cache_dir('sessions') if cache_dir is None else cache_dir
+        self.budget_bytes = budget_bytes
+
+    def get_key(self, filepath):
+        """key of filepath, None if the cache is disabled"""
+        if self.budget_bytes <= 0:
+            return None
+        return get_content_key(filepath)
+
+    def load(self, key):
+        """items of the record of key, {} if there is none"""
+        if key is None:
+            return {}
+        json_filepath, _ = self._get_record_filepaths(key)
+        try:
+            with open(json_filepath, 'r') as f:
+                items = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        os.utime(json_filepath)  # last use for eviction
+        return items
+
+    def load_arrays(self, key):
+        """{name: array} of the record of key, None if there are none"""
+        if key is None:
+            return None
+        json_filepath, npz_filepath = self._get_record_filepaths(key)
+        if not os.path.exists(json_filepath):
+            return None
+        try:
+            with np.load(npz_filepath) as npz:
+                arrays = {name: npz[name] for name in npz.files}
+        except (OSError, ValueError, KeyError):
+            return None
+        os.utime(json_filepath)
+        return arrays
+
+    def update(self, key, arrays=None, **items):
+        """add items, and arrays {name: array} replacing the former ones, to the record of key.
+        return whether they are cached"""
+        if key is None:
+            return False
+        json_filepath, npz_filepath = self._get_record_filepaths(key)
+        record_items = self.load(key)
+        record_items.update(items)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            if arrays is not None:
+                # target id maps are mostly background, compressed they are far smaller and load about as fast
+                self._write_atomic(npz_filepath, lambda f: np.savez_compressed(f, **arrays), 'wb')
+            self._write_atomic(json_filepath, lambda f: json.dump(record_items, f), 'w')
+            self._evict(self.budget_bytes)  # this record is the latest used, so it is evicted last
+        except OSError:
+            self._remove_record(json_filepath, npz_filepath)
+            return False
+        return os.path.exists(json_filepath)
+
+    def clear(self):
+        for json_filepath, npz_filepath, _, _ in self._list_records():
+            self._remove_record(json_filepath, npz_filepath)
+
+    def get_nbytes(self):
+        return sum(record[3] for record in self._list_records())
+
+    def _get_record_filepaths(self, key):
+        return os.path.join(self.cache_dir, key + '.json'), os.path.join(self.cache_dir, key + '.npz')
+
+    def _list_records(self):
+        """[(json filepath, npz filepath, last use time, bytes)]"""
+        if not os.path.isdir(self.cache_dir):
+            return []
+        records = []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith('.json'):
+                continue
+            json_filepath, npz_filepath = self._get_record_filepaths(filename[:-len('.json')])
+            try:
+                records.append((json_filepath, npz_filepath, os.path.getmtime(json_filepath),
+                                os.path.getsize(json_filepath) +
+                                (os.path.getsize(npz_filepath) if os.path.exists(npz_filepath) else 0)))
+            except OSError:
+                self._remove_record(json_filepath, npz_filepath)
+        return records
+
+    def _evict(self, budget_bytes):
+        """remove least recently used records until they take at most budget_bytes"""
+        records = sorted(self._list_records(), key=lambda record: record[2])
+        nbytes = sum(record[3] for record in records)
+        for json_filepath, npz_filepath, _, record_nbytes in records:
+            if nbytes <= budget_bytes:
+                break
+            self._remove_record(json_filepath, npz_filepath)
+            nbytes -= record_nbytes
+
+    def _write_atomic(self, filepath, write_fn, mode):
+        fd, tmp_filepath = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, mode) as f:
+                write_fn(f)
+            os.replace(tmp_filepath, filepath)
+        except BaseException:
+            if os.path.exists(tmp_filepath):
+                os.remove(tmp_filepath)
+            raise
+
+    @staticmethod
+    def _remove_record(json_filepath, npz_filepath):
+        # json first, so that a half removed record is never loaded
+        for filepath in [json_filepath, npz_filepath]:
+            try:
+                os.remove(filepath)
+            except OSError:
+                pass
@@ -0,0 +1,93 @@
+import threading
+from collections import OrderedDict
+
+DEFAULT_SLICE_CACHE_BUDGET = 256 * 1024 ** 2  # bytes
+
+
+class SliceCache:
+    """Thread-safe LRU cache of rendered 2D slices, limited by the bytes of the cached arrays.
+    Cached arrays are read-only, they are shared with every caller that hits them."""
+
+    def __init__(self, budget_bytes=DEFAULT_SLICE_CACHE_BUDGET):
+        self.budget_bytes = budget_bytes
+        self._slices = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._slices
+
+    def get(self, key):
+        with self._lock:
+            img_slice = self._slices.get(key)
+            if img_slice is not None:
+                self._slices.move_to_end(key)
+            return img_slice
+
+    def put(self, key, img_slice, copy=False):
+        """copy: cache a copy of img_slice, made only if it fits in the budget"""
+        if img_slice.nbytes > self.budget_bytes:
+            return
+        if copy:
+            img_slice = img_slice.copy()
+        img_slice.flags.writeable = False
+        with self._lock:
+            if key in self._slices:
+                self._nbytes -= self._slices.pop(key).nbytes
+            self._slices[key] = img_slice
+            self._nbytes += img_slice.nbytes
+            while self._nbytes > self.budget_bytes:
+                self._nbytes -= self._slices.popitem(last=False)[1].nbytes
+
+    def clear(self):
+        with self._lock:
+            self._slices.clear()
+            self._nbytes = 0
+
+
+class SlicePrefetcher:
+    """Renders slices into a SliceCache in a background thread.
+    render_fn(*args) -> (key, img_slice) is called for every requested args not yet cached, in request order.
+    A new request replaces the pending one, so only the latest scrolling direction is followed."""
+
+    def __init__(self, render_fn, cache):
+        self._render_fn = render_fn
+        self._cache = cache
+        self._jobs = []  # [(key, args)]
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def request(self, jobs):
+        """jobs: [(key, args)]"""
+        with self._condition:
+            self._jobs = [job for job in jobs if job[0] not in self._cache]
+            if len(self._jobs) == 0:
+                return
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='SlicePrefetcher', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def cancel(self):
+        with self._condition:
+            self._jobs = []
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if len(self._jobs) == 0:
+                    self._condition.wait(timeout=5)
+                    if len(self._jobs) == 0:
+                        self._thread = None
+                        return
+                key, args = self._jobs.pop(0)
+            if key in self._cache:
+                continue
+            rendered_key, img_slice = self._render_fn(*args)
+            if img_slice is not None and rendered_key == key:
+                self._cache.put(key, img_slice)
@@ -0,0 +1,263 @@
+import glob
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from utils.cache_utils import get_cache_dir
+from utils.nifti_utils import read_array, read_nifti_voxels
+from utils.trace_utils import traced
+
+DEFAULT_VOLUME_CACHE_BUDGET = 8 * 1024 ** 3  # bytes
+
+
+def get_img_info(itk_img):
+    """geometry of a sitk image. size is x, y, z"""
+    return {
+        'size': list(itk_img.GetSize()),
+        'spacing': list(itk_img.GetSpacing()),
+        'origin': list(itk_img.GetOrigin()),
+        'direction': list(itk_img.GetDirection())
+    }
+
+
+def read_img_info(filepath):
+    """geometry of an image file read from its header only"""
+    import SimpleITK as sitk
+
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(filepath)
+    reader.ReadImageInformation()
+    return get_img_info(reader)
+
+
+def set_img_info(itk_img, img_info):
+    itk_img.SetSpacing(img_info['spacing'])
+    itk_img.SetOrigin(img_info['origin'])
+    itk_img.SetDirection(img_info['direction'])
+
+
+class VolumeCache:
+    """On-disk cache of decompressed voxel arrays (d, h, w) of image files, keyed by file path, size and mtime.
+    Each entry is a .npy file memory-mapped on reopen, a .json file of image geometry and stats, and optional
+    .level<k>.npy files of downsampled pyramid levels. Entries are evicted least recently used first when the
+    cache directory exceeds budget_bytes.
+    A budget of 0 disables the cache."""
+
+    def __init__(self, cache_dir=None, budget_bytes=DEFAULT_VOLUME_CACHE_BUDGET):
+        self.cache_dir = get_cache_dir('volumes') if cache_dir is None else cache_dir
+        self.budget_bytes = budget_bytes
+
+    @traced()
+    def read_img(self, filepath, dtype=None):
+        """Return (voxel array (d, h, w), img_info with min_val and max_val of the voxels in the file) of filepath,
+        which is read and cached if not cached yet.
+        dtype None returns a read-only memory map of the cached array (or the array as read if it can not be
+        cached), otherwise a new writable array of dtype, allocated once without a full size intermediate copy
+        for cached volumes and plain NIfTI files. An array of dtype is cached only if it holds the voxels of the
+        file unchanged."""
+        cached = self.load(filepath, dtype)
+        if cached is not None:
+            return cached
+        img, img_info = VolumeCache.read_file(filepath, dtype)
+        if dtype is not None and not VolumeCache.is_lossless_cast(img_info, dtype):
+            return img, img_info  # voxels are changed by the cast, do not cache them as the file
+        if self.store(filepath, img, img_info) and dtype is None:
+            # the memory map of the cache instead, whose pages can be dropped by the system
+            del img
+            cached = self.load(filepath)
+            if cached is None:
+                raise OSError('Failed to read %s back from the volume cache' % filepath)
+            return cached
+        return img, img_info
+
+    @staticmethod
+    def is_lossless_cast(img_info, dtype):
+        """whether voxels of the file of img_info (as returned by read_file) are unchanged when cast to dtype"""
+        file_dtype = np.dtype(img_info['dtype'])
+        if np.can_cast(file_dtype, dtype, 'safe'):
+            return True
+        if not np.issubdtype(file_dtype, np.integer) or not np.issubdtype(dtype, np.integer):
+            return False
+        return img_info['min_val'] is None or \
+            np.iinfo(dtype).min <= img_info['min_val'] <= img_info['max_val'] <= np.iinfo(dtype).max
+
+    @staticmethod
+    @traced()
+    def read_file(filepath, dtype=None):
+        """return (new voxel array (d, h, w) of dtype, img_info with min_val, max_val and dtype of the voxels in the
+        file) of an image file"""
+        import SimpleITK as sitk
+
+        reader = sitk.ImageFileReader()
+        reader.SetFileName(filepath)
+        reader.ReadImageInformation()
+        img_info = get_img_info(reader)
+        if reader.GetNumberOfComponents() == 1:
+            streamed = read_nifti_voxels(filepath, dtype)
+            if streamed is not None and list(streamed[0].shape) == img_info['size'][::-1]:
+                img, img_info['min_val'], img_info['max_val'], file_dtype = streamed
+                img_info['dtype'] = file_dtype.name
+                return img, img_info
+        itk_img = reader.Execute()
+        img_info = get_img_info(itk_img)
+        img = sitk.GetArrayViewFromImage(itk_img)  # no copy, valid while itk_img is alive
+        img_info['min_val'] = img.min().item()
+        img_info['max_val'] = img.max().item()
+        img_info['dtype'] = img.dtype.name
+        return np.array(img, dtype), img_info
+
+    def load(self, filepath, dtype=None):
+        """return (voxel array, img_info) or None if not cached. see read_img for dtype"""
+        if self.budget_bytes <= 0:
+            return None
+        npy_filepath, json_filepath = self._get_entry_filepaths(filepath)
+        try:
+            with open(json_filepath, 'r') as f:
+                img_info = json.load(f)
+            img = np.load(npy_filepath, mmap_mode='r')
+        except (OSError, ValueError):
+            self._remove_entry(npy_filepath, json_filepath)
+            return None
+        if list(img.shape) != img_info['size'][::-1]:
+            self._remove_entry(npy_filepath, json_filepath)
+            return None
+        os.utime(json_filepath)  # last use for eviction
+        if 'min_val' not in img_info:
+            img_info['min_val'] = img.min().item()
+            img_info['max_val'] = img.max().item()
+            self.update_info(filepath, min_val=img_info['min_val'], max_val=img_info['max_val'])
+        if dtype is not None:
+            if not img.flags.c_contiguous:
+                return np.array(img, dtype), img_info
+            # read by the file instead of the memory map, whose pages would stay resident while it is mapped
+            with open(npy_filepath, 'rb') as f:
+                f.seek(img.offset)
+                img = read_array(f, img.shape, img.dtype, dtype)[0]
+        return img, img_info
+
+    @traced()
+    def store(self, filepath, img, img_info):
+        """cache img (d, h, w) and json serializable img_info of filepath. return whether it is cached"""
+        if self.budget_bytes <= 0 or img.nbytes > self.budget_bytes:
+            return False
+        npy_filepath, json_filepath = self._get_entry_filepaths(filepath)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._evict(self.budget_bytes - img.nbytes)
+            self._write_atomic(npy_filepath, lambda f: np.save(f, img), 'wb')
+            self._write_atomic(json_filepath, lambda f: json.dump(img_info, f), 'w')
+        except OSError:
+            self._remove_entry(npy_filepath, json_filepath)
+            return False
+        return True
+
+    def load_level(self, filepath, level):
+        """return read-only memory map of pyramid level (k >= 1) of a cached filepath, None if not cached"""
+        if self.budget_bytes <= 0:
+            return None
+        try:
+            return np.load(self._get_level_filepath(filepath, level), mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+
+    def store_level(self, filepath, level, img):
+        """cache pyramid level (k >= 1) of a cached filepath. return whether it is cached"""
+        if self.budget_bytes <= 0:
+            return False
+        npy_filepath, json_filepath = self._get_entry_filepaths(filepath)
+        level_filepath = self._get_level_filepath(filepath, level)
+        try:
+            os.utime(json_filepath)  # the latest used, so that it is evicted last
+            self._evict(self.budget_bytes - img.nbytes)
+            if not os.path.exists(json_filepath):
+                return False
+            self._write_atomic(level_filepath, lambda f: np.save(f, img), 'wb')
+        except OSError:
+            return False
+        return True
+
+    def update_info(self, filepath, **items):
+        """add items to img_info of a cached filepath"""
+        if self.budget_bytes <= 0:
+            return
+        _, json_filepath = self._get_entry_filepaths(filepath)
+        try:
+            with open(json_filepath, 'r') as f:
+                img_info = json.load(f)
+            img_info.update(items)
+            self._write_atomic(json_filepath, lambda f: json.dump(img_info, f), 'w')
+        except (OSError, ValueError):
+            pass
+
+    def clear(self):
+        for npy_filepath, json_filepath, _, _ in self._list_entries():
+            self._remove_entry(npy_filepath, json_filepath)
+
+    def get_nbytes(self):
+        return sum(entry[3] for entry in self._list_entries())
+
+    def _get_entry_filepaths(self, filepath):
+        stat = os.stat(filepath)
+        key = '%s|%d|%d' % (os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns)
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, name + '.npy'), os.path.join(self.cache_dir, name + '.json')
+
+    def _get_level_filepath(self, filepath, level):
+        npy_filepath, _ = self._get_entry_filepaths(filepath)
+        return npy_filepath[:-len('.npy')] + '.level%d.npy' % level
+
+    @staticmethod
+    def _list_level_filepaths(npy_filepath):
+        return glob.glob(glob.escape(npy_filepath[:-len('.npy')]) + '.level*.npy')
+
+    def _list_entries(self):
+        """[(npy filepath, json filepath, last use time, bytes)]"""
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith('.json'):
+                continue
+            json_filepath = os.path.join(self.cache_dir, filename)
+            npy_filepath = json_filepath[:-len('.json')] + '.npy'
+            try:
+                entries.append((npy_filepath, json_filepath, os.path.getmtime(json_filepath),
+                                os.path.getsize(npy_filepath) + os.path.getsize(json_filepath) +
+                                sum(os.path.getsize(level_filepath) for level_filepath in
+                                    VolumeCache._list_level_filepaths(npy_filepath))))
+            except OSError:
+                self._remove_entry(npy_filepath, json_filepath)
+        return entries
+
+    def _evict(self, budget_bytes):
+        """remove least recently used entries until they take at most budget_bytes"""
+        entries = sorted(self._list_entries(), key=lambda entry: entry[2])
+        nbytes = sum(entry[3] for entry in entries)
+        for npy_filepath, json_filepath, _, entry_nbytes in entries:
+            if nbytes <= budget_bytes:
+                break
+            self._remove_entry(npy_filepath, json_filepath)
+            nbytes -= entry_nbytes
+
+    def _write_atomic(self, filepath, write_fn, mode):
+        fd, tmp_filepath = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, mode) as f:
+                write_fn(f)
+            os.replace(tmp_filepath, filepath)
+        except BaseException:
+            if os.path.exists(tmp_filepath):
+                os.remove(tmp_filepath)
+            raise
+
+    @staticmethod
+    def _remove_entry(npy_filepath, json_filepath):
+        # json first, so that a half removed entry is never loaded
+        for filepath in [json_filepath, npy_filepath] + VolumeCache._list_level_filepaths(npy_filepath):
+            try:
+                os.remove(filepath)
+            except OSError:
+                pass
@@ -0,0 +1,132 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from utils.batch_utils import CaseResultFile, find_cases, run_cases
+
+FIELDNAMES = ['label', 'source_labels', 'voxels', 'targets', 'removed_targets', 'removed_voxels']
+SPEC_KEYS = ['label_map', 'min_target_size', 'keep_largest']
+
+
+def load_spec(filepath):
+    """Cleanup spec of a json file, the keyword arguments of Model.clean_anno:
+    {"label_map": {"3": 2, "5": 0}, "min_target_size": 10 or {"1": 10}, "keep_largest": 1 or {"2": 1}}.
+    All keys are optional. raise ValueError if it is not valid"""
+    from model.model import MAX_LABEL
+
+    with open(filepath, 'r') as f:
+        spec = json.load(f)
+    if not isinstance(spec, dict) or any(key not in SPEC_KEYS for key in spec):
+        raise ValueError('spec should be a json object of %s' % ', '.join(SPEC_KEYS))
+
+    def parse_label(label, min_label):
+        if isinstance(label, str) and label.isdigit():
+            label = int(label)
+        if not isinstance(label, int) or isinstance(label, bool) or not min_label <= label <= MAX_LABEL:
+            raise ValueError('invalid label %r, labels are %d to %d' % (label, min_label, MAX_LABEL))
+        return label
+
+    def parse_limit(key):
+        limit = spec.get(key)
+        if isinstance(limit, dict):
+            return {parse_label(label, 1): parse_limit_value(key, value) for label, value in limit.items()}
+        return None if limit is None else parse_limit_value(key, limit)
+
+    def parse_limit_value(key, value):
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            raise ValueError('%s should be a non-negative int or {label: int}, not %r' % (key, value))
+        return value
+
+    label_map = spec.get('label_map', {})
+    if not isinstance(label_map, dict):
+        raise ValueError('label_map should be {label: new label}')
+    return {'label_map': {parse_label(label, 1): parse_label(new_label, 0) for label, new_label in label_map.items()},
+            'min_target_size': parse_limit('min_target_size'),
+            'keep_largest': parse_limit('keep_largest')}
+
+
+def clean_case(case, raw_filepath, anno_filepath, output_filepath, spec):
+    """Clean up an annotation file by spec (see load_spec) and write it to output_filepath, None for a dry run.
+    return the report rows of Model.clean_anno"""
+    # imported in the worker processes, model imports neither Qt nor the controllers
+    from model.model import Model
+    from model.volume_cache import VolumeCache, read_img_info
+
+    raw_img_info = read_img_info(raw_filepath)
+    anno_img, anno_img_info = VolumeCache.read_file(anno_filepath, np.int8)
+    Model.check_anno_img_info(anno_img_info, raw_img_info)
+    new_anno_img, report = Model.clean_anno(anno_img, **spec)
+    if output_filepath is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(output_filepath)), exist_ok=True)
+        # one compressing thread, the cases are already run in a process per CPU
+        Model.write_anno(output_filepath, new_anno_img, anno_img_info, num_workers=1)
+    for row in report:
+        row['source_labels'] = ' '.join(str(label) for label in row['source_labels'])
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m scripts.batch_cleanup',
+        description='Change labels and remove small or extra targets of every annotation file of a data directory, '
+                    'without the GUI. A report of the labels and removed targets of every case is written.')
+    parser.add_argument('data_dir', help='directory of raw images (.nii.gz or .nii), searched recursively')
+    parser.add_argument('spec', help='json cleanup spec, e.g. {"label_map": {"3": 2, "5": 0}, '
+                                     '"min_target_size": 10, "keep_largest": {"2": 1}}')
+    parser.add_argument('report', help='report file, .csv (a line per label) or .jsonl (a line per case)')
+    output_group = parser.add_mutually_exclusive_group(required=True)
+    output_group.add_argument('-o', '--output-dir',
+                              help='directory of cleaned annotations, in the same layout as the annotations')
+    output_group.add_argument('-n', '--dry-run', action='store_true', help='only write the report')
+    parser.add_argument('--anno-dir', default=None,
+                        help='directory of annotations in the same layout as data_dir (default: data_dir)')
+    parser.add_argument('--anno-suffix', default=None,
+                        help='annotation of <name>.nii.gz is <name><suffix>.nii.gz (default: _seg in data_dir, '
+                             'none in another anno dir)')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of processes (default: all cpus)')
+    parser.add_argument('--resume', action='store_true',
+                        help='keep the cases already done in report and skip them, instead of overwriting it')
+    args = parser.parse_args(argv)
+    try:
+        spec = load_spec(args.spec)
+    except (OSError, ValueError) as e:
+        parser.error('can not load spec %s: %s' % (args.spec, e))
+
+    anno_dir = args.data_dir if args.anno_dir is None else args.anno_dir
+    jobs = []
+    for case, raw_filepath, anno_filepath in find_cases(args.data_dir, args.anno_dir, args.anno_suffix):
+        output_filepath = None
+        if not args.dry_run:
+            output_filepath = os.path.join(args.output_dir, os.path.relpath(anno_filepath, anno_dir))
+            if os.path.abspath(output_filepath) == os.path.abspath(anno_filepath):
+                parser.error('output dir %s would overwrite the annotations' % args.output_dir)
+        jobs.append((case, raw_filepath, anno_filepath, output_filepath, spec))
+
+    with CaseResultFile(args.report, FIELDNAMES, args.resume) as report_file:
+        todo_jobs = [job for job in jobs if job[0] not in report_file.done_cases]
+        print('%d cases found, %d done before, %d to do' % (len(jobs), len(jobs) - len(todo_jobs), len(todo_jobs)),
+              file=sys.stderr)
+        num_errors = 0
+        removed_targets = removed_voxels = 0
+        start = time.time()
+        for i, (job, rows, error) in enumerate(run_cases(clean_case, todo_jobs, args.workers)):
+            report_file.write(job[0], rows, error)
+            if error is not None:
+                num_errors += 1
+                print('%s: %s' % (job[0], error), file=sys.stderr)
+            else:
+                removed_targets += sum(row['removed_targets'] for row in rows)
+                removed_voxels += sum(row['removed_voxels'] for row in rows)
+            print('[%d/%d] %s, %.1fs' % (i + 1, len(todo_jobs), job[0], time.time() - start), file=sys.stderr)
+    print('%d cases %s, %d failed. %d targets and %d voxels removed (including dropped labels)' % (
+        len(todo_jobs) - num_errors, 'checked' if args.dry_run else 'cleaned', num_errors, removed_targets,
+        removed_voxels), file=sys.stderr)
+    return 1 if num_errors > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
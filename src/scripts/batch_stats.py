@@ -0,0 +1,74 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from utils.batch_utils import CaseResultFile, find_cases, run_cases
+
+FIELDNAMES = ['target', 'label', 'voxel_count', 'volume_mm3', 'center_x', 'center_y', 'center_z',
+              'bbox_x0', 'bbox_x1', 'bbox_y0', 'bbox_y1', 'bbox_z0', 'bbox_z1']
+
+
+def compute_case_stats(case, raw_filepath, anno_filepath):
+    """Target stats of an annotation file the same as the program shows them, without the volume cache, as
+    processes of a batch would contend for it. Only the header of the raw image is read to check the size.
+    return [{fieldname: value}] of targets ordered by label, coordinates are voxel indices (x, y, z)"""
+    # imported in the worker processes, model imports neither Qt nor the controllers
+    from model.model import Model
+    from model.volume_cache import VolumeCache, read_img_info
+
+    raw_img_info = read_img_info(raw_filepath)
+    anno_img, anno_img_info = VolumeCache.read_file(anno_filepath, np.int8)
+    Model.check_anno_img_info(anno_img_info, raw_img_info)
+    anno_stats = Model.compute_anno_stats(anno_img)
+    voxel_volume = float(np.prod(anno_img_info['spacing']))
+    rows = []
+    for i in np.argsort(anno_stats['target_labels'], kind='stable'):
+        d, h, w = anno_stats['target_centers'][i].tolist()
+        (d0, d1), (h0, h1), (w0, w1) = anno_stats['target_bboxes'][i].tolist()
+        voxel_count = int(anno_stats['target_voxel_counts'][i])
+        rows.append({
+            'target': len(rows) + 1, 'label': int(anno_stats['target_labels'][i]), 'voxel_count': voxel_count,
+            'volume_mm3': voxel_count * voxel_volume, 'center_x': w, 'center_y': h, 'center_z': d,
+            'bbox_x0': w0, 'bbox_x1': w1, 'bbox_y0': h0, 'bbox_y1': h1, 'bbox_z0': d0, 'bbox_z1': d1
+        })
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m scripts.batch_stats',
+        description='Target stats (label, voxel count, volume, center and bbox) of every annotation file of a data '
+                    'directory, without the GUI.')
+    parser.add_argument('data_dir', help='directory of raw images (.nii.gz or .nii), searched recursively')
+    parser.add_argument('output', help='result file, .csv (a line per target) or .jsonl (a line per case)')
+    parser.add_argument('--anno-dir', default=None,
+                        help='directory of annotations in the same layout as data_dir (default: data_dir)')
+    parser.add_argument('--anno-suffix', default=None,
+                        help='annotation of <name>.nii.gz is <name><suffix>.nii.gz (default: _seg in data_dir, '
+                             'none in another anno dir)')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of processes (default: all cpus)')
+    parser.add_argument('--resume', action='store_true',
+                        help='keep the cases already done in output and skip them, instead of overwriting it')
+    args = parser.parse_args(argv)
+
+    cases = find_cases(args.data_dir, args.anno_dir, args.anno_suffix)
+    with CaseResultFile(args.output, FIELDNAMES, args.resume) as result_file:
+        todo_cases = [case for case in cases if case[0] not in result_file.done_cases]
+        print('%d cases found, %d done before, %d to do' % (len(cases), len(cases) - len(todo_cases),
+                                                              len(todo_cases)), file=sys.stderr)
+        num_errors = 0
+        start = time.time()
+        for i, (case, rows, error) in enumerate(run_cases(compute_case_stats, todo_cases, args.workers)):
+            result_file.write(case[0], rows, error)
+            if error is not None:
+                num_errors += 1
+                print('%s: %s' % (case[0], error), file=sys.stderr)
+            print('[%d/%d] %s, %.1fs' % (i + 1, len(todo_cases), case[0], time.time() - start), file=sys.stderr)
+    print('%d cases done, %d failed' % (len(todo_cases) - num_errors, num_errors), file=sys.stderr)
+    return 1 if num_errors > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,200 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+SHAPES = {  # d, h, w
+    'small': (64, 256, 256),
+    'medium': (128, 512, 512),
+    'large': (256, 512, 512),
+}
+DEFAULT_SHAPES = ['small', 'medium']
+DEFAULT_NUM_TARGETS = [10, 1000]
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 1.5  # slower than baseline by this ratio is a regression
+MIN_REGRESSION_SECONDS = 0.1e-3  # smaller differences are noise of the timer and scheduler
+
+
+def time_calls(fn, args_list):
+    """seconds of fn(*args) for every args of args_list"""
+    times = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def benchmark_case(dirname, shape, num_targets, repeat):
+    """Time the model hot paths on a synthetic CT image of shape (d, h, w) with num_targets targets.
+    return [(benchmark name, [seconds of each run])]"""
+    from model.brush import BRUSH_TYPE_CIRCLE_BRUSH, BRUSH_TYPE_SPHERE_BRUSH
+    from model.edit_journal import EditJournal
+    from model.model import Model
+    from model.session_cache import SessionCache
+    from model.volume_cache import VolumeCache
+    from scripts.measure_update_scenes import write_case
+
+    raw_filepath, anno_filepath = write_case(dirname, shape, num_targets)
+    cache_dir = os.path.join(dirname, 'cache')
+    rng = np.random.RandomState(0)
+    results = []
+
+    def new_model(cache_budget):
+        # no slice cache, every 2D map is rendered
+        return Model(slice_cache_budget=0, volume_cache=VolumeCache(cache_dir, cache_budget),
+                     edit_journal=EditJournal(os.path.join(cache_dir, 'journals')),
+                     session_cache=SessionCache(os.path.join(cache_dir, 'sessions'), cache_budget))
+
+    def read_case(model):
+        model.read_img(raw_filepath, 'raw')
+        model.read_img(anno_filepath, 'anno')
+
+    model = new_model(0)
+    results.append(('read_img raw, no volume cache',
+                    time_calls(lambda: model.read_img(raw_filepath, 'raw'), [()] * repeat)))
+    results.append(('read_img anno, no volume cache',
+                    time_calls(lambda: model.read_img(anno_filepath, 'anno'), [()] * repeat)))
+    model = new_model(8 * 1024 ** 3)
+    read_case(model)  # fills the volume cache
+    results.append(('read_img raw, cached', time_calls(lambda: model.read_img(raw_filepath, 'raw'), [()] * repeat)))
+    results.append(('read_img anno, cached',
+                    time_calls(lambda: model.read_img(anno_filepath, 'anno'), [()] * repeat)))
+    results.append(('compute_img_stats raw', time_calls(lambda: model.compute_img_stats('raw'), [()] * repeat)))
+    results.append(('compute_img_stats anno', time_calls(lambda: model.compute_img_stats('anno'), [()] * repeat)))
+
+    size = model.get_size()  # x, y, z
+    for view, axis in [('a', 2), ('s', 0), ('c', 1)]:
+        indices = [(view, int(index)) for index in rng.randint(0, size[axis], repeat)]
+        results.append(('get_2D_map_in_window raw %s' % view, time_calls(
+            lambda view, index: model.get_2D_map_in_window(view, index, 'raw', -160, 240), indices)))
+        results.append(('get_2D_map_in_window anno %s' % view, time_calls(
+            lambda view, index: model.get_2D_map_in_window(view, index, 'anno', colored_anno=True, alpha=0.5),
+            indices)))
+
+    points = [tuple(int(rng.randint(0, size[i])) for i in range(3)) for _ in range(repeat)]
+    paint_times = {'anno_paint circle 20': [], 'anno_paint sphere 20': [], 'update_anno_stats after painting': []}
+    for point in points:
+        paint_times['anno_paint circle 20'] += time_calls(
+            lambda x, y, z: model.anno_paint(x, y, z, 'z', 1, BRUSH_TYPE_CIRCLE_BRUSH, 20, new_step=True), [point])
+        paint_times['anno_paint sphere 20'] += time_calls(
+            lambda x, y, z: model.anno_paint(x, y, z, 'z', 2, BRUSH_TYPE_SPHERE_BRUSH, 20, new_step=True), [point])
+        paint_times['update_anno_stats after painting'] += time_calls(model.update_anno_stats, [()])
+    results += list(paint_times.items())
+    results.append(('undo_paint', time_calls(model.undo_paint, [()] * repeat)))
+    results.append(('redo_paint', time_calls(model.redo_paint, [()] * repeat)))
+    model.update_anno_stats()  # targets touched by undo and redo get new ids
+    target_ids = model.get_anno_target_ids()
+    target_ids = [(int(target_id),) for target_id in rng.permutation(target_ids)[:repeat]]
+    results.append(('delete_target', time_calls(model.delete_target, target_ids)))
+    save_filepath = os.path.join(dirname, 'saved.nii.gz')
+    results.append(('save_anno .nii.gz', time_calls(lambda: model.save_anno(save_filepath), [()] * repeat)))
+    model.discard_unsaved_edits()
+    return results
+
+
+def get_environment():
+    import PyQt5.QtCore
+    import SimpleITK as sitk
+
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'commit': commit,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'simpleitk': sitk.Version_VersionString(),
+        'qt': PyQt5.QtCore.QT_VERSION_STR,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Print the min times against baseline, as the min of the runs is the least disturbed by other load.
+    return the number of regressions, slower by more than threshold and MIN_REGRESSION_SECONDS"""
+    baseline_mins = {(result['case'], result['name']): result['min'] for result in baseline['results']}
+    num_regressions = 0
+    print('%-16s %-36s %12s %12s %8s' % ('case', 'benchmark', 'baseline ms', 'min ms', 'ratio'))
+    for result in results:
+        baseline_min = baseline_mins.get((result['case'], result['name']))
+        if baseline_min is None:
+            print('%-16s %-36s %12s %12.2f %8s' % (result['case'], result['name'], '', result['min'] * 1000, ''))
+            continue
+        ratio = result['min'] / baseline_min if baseline_min > 0 else float('inf')
+        regression = ratio > threshold and result['min'] - baseline_min > MIN_REGRESSION_SECONDS
+        num_regressions += regression
+        print('%-16s %-36s %12.2f %12.2f %8.2f%s' % (result['case'], result['name'], baseline_min * 1000,
+                                                    result['min'] * 1000, ratio, '  slower' if regression else ''))
+    return num_regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m scripts.benchmark',
+        description='Time the model hot paths on synthetic CT images and label maps. Results are written as json '
+                    'and may be compared to the json of a former run.')
+    parser.add_argument('-o', '--output', help='json file of the results')
+    parser.add_argument('-b', '--baseline', help='json file of a former run to compare with')
+    parser.add_argument('-s', '--shapes', nargs='+', default=DEFAULT_SHAPES,
+                        help='image shapes, %s or DxHxW (default: %s)' % (', '.join(SHAPES), ' '.join(DEFAULT_SHAPES)))
+    parser.add_argument('-t', '--targets', nargs='+', type=int, default=DEFAULT_NUM_TARGETS,
+                        help='numbers of targets in the label map (default: %s)' %
+                             ' '.join(str(n) for n in DEFAULT_NUM_TARGETS))
+    parser.add_argument('-r', '--repeat', type=int, default=DEFAULT_REPEAT,
+                        help='runs of each benchmark (default: %d)' % DEFAULT_REPEAT)
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='min time ratio to the baseline above which a benchmark is a regression '
+                             '(default: %g)' % DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+    shapes = []
+    for shape in args.shapes:
+        try:
+            shapes.append(SHAPES[shape] if shape in SHAPES else tuple(int(s) for s in shape.split('x')))
+        except ValueError:
+            parser.error('invalid shape %s' % shape)
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    results = []
+    for shape in shapes:
+        for num_targets in args.targets:
+            case = '%dx%dx%d/%d' % (shape + (num_targets,))
+            print('benchmarking %s' % case, file=sys.stderr)
+            with tempfile.TemporaryDirectory() as dirname:
+                for name, times in benchmark_case(dirname, shape, num_targets, args.repeat):
+                    results.append({'case': case, 'shape': list(shape), 'num_targets': num_targets, 'name': name,
+                                    'times': times, 'median': float(np.median(times)), 'min': min(times)})
+    output = {'environment': get_environment(), 'repeat': args.repeat, 'results': results}
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=1)
+
+    if baseline is None:
+        print('%-16s %-36s %12s %12s' % ('case', 'benchmark', 'median ms', 'min ms'))
+        for result in results:
+            print('%-16s %-36s %12.2f %12.2f' % (result['case'], result['name'], result['median'] * 1000,
+                                                result['min'] * 1000))
+        return 0
+    num_regressions = compare(results, baseline, args.threshold)
+    print('%d of %d benchmarks slower than the baseline by more than x%g' % (num_regressions, len(results),
+                                                                             args.threshold))
+    return 1 if num_regressions > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
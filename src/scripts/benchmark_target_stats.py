@@ -0,0 +1,57 @@
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from model.edit_journal import EditJournal
+from model.model import Model
+from model.session_cache import SessionCache
+from model.volume_cache import VolumeCache
+
+
+def make_anno_img(shape, num_targets, seed=0):
+    """label map (d, h, w) with num_targets separated cubes of random labels"""
+    rng = np.random.RandomState(seed)
+    anno_img = np.zeros(shape, np.int8)
+    grid = int(np.ceil(num_targets ** (1 / 3)))
+    cell = [s // grid for s in shape]
+    for i_target in range(num_targets):
+        cell_pos = np.unravel_index(i_target, [grid, grid, grid])
+        start = [cell_pos[i] * cell[i] + 1 for i in range(3)]
+        size = [max(min(cell[i] - 2, 6), 1) for i in range(3)]
+        anno_img[start[0]:start[0] + size[0], start[1]:start[1] + size[1], start[2]:start[2] + size[2]] = \
+            rng.randint(1, 6)
+    return anno_img
+
+
+def benchmark(shape=(128, 256, 256), num_targets_list=(1, 10, 100, 1000), repeat=3):
+    print('volume shape (d, h, w): %s' % (shape,))
+    print('%12s %12s %12s' % ('num_targets', 'found', 'seconds'))
+    size = list(shape[::-1])  # x, y, z
+    with tempfile.TemporaryDirectory() as dirname:
+        # caches disabled and the journal in dirname, so the stats are always computed and nothing is left behind
+        model = Model(volume_cache=VolumeCache(dirname, 0), edit_journal=EditJournal(os.path.join(dirname, 'journals')),
+                      session_cache=SessionCache(dirname, 0))
+        raw_filepath = os.path.join(dirname, 'raw.nii.gz')
+        model.set_img(raw_filepath, 'raw', np.zeros(shape, np.int16), {'size': size, 'min_val': 0, 'max_val': 0})
+        for num_targets in num_targets_list:
+            anno_img = make_anno_img(shape, num_targets)
+            model.set_img(os.path.join(dirname, 'anno.nii.gz'), 'anno', anno_img,
+                          {'size': size, 'min_val': 0, 'max_val': anno_img.max().item()})
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                model.compute_img_stats('anno')
+                times.append(time.perf_counter() - start)
+            print('%12d %12d %12.3f' % (num_targets, len(model.get_anno_target_ids()), min(times)))
+        model.clear()
+
+if __name__ == '__main__':
+    if len(sys.argv) == 1:
+        benchmark()
+    elif len(sys.argv) == 4:
+        benchmark(shape=tuple(int(s) for s in sys.argv[1:4]))
+    else:
+        raise AttributeError('unsupported argv: %s' % sys.argv)
@@ -0,0 +1,105 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+from scripts.measure_update_scenes import write_case
+
+DEFAULT_SHAPE = (128, 512, 512)
+
+
+def get_rss():
+    """(resident set size, peak resident set size) of this process in bytes. rss is None if unknown"""
+    if os.path.exists('/proc/self/status'):
+        # ru_maxrss of linux is inherited from the parent process, VmHWM is not
+        rss = {}
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:') or line.startswith('VmHWM:'):
+                    rss[line.split(':')[0]] = int(line.split()[1]) * 1024
+        return rss['VmRSS'], rss['VmHWM']
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return None, peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+def reset_peak_rss():
+    """make the peak RSS the current RSS (linux only), return whether it is done"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def open_case(raw_filepath, anno_filepath, cache_dir, cache_budget):
+    """Open a case like the program does. return [(step, peak RSS above the RSS before the step,
+    RSS kept after the step)] in bytes. If the peak can not be reset between the steps, peaks are of the
+    whole process above the RSS before the first step"""
+    from model.edit_journal import EditJournal
+    from model.model import Model
+    from model.session_cache import SessionCache
+    from model.volume_cache import VolumeCache
+
+    model = Model(volume_cache=VolumeCache(cache_dir, cache_budget),
+                  edit_journal=EditJournal(os.path.join(cache_dir, 'journals')),
+                  session_cache=SessionCache(os.path.join(cache_dir, 'sessions'), cache_budget))
+
+    def read_img(img_type, filepath):
+        img, img_info = model.read_img_data(filepath, img_type)
+        model.set_img(filepath, img_type, img, img_info)
+
+    steps = [('read raw', lambda: read_img('raw', raw_filepath)),
+             ('read anno', lambda: read_img('anno', anno_filepath)),
+             ('target stats', lambda: model.compute_img_stats('anno'))]
+    results = []
+    start_rss = None
+    for name, step in steps:
+        reset = reset_peak_rss()
+        rss, _ = get_rss()
+        if start_rss is None or reset:
+            start_rss = rss
+        step()
+        new_rss, peak_rss = get_rss()
+        results.append((name, peak_rss - start_rss, new_rss - rss))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m scripts.measure_open_memory',
+        description='Print the memory taken by opening a synthetic case without cache, for the first time and again')
+    parser.add_argument('-s', '--shape', nargs=3, type=int, default=DEFAULT_SHAPE, metavar=('D', 'H', 'W'),
+                        help='image shape (default: %s)' % ' '.join(str(n) for n in DEFAULT_SHAPE))
+    # the measurement of one case, run by main in a new process
+    parser.add_argument('--open', nargs=4, metavar=('RAW', 'ANNO', 'CACHE_DIR', 'CACHE_BUDGET'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.open is not None:
+        raw_filepath, anno_filepath, cache_dir, cache_budget = args.open
+        print(json.dumps(open_case(raw_filepath, anno_filepath, cache_dir, int(cache_budget))))
+        return 0
+    shape = tuple(args.shape)
+    label_map_nbytes = shape[0] * shape[1] * shape[2]  # int8
+    print('volume shape (d, h, w): %s, label map %.1f MB' % (shape, label_map_nbytes / 1024 ** 2))
+    print('%-16s %-14s %14s %12s %14s %12s' % ('case', 'step', 'peak RSS MB', 'label maps', 'kept RSS MB',
+                                                'label maps'))
+    with tempfile.TemporaryDirectory() as dirname:
+        raw_filepath, anno_filepath = write_case(dirname, shape)
+        cache_dir = os.path.join(dirname, 'cache')
+        # every case in a new process, as the peak RSS of a process never decreases
+        for name, cache_budget in [('no cache', 0), ('first open', 8 * 1024 ** 3), ('reopen', 8 * 1024 ** 3)]:
+            output = subprocess.check_output(
+                [sys.executable, '-m', 'scripts.measure_open_memory', '--open', raw_filepath, anno_filepath,
+                 cache_dir, str(cache_budget)])
+            for step, peak_increase, rss_increase in json.loads(output.decode('utf-8').splitlines()[-1]):
+                print('%-16s %-14s %14.1f %12.2f %14.1f %12.2f' % (
+                    name, step, peak_increase / 1024 ** 2, peak_increase / label_map_nbytes,
+                    rss_increase / 1024 ** 2, rss_increase / label_map_nbytes))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,56 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_RUNS = 5
+STARTUP_TIMEOUT = 120  # seconds
+STAGES = [('main', 'app.main entered'), ('show', 'window shown'), ('first_paint', 'first paint')]
+
+
+def measure_run(command):
+    """seconds from launching command to each of STAGES, reported by app.py --startup-time"""
+    with tempfile.TemporaryDirectory() as dirname:
+        times_filepath = os.path.join(dirname, 'startup.json')
+        start = time.time()
+        subprocess.run(command + ['--startup-time', times_filepath], cwd=SRC_DIR, timeout=STARTUP_TIMEOUT, check=True)
+        with open(times_filepath, 'r') as f:
+            times = json.load(f)
+    return [times[stage] - start for stage, _ in STAGES]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m scripts.measure_startup',
+        description='Launch the app several times and print the time to its first paint. The first run may be '
+                    'slower as the files of the libraries are not in the disk cache yet.')
+    parser.add_argument('-e', '--executable',
+                        help='frozen app built by generate_binary.sh, e.g. dist/MedicalLabelMe/MedicalLabelMe '
+                             '(default: run app.py with this python)')
+    parser.add_argument('-n', '--runs', type=int, default=DEFAULT_RUNS,
+                        help='number of launches (default: %d)' % DEFAULT_RUNS)
+    args = parser.parse_args(argv)
+    if args.executable is None:
+        command = [sys.executable, os.path.join(SRC_DIR, 'app.py')]
+    else:
+        command = [os.path.abspath(args.executable)]
+
+    print('%-8s' % 'run' + ''.join('%20s' % ('%s ms' % name) for _, name in STAGES))
+    all_times = []
+    for i in range(args.runs):
+        all_times.append(measure_run(command))
+        print('%-8d' % (i + 1) + ''.join('%20.1f' % (t * 1000) for t in all_times[-1]))
+    all_times = np.array(all_times)
+    print('%-8s' % 'median' + ''.join('%20.1f' % (t * 1000) for t in np.median(all_times, axis=0)))
+    print('%-8s' % 'min' + ''.join('%20.1f' % (t * 1000) for t in all_times.min(axis=0)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
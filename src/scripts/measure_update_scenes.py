@@ -0,0 +1,108 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import SimpleITK as sitk
+import numpy as np
+from PyQt5.QtWidgets import QApplication
+
+from controller.main_window_controller import MainWindow
+from scripts.benchmark_target_stats import make_anno_img
+from utils.cache_utils import CACHE_DIR_ENV
+
+DEFAULT_SHAPE = (64, 512, 512)
+
+
+def write_case(dirname, shape, num_targets=100):
+    """synthetic int16 CT-like raw image and its annotation in dirname"""
+    raw_img = np.random.RandomState(0).normal(40, 300, shape).astype(np.int16)
+    raw_itk_img = sitk.GetImageFromArray(raw_img)
+    anno_itk_img = sitk.GetImageFromArray(make_anno_img(shape, num_targets).astype(np.int16))
+    anno_itk_img.CopyInformation(raw_itk_img)
+    raw_filepath = os.path.join(dirname, 'raw.nii.gz')
+    anno_filepath = os.path.join(dirname, 'anno.nii.gz')
+    sitk.WriteImage(raw_itk_img, raw_filepath)
+    sitk.WriteImage(anno_itk_img, anno_filepath)
+    return raw_filepath, anno_filepath
+
+
+def measure_frames(main_window, scenes, raw, anno, indices):
+    """python/numpy bytes allocated at peak during each update_scenes call, and its time"""
+    peaks = []
+    times = []
+    for index in indices:
+        main_window._focus_point[2] = index
+        tracemalloc.start()
+        start = time.perf_counter()
+        main_window.update_scenes(scenes, raw=raw, anno=anno)
+        times.append(time.perf_counter() - start)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return np.mean(peaks), np.mean(times)
+
+
+def measure_pan(main_window, step, num):
+    """time of scrolling the axial view by step pixels, num times. tiles coming into sight are rendered"""
+    scroll_bar = main_window.aGraphicsView.horizontalScrollBar()
+    times = []
+    for _ in range(num):
+        start = time.perf_counter()
+        scroll_bar.setValue(scroll_bar.value() + step)
+        times.append(time.perf_counter() - start)
+    return np.mean(times)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m scripts.measure_update_scenes',
+        description='Print the peak memory allocated and the time of redrawing the views of a synthetic case')
+    parser.add_argument('-s', '--shape', nargs=3, type=int, default=DEFAULT_SHAPE, metavar=('D', 'H', 'W'),
+                        help='image shape (default: %s)' % ' '.join(str(n) for n in DEFAULT_SHAPE))
+    args = parser.parse_args(argv)
+    shape = tuple(args.shape)
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    with tempfile.TemporaryDirectory() as dirname:
+        # caches of the run in dirname, neither left in nor warmed by the cache of the user
+        os.environ[CACHE_DIR_ENV] = os.path.join(dirname, 'cache')
+        app = QApplication(sys.argv[:1])
+        main_window = MainWindow()
+        # only the tiles in sight are rendered, so the views need their real size
+        main_window.resize(1280, 960)
+        main_window.show()
+        app.processEvents()
+        raw_filepath, anno_filepath = write_case(dirname, shape)
+        main_window.model.read_img(raw_filepath, 'raw')
+        main_window.model.read_img(anno_filepath, 'anno')
+        main_window.init_views()
+        print('volume shape (d, h, w): %s' % (shape,))
+        print('%-28s %16s %12s' % ('frame', 'peak KB/frame', 'ms/frame'))
+        indices = list(range(shape[0]))
+        for name, scenes, raw, anno, frame_indices in [
+            ('axial scroll, first visit', 'a', True, True, indices),
+            ('axial scroll, revisit', 'a', True, True, indices),
+            ('all views, overlay only', 'asc', False, True, indices[:1] * 20),
+        ]:
+            peak, frame_time = measure_frames(main_window, scenes, raw, anno, frame_indices)
+            print('%-28s %16.1f %12.2f' % (name, peak / 1024, frame_time * 1000))
+        main_window.scale_all_scenes(4, 4)
+        peak, frame_time = measure_frames(main_window, 'a', True, True, indices)
+        print('%-28s %16.1f %12.2f' % ('axial scroll, zoomed in x4', peak / 1024, frame_time * 1000))
+        main_window.scale_all_scenes(0.25, 0.25)
+        main_window.model.set_slice_cache_budget(0)
+        peak, frame_time = measure_frames(main_window, 'a', True, True, indices)
+        print('%-28s %16.1f %12.2f' % ('axial scroll, no cache', peak / 1024, frame_time * 1000))
+        main_window.scale_all_scenes(4, 4)
+        peak, frame_time = measure_frames(main_window, 'a', True, True, indices)
+        print('%-28s %16.1f %12.2f' % ('zoomed in x4, no cache', peak / 1024, frame_time * 1000))
+        main_window.aGraphicsView.horizontalScrollBar().setValue(0)
+        print('%-28s %16s %12.2f' % ('pan zoomed in x4, 16 px', '', measure_pan(main_window, 16, 40) * 1000))
+        main_window.model.clear()
+        app.quit()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
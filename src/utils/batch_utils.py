@@ -0,0 +1,159 @@
+import csv
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+IMG_EXTENSIONS = ('.nii.gz', '.nii')
+DEFAULT_ANNO_SUFFIX = '_seg'  # annotation of case.nii.gz is case_seg.nii.gz, when in the same directory
+
+
+def split_img_ext(filename):
+    """(name, extension) of an image file name, extension is '' if it is not one of IMG_EXTENSIONS"""
+    for ext in IMG_EXTENSIONS:
+        if filename.endswith(ext):
+            return filename[:-len(ext)], ext
+    return filename, ''
+
+
+def find_cases(data_dir, anno_dir=None, anno_suffix=None):
+    """Raw images under data_dir (recursively) which have an annotation, sorted by case name.
+    The annotation of <data_dir>/<path>.nii.gz is <anno_dir>/<path><anno_suffix>.nii.gz. anno_dir is data_dir by
+    default, anno_suffix is DEFAULT_ANNO_SUFFIX if anno_dir is data_dir, else ''. Annotations in data_dir are not
+    taken for raw images.
+    return [(case name: relative path of the raw image without extension, raw filepath, anno filepath)]"""
+    if anno_dir is None:
+        anno_dir = data_dir
+    if anno_suffix is None:
+        anno_suffix = DEFAULT_ANNO_SUFFIX if os.path.abspath(anno_dir) == os.path.abspath(data_dir) else ''
+    cases = []
+    for dirpath, dirnames, filenames in os.walk(data_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            name, ext = split_img_ext(filename)
+            if ext == '' or anno_suffix != '' and name.endswith(anno_suffix):
+                continue
+            case = os.path.relpath(os.path.join(dirpath, name), data_dir).replace(os.sep, '/')
+            raw_filepath = os.path.join(dirpath, filename)
+            anno_filepath = os.path.join(anno_dir, os.path.relpath(dirpath, data_dir), name + anno_suffix + ext)
+            if os.path.abspath(anno_filepath) != os.path.abspath(raw_filepath) and os.path.exists(anno_filepath):
+                cases.append((case, raw_filepath, anno_filepath))
+    return sorted(cases)
+
+
+def run_cases(fn, cases, num_workers=None):
+    """Run fn(*case) for every case (tuple of picklable args, the first is the case name) in num_workers processes,
+    all cpus by default, 1 runs them in this process. fn must be a module level function.
+    Results are yielded as they are done, as (case, result, error message). result is None if fn raised"""
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    if num_workers <= 1:
+        for case in cases:
+            yield _run_case(fn, case)
+        return
+    cases = iter(cases)
+    with ProcessPoolExecutor(num_workers) as executor:
+        pending = set()
+        while True:
+            # at most 2 cases per worker are submitted ahead, so that results stream out of long runs
+            while len(pending) < 2 * num_workers:
+                case = next(cases, None)
+                if case is None:
+                    break
+                pending.add(executor.submit(_run_case, fn, case))
+            if len(pending) == 0:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def _run_case(fn, case):
+    try:
+        return case, fn(*case), None
+    except Exception as e:
+        return case, None, '%s: %s' % (type(e).__name__, str(e).replace('\n', ' '))
+
+
+class CaseResultFile:
+    """Results of cases in a CSV or JSON Lines file, chosen by the extension (.csv or .jsonl).
+    A case has a list of rows (dicts of fieldnames) or an error. In CSV every row is a line with the case name and
+    the number of rows of its case, a case without rows is one line of empty fields. In JSON Lines a case is one
+    line {"case": name, "rows": [...], "error": message}.
+    With resume, the cases completely written by a former run without error are kept and listed in done_cases,
+    the others are dropped to be done again. Otherwise the file is overwritten."""
+
+    def __init__(self, filepath, fieldnames, resume=False):
+        self.filepath = filepath
+        self.fieldnames = list(fieldnames)
+        self.is_csv = filepath.endswith('.csv')
+        if not self.is_csv and not filepath.endswith('.jsonl'):
+            raise AttributeError('unsupported result file %s, should be .csv or .jsonl' % filepath)
+        self.done_cases = set()
+        kept_lines = self._read_done_cases() if resume and os.path.exists(filepath) else []
+        if self.is_csv:
+            header = ','.join(['case', 'case_rows'] + self.fieldnames + ['error']) + '\n'
+            kept_lines = [header] + kept_lines
+        # rewritten at once, so that an interrupted resume keeps the former results
+        dirname = os.path.dirname(os.path.abspath(filepath))
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmp_filepath = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        with os.fdopen(fd, 'w', newline='') as f:
+            f.writelines(kept_lines)
+        os.replace(tmp_filepath, filepath)
+        self._file = open(filepath, 'a', newline='')
+
+    def _read_done_cases(self):
+        """lines of the cases completely done in the file"""
+        with open(self.filepath, 'r', newline='') as f:
+            lines = f.readlines()
+        if len(lines) > 0 and not lines[-1].endswith('\n'):
+            lines = lines[:-1]  # interrupted while writing
+        case_lines = {}
+        if self.is_csv:
+            if len(lines) == 0:
+                return []
+            fieldnames = next(csv.reader(lines[:1]))
+            if fieldnames != ['case', 'case_rows'] + self.fieldnames + ['error']:
+                raise AttributeError('%s has other columns than the results to resume' % self.filepath)
+            for line in lines[1:]:
+                row = dict(zip(fieldnames, next(csv.reader([line]))))
+                if row['error'] == '':
+                    case_lines.setdefault(row['case'], (int(row['case_rows']), []))[1].append(line)
+            done = [(case, case_rows) for case, (num_rows, case_rows) in case_lines.items()
+                    if len(case_rows) == max(num_rows, 1)]
+        else:
+            done = []
+            for line in lines:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('error') is None:
+                    done.append((record['case'], [line]))
+        self.done_cases = set(case for case, _ in done)
+        return [line for _, case_rows in done for line in case_rows]
+
+    def write(self, case, rows=None, error=None):
+        """all results of case at once"""
+        if self.is_csv:
+            lines = []
+            for row in rows if rows else [{}]:
+                line = [case, 0 if rows is None else len(rows)] + [row.get(name, '') for name in self.fieldnames] + \
+                    ['' if error is None else error]
+                lines.append(line)
+            csv.writer(self._file, lineterminator='\n').writerows(lines)
+        else:
+            self._file.write(json.dumps({'case': case, 'rows': rows, 'error': error}) + '\n')
+        self._file.flush()
+        if error is None:
+            self.done_cases.add(case)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,11 @@
+import os
+
+CACHE_DIR_ENV = 'MEDLABELME_CACHE_DIR'
+
+
+def get_cache_dir(name):
+    """sub directory name of $MEDLABELME_CACHE_DIR, else of ~/.cache/medlabelme"""
+    cache_root = os.environ.get(CACHE_DIR_ENV)
+    if not cache_root:
+        cache_root = os.path.join(os.path.expanduser('~'), '.cache', 'medlabelme')
+    return os.path.join(cache_root, name)
@@ -7,9 +7,9 @@ class IllegalSizeError(Exception):
     def __str__(self):
         msg = 'Illegal size!'
         if self.new_size is not None:
-            msg += '\nnew size: %s' % self.new_size
+            msg += '\nnew size: %s' % (self.new_size,)
         if self.reference_size is not None:
-            msg += '\nreference size: %s' % self.reference_size
+            msg += '\nreference size: %s' % (self.reference_size,)
         return msg
 
 
@@ -40,3 +40,16 @@ class ChangeNotSavedError(Exception):
 
     def __str__(self):
         return self.description
+
+
+class JournalError(Exception):
+    """ check if the journal of unsaved edits can be replayed """
+
+    def __init__(self, description=None):
+        if description is None:
+            self.description = 'Unsaved edits can not be recovered!'
+        else:
+            self.description = description
+
+    def __str__(self):
+        return self.description
@@ -0,0 +1,19 @@
+import os
+
+
+def fsync_file(filepath):
+    """flush the data of a written and closed file to the disk"""
+    with open(filepath, 'rb') as f:
+        os.fsync(f.fileno())
+
+
+def fsync_dir(dirpath):
+    """flush the entries of a directory to the disk, so that a file created or replaced in it survives a crash.
+    directories can not be opened on Windows, where this is left to the file system"""
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(dirpath or '.', os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,44 @@
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+GZIP_BLOCK_SIZE = 4 * 1024 ** 2  # bytes of uncompressed data per gzip member
+
+
+def gzip_block(data, level):
+    """one complete gzip member of data. zlib releases the GIL, so blocks are compressed in parallel threads"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def parallel_gzip_file(src_filepath, dst_filepath, level=6, block_size=GZIP_BLOCK_SIZE, num_workers=None,
+                       progress_callback=None):
+    """Gzip src to dst with blocks compressed in a thread pool. Every block is written as a gzip member, the
+    concatenated members are a valid gzip file (RFC 1952), readable by gzip, zlib and ITK. dst is fsynced before
+    it is closed.
+    progress_callback(fraction of src compressed) is called after every block."""
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    src_size = os.path.getsize(src_filepath)
+    with open(src_filepath, 'rb') as src_file, open(dst_filepath, 'wb') as dst_file, \
+            ThreadPoolExecutor(num_workers) as executor:
+        pending = []
+        done_size = 0
+        while True:
+            # keep at most 2 blocks per worker in memory
+            while len(pending) < 2 * num_workers:
+                data = src_file.read(block_size)
+                if len(data) == 0:
+                    break
+                pending.append((len(data), executor.submit(gzip_block, data, level)))
+            if len(pending) == 0:
+                break
+            data_size, future = pending.pop(0)
+            dst_file.write(future.result())
+            done_size += data_size
+            if progress_callback is not None:
+                progress_callback(done_size / max(src_size, 1))
+        if src_size == 0:
+            dst_file.write(gzip_block(b'', level))
+        dst_file.flush()
+        os.fsync(dst_file.fileno())
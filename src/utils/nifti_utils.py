@@ -0,0 +1,83 @@
+import gzip
+import struct
+
+import numpy as np
+
+NIFTI1_HEADER_SIZE = 348
+NIFTI1_MAGIC = b'n+1\x00'  # single file .nii, header and voxels
+NIFTI_DTYPES = {2: np.uint8, 4: np.int16, 8: np.int32, 16: np.float32, 64: np.float64, 256: np.int8, 512: np.uint16,
+                768: np.uint32, 1024: np.int64, 1280: np.uint64}
+READ_SLAB_BYTES = 4 * 1024 ** 2  # bytes of file voxels read at a time
+
+
+def read_array(f, shape, file_dtype, dtype=None, slab_bytes=READ_SLAB_BYTES):
+    """Read a C ordered array of file_dtype from file object f into a new array of dtype (file_dtype if None) slab
+    by slab along the first axis, so that the voxels are allocated once in their final dtype.
+    return (array, min, max) of the voxels as in the file"""
+    file_dtype = np.dtype(file_dtype)
+    img = np.empty(shape, file_dtype.newbyteorder('=') if dtype is None else dtype)
+    if img.size == 0:
+        return img, None, None
+    slab_size = max(slab_bytes // (img[0].size * file_dtype.itemsize), 1)
+    buffer = np.empty((min(slab_size, shape[0]),) + tuple(shape[1:]), file_dtype)
+    min_val = max_val = None
+    for start in range(0, shape[0], slab_size):
+        end = min(start + slab_size, shape[0])
+        slab = buffer[:end - start]
+        slab_bytes_view = memoryview(slab.reshape(-1)).cast('B')
+        num_read = 0
+        while num_read < slab.nbytes:
+            n = f.readinto(slab_bytes_view[num_read:])
+            if not n:
+                raise EOFError('Voxel data ends before %d of %d slices' % (start, shape[0]))
+            num_read += n
+        slab_min, slab_max = slab.min().item(), slab.max().item()
+        min_val = slab_min if min_val is None else min(min_val, slab_min)
+        max_val = slab_max if max_val is None else max(max_val, slab_max)
+        img[start:end] = slab
+    return img, min_val, max_val
+
+
+def read_nifti_header(f):
+    """fields of a single file NIfTI-1 header needed to read its voxels, None if f is not one"""
+    header = f.read(NIFTI1_HEADER_SIZE)
+    if len(header) < NIFTI1_HEADER_SIZE or header[344:348] != NIFTI1_MAGIC:
+        return None
+    for endian in '<>':
+        if struct.unpack(endian + 'i', header[:4])[0] == NIFTI1_HEADER_SIZE:
+            break
+    else:
+        return None
+    scl_slope, scl_inter = struct.unpack(endian + '2f', header[112:120])
+    return {
+        'endian': endian,
+        'dim': list(struct.unpack(endian + '8h', header[40:56])),
+        'datatype': struct.unpack(endian + 'h', header[70:72])[0],
+        'vox_offset': int(struct.unpack(endian + 'f', header[108:112])[0]),
+        'scl_slope': scl_slope,
+        'scl_inter': scl_inter
+    }
+
+
+def read_nifti_voxels(filepath, dtype=None):
+    """Stream the voxels (d, h, w) of a 3D .nii or .nii.gz file into a new array of dtype (the file dtype if None),
+    without a full size intermediate copy as made by ITK. Geometry is left to the caller.
+    return (array, min, max of the voxels, dtype of the voxels in the file), None if the file can not be read this
+    way (other formats, scaled voxels or other dimensions), then it should be read by SimpleITK."""
+    if filepath.endswith('.nii.gz'):
+        opener = gzip.open
+    elif filepath.endswith('.nii'):
+        opener = open
+    else:
+        return None
+    with opener(filepath, 'rb') as f:
+        header = read_nifti_header(f)
+        if header is None or header['datatype'] not in NIFTI_DTYPES or header['dim'][0] != 3 or \
+                header['vox_offset'] < NIFTI1_HEADER_SIZE:
+            return None
+        if header['scl_slope'] != 0 and (header['scl_slope'] != 1 or header['scl_inter'] != 0):
+            return None  # voxels are scaled to floats by ITK
+        f.read(header['vox_offset'] - NIFTI1_HEADER_SIZE)  # extensions
+        shape = tuple(header['dim'][3:0:-1])
+        file_dtype = np.dtype(NIFTI_DTYPES[header['datatype']]).newbyteorder(header['endian'])
+        return read_array(f, shape, file_dtype, dtype) + (file_dtype.newbyteorder('='),)
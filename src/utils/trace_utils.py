@@ -0,0 +1,119 @@
+import atexit
+import json
+import os
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+DEFAULT_MAX_EVENTS = 1000000  # the latest spans are kept, about 200 bytes each
+SCALAR_TYPES = (str, int, float, bool, type(None))
+
+_tracer = None  # Tracer while tracing is enabled, checked by every traced call
+
+
+class Tracer:
+    """Spans of traced calls kept in memory as Chrome trace events, written as json by save. The file can be
+    opened in chrome://tracing or https://ui.perfetto.dev"""
+
+    def __init__(self, filepath, max_events=DEFAULT_MAX_EVENTS):
+        self.filepath = filepath
+        self._events = deque(maxlen=max_events)  # appended by any thread
+        self._thread_names = {}
+        self._pid = os.getpid()
+        self._start = time.perf_counter()
+
+    def add_span(self, name, start, end, args=None):
+        """span of perf_counter times start to end"""
+        tid = threading.get_ident()
+        if tid not in self._thread_names:
+            self._thread_names[tid] = threading.current_thread().name
+        event = {'name': name, 'ph': 'X', 'pid': self._pid, 'tid': tid,
+                 'ts': (start - self._start) * 1e6, 'dur': (end - start) * 1e6}
+        if args:
+            event['args'] = args
+        self._events.append(event)
+
+    def save(self):
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': self._pid, 'tid': tid, 'args': {'name': name}}
+                  for tid, name in list(self._thread_names.items())]
+        events += list(self._events)
+        tmp_filepath = self.filepath + '.tmp'
+        with open(tmp_filepath, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        os.replace(tmp_filepath, self.filepath)
+
+
+def enable_tracing(filepath, max_events=DEFAULT_MAX_EVENTS):
+    """record the spans of traced calls from now on, written to filepath at exit or by save_trace"""
+    global _tracer
+    if _tracer is None:
+        atexit.register(save_trace)
+    _tracer = Tracer(filepath, max_events)
+    return _tracer
+
+
+def is_tracing():
+    return _tracer is not None
+
+
+def save_trace():
+    if _tracer is not None:
+        _tracer.save()
+
+
+def traced(name=None):
+    """Decorator recording every call as a span named name (the qualified function name by default), with the
+    arguments of scalar values. A disabled tracer costs a global lookup per call"""
+    def decorator(fn):
+        span_name = fn.__qualname__ if name is None else name
+        arg_names = fn.__code__.co_varnames[:fn.__code__.co_argcount]
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                span_args = {arg_name: arg for arg_name, arg in zip(arg_names, args) if type(arg) in SCALAR_TYPES}
+                span_args.update((k, v) for k, v in kwargs.items() if type(v) in SCALAR_TYPES)
+                tracer.add_span(span_name, start, time.perf_counter(), span_args)
+        return wrapper
+    return decorator
+
+
+class _Span:
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.tracer.add_span(self.name, self.start, time.perf_counter(), self.args)
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def trace_span(name, **args):
+    """context manager recording its block as a span, a shared no-op one if tracing is disabled"""
+    tracer = _tracer
+    if tracer is None:
+        return _NO_SPAN
+    return _Span(tracer, name, args)
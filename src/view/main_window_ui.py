@@ -157,6 +157,9 @@ class Ui_MainWindow(object):
         self.label_10 = QtWidgets.QLabel(self.groupBox_3)
         self.label_10.setObjectName("label_10")
         self.gridLayout_3.addWidget(self.label_10, 2, 0, 1, 1)
+        self.windowPresetComboBox = QtWidgets.QComboBox(self.groupBox_3)
+        self.windowPresetComboBox.setObjectName("windowPresetComboBox")
+        self.gridLayout_3.addWidget(self.windowPresetComboBox, 4, 0, 1, 2)
         self.verticalLayout_5.addWidget(self.groupBox_3)
         self.verticalLayout.addWidget(self.groupBox_2)
         self.horizontalLayout.addLayout(self.verticalLayout)
@@ -219,7 +222,21 @@ class Ui_MainWindow(object):
         self.refreshTargetListButton.setObjectName("refreshTargetListButton")
         self.horizontalLayout_5.addWidget(self.refreshTargetListButton)
         self.verticalLayout_2.addLayout(self.horizontalLayout_5)
-        self.targetList = QtWidgets.QListWidget(self.centralwidget)
+        self.horizontalLayout_10 = QtWidgets.QHBoxLayout()
+        self.horizontalLayout_10.setObjectName("horizontalLayout_10")
+        self.targetLabelFilterComboBox = QtWidgets.QComboBox(self.centralwidget)
+        self.targetLabelFilterComboBox.setObjectName("targetLabelFilterComboBox")
+        self.horizontalLayout_10.addWidget(self.targetLabelFilterComboBox)
+        self.targetMinSizeSpinBox = QtWidgets.QSpinBox(self.centralwidget)
+        self.targetMinSizeSpinBox.setMaximum(999999999)
+        self.targetMinSizeSpinBox.setObjectName("targetMinSizeSpinBox")
+        self.horizontalLayout_10.addWidget(self.targetMinSizeSpinBox)
+        self.targetSortComboBox = QtWidgets.QComboBox(self.centralwidget)
+        self.targetSortComboBox.setObjectName("targetSortComboBox")
+        self.horizontalLayout_10.addWidget(self.targetSortComboBox)
+        self.verticalLayout_2.addLayout(self.horizontalLayout_10)
+        self.targetList = QtWidgets.QListView(self.centralwidget)
+        self.targetList.setUniformItemSizes(True)
         self.targetList.setObjectName("targetList")
         self.verticalLayout_2.addWidget(self.targetList)
         self.label_17 = QtWidgets.QLabel(self.centralwidget)
@@ -278,6 +295,12 @@ class Ui_MainWindow(object):
         self.circleRadioButton.setChecked(True)
         self.circleRadioButton.setObjectName("circleRadioButton")
         self.horizontalLayout_4.addWidget(self.circleRadioButton)
+        self.cubeRadioButton = QtWidgets.QRadioButton(self.brush)
+        self.cubeRadioButton.setObjectName("cubeRadioButton")
+        self.horizontalLayout_4.addWidget(self.cubeRadioButton)
+        self.sphereRadioButton = QtWidgets.QRadioButton(self.brush)
+        self.sphereRadioButton.setObjectName("sphereRadioButton")
+        self.horizontalLayout_4.addWidget(self.sphereRadioButton)
         self.verticalLayout_6.addLayout(self.horizontalLayout_4)
         self.label_14 = QtWidgets.QLabel(self.brush)
         self.label_14.setObjectName("label_14")
@@ -334,6 +357,9 @@ class Ui_MainWindow(object):
         self.actionRedo.setObjectName("actionRedo")
         self.actionToggle_Label_Visibility = QtWidgets.QAction(MainWindow)
         self.actionToggle_Label_Visibility.setObjectName("actionToggle_Label_Visibility")
+        self.actionShow_Frame_Times = QtWidgets.QAction(MainWindow)
+        self.actionShow_Frame_Times.setCheckable(True)
+        self.actionShow_Frame_Times.setObjectName("actionShow_Frame_Times")
         self.menuFile.addAction(self.actionOpen)
         self.menuFile.addAction(self.actionSave)
         self.menuFile.addAction(self.actionClose)
@@ -343,6 +369,8 @@ class Ui_MainWindow(object):
         self.menuEdit.addAction(self.actionRedo)
         self.menuEdit.addSeparator()
         self.menuEdit.addAction(self.actionToggle_Label_Visibility)
+        self.menuEdit.addSeparator()
+        self.menuEdit.addAction(self.actionShow_Frame_Times)
         self.menubar.addAction(self.menuFile.menuAction())
         self.menubar.addAction(self.menuEdit.menuAction())
 
@@ -367,7 +395,10 @@ class Ui_MainWindow(object):
         self.zSpinBox.valueChanged['int'].connect(MainWindow.on_z_spin_box_value_changed)
         self.windowLevelSpinBox.valueChanged['int'].connect(MainWindow.on_window_level_spin_box_value_changed)
         self.windowWidthSpinBox.valueChanged['int'].connect(MainWindow.on_window_width_spin_box_value_changed)
-        self.targetList.itemClicked['QListWidgetItem*'].connect(MainWindow.on_target_list_item_clicked)
+        self.targetList.clicked['QModelIndex'].connect(MainWindow.on_target_list_item_clicked)
+        self.targetLabelFilterComboBox.currentIndexChanged['int'].connect(MainWindow.on_target_list_view_changed)
+        self.targetMinSizeSpinBox.valueChanged['int'].connect(MainWindow.on_target_list_view_changed)
+        self.targetSortComboBox.currentIndexChanged['int'].connect(MainWindow.on_target_list_view_changed)
         self.brushSizeSpinBox.valueChanged['int'].connect(self.brushSizeSlider.setValue)
         self.brushSizeSlider.valueChanged['int'].connect(self.brushSizeSpinBox.setValue)
         self.opModeTab.currentChanged['int'].connect(MainWindow.on_current_op_mode_tab_changed)
@@ -377,12 +408,14 @@ class Ui_MainWindow(object):
         MainWindow.set_brush_stats_signal['int', 'int'].connect(self.cGraphicsView.set_brush_stats)
         self.circleRadioButton.clicked.connect(MainWindow.on_brush_type_clicked)
         self.rectRadioButton.clicked.connect(MainWindow.on_brush_type_clicked)
-        self.aGraphicsView.paint_anno_on_point_signal['int', 'int', 'int', 'int', 'int', 'bool', 'bool'].connect(
-            MainWindow.on_paint_on_point)
-        self.sGraphicsView.paint_anno_on_point_signal['int', 'int', 'int', 'int', 'int', 'bool', 'bool'].connect(
-            MainWindow.on_paint_on_point)
-        self.cGraphicsView.paint_anno_on_point_signal['int', 'int', 'int', 'int', 'int', 'bool', 'bool'].connect(
-            MainWindow.on_paint_on_point)
+        self.cubeRadioButton.clicked.connect(MainWindow.on_brush_type_clicked)
+        self.sphereRadioButton.clicked.connect(MainWindow.on_brush_type_clicked)
+        self.aGraphicsView.paint_anno_stroke_signal['PyQt_PyObject', 'int', 'int', 'bool', 'bool'].connect(
+            MainWindow.on_paint_stroke)
+        self.sGraphicsView.paint_anno_stroke_signal['PyQt_PyObject', 'int', 'int', 'bool', 'bool'].connect(
+            MainWindow.on_paint_stroke)
+        self.cGraphicsView.paint_anno_stroke_signal['PyQt_PyObject', 'int', 'int', 'bool', 'bool'].connect(
+            MainWindow.on_paint_stroke)
         self.refreshTargetListButton.clicked.connect(MainWindow.on_refresh_list_button_clicked)
         self.deleteTargetButton.clicked.connect(MainWindow.on_delete_target_button_clicked)
         self.actionClose.triggered.connect(MainWindow.menu_close_triggered)
@@ -404,6 +437,11 @@ class Ui_MainWindow(object):
         self.actionUndo.triggered.connect(MainWindow.menu_undo_paint_triggered)
         self.actionRedo.triggered.connect(MainWindow.menu_redo_paint_triggered)
         self.actionToggle_Label_Visibility.triggered.connect(MainWindow.menu_toggle_label_visibility)
+        self.aGraphicsView.adjust_window_signal['int', 'int'].connect(MainWindow.adjust_window)
+        self.sGraphicsView.adjust_window_signal['int', 'int'].connect(MainWindow.adjust_window)
+        self.cGraphicsView.adjust_window_signal['int', 'int'].connect(MainWindow.adjust_window)
+        self.windowPresetComboBox.activated['int'].connect(MainWindow.on_window_preset_activated)
+        self.actionShow_Frame_Times.toggled['bool'].connect(MainWindow.set_frame_time_overlay)
         QtCore.QMetaObject.connectSlotsByName(MainWindow)
 
     def retranslateUi(self, MainWindow):
@@ -424,8 +462,14 @@ class Ui_MainWindow(object):
         self.label_8.setText(_translate("MainWindow", "Level:"))
         self.label_11.setText(_translate("MainWindow", "Top"))
         self.label_10.setText(_translate("MainWindow", "Bottom:"))
+        self.windowPresetComboBox.setToolTip(_translate("MainWindow", "Window presets"))
         self.label_12.setText(_translate("MainWindow", "Target list:"))
         self.refreshTargetListButton.setText(_translate("MainWindow", "Refresh"))
+        self.targetLabelFilterComboBox.setToolTip(_translate("MainWindow", "Show targets of this label"))
+        self.targetMinSizeSpinBox.setToolTip(_translate("MainWindow", "Show targets of at least this number of voxels"))
+        self.targetMinSizeSpinBox.setPrefix(_translate("MainWindow", ">= "))
+        self.targetMinSizeSpinBox.setSuffix(_translate("MainWindow", " voxels"))
+        self.targetSortComboBox.setToolTip(_translate("MainWindow", "Sort targets by"))
         self.label_17.setText(_translate("MainWindow", "Label Opacity (%):"))
         self.deleteTargetButton.setText(_translate("MainWindow", "Delete Selected Target"))
         self.label_13.setText(_translate("MainWindow", "Annotator"))
@@ -434,6 +478,8 @@ class Ui_MainWindow(object):
         self.label_15.setText(_translate("MainWindow", "Paint brush mode."))
         self.rectRadioButton.setText(_translate("MainWindow", "Rect"))
         self.circleRadioButton.setText(_translate("MainWindow", "Circle"))
+        self.cubeRadioButton.setText(_translate("MainWindow", "Cube"))
+        self.sphereRadioButton.setText(_translate("MainWindow", "Sphere"))
         self.label_14.setText(_translate("MainWindow", "Size:"))
         self.opModeTab.setTabText(self.opModeTab.indexOf(self.brush), _translate("MainWindow", "Brush"))
         self.menuFile.setTitle(_translate("MainWindow", "File"))
@@ -450,5 +496,7 @@ class Ui_MainWindow(object):
         self.actionRedo.setShortcut(_translate("MainWindow", "Ctrl+Shift+Z"))
         self.actionToggle_Label_Visibility.setText(_translate("MainWindow", "Toggle Label Visibility"))
         self.actionToggle_Label_Visibility.setShortcut(_translate("MainWindow", "S"))
+        self.actionShow_Frame_Times.setText(_translate("MainWindow", "Show Frame Times"))
+        self.actionShow_Frame_Times.setShortcut(_translate("MainWindow", "F12"))
 
 from controller.graphics_view_controller import ASCGraphicsView
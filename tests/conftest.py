@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """caches and journals of every test in its own directory, never in the cache of the user"""
+    from utils.cache_utils import CACHE_DIR_ENV
+
+    cache_dir = str(tmp_path / 'cache')
+    monkeypatch.setenv(CACHE_DIR_ENV, cache_dir)
+    return cache_dir
@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+
+from model.brush import BRUSH_TYPE_CIRCLE_BRUSH, BRUSH_TYPE_RECT_BRUSH, BRUSH_TYPE_SPHERE_BRUSH
+from model.model import Model
+
+SHAPE = (12, 48, 40)  # d, h, w
+
+
+def make_anno_img(shape, num_targets, seed=0):
+    """label map (d, h, w) with num_targets random boxes of labels 1 to 3, which may touch"""
+    rng = np.random.RandomState(seed)
+    anno_img = np.zeros(shape, np.int8)
+    for _ in range(num_targets):
+        start = [rng.randint(0, n - 2) for n in shape]
+        size = [rng.randint(1, 6) for _ in shape]
+        anno_img[start[0]:start[0] + size[0], start[1]:start[1] + size[1], start[2]:start[2] + size[2]] = \
+            rng.randint(1, 4)
+    return anno_img
+
+
+def get_targets_stats_by_masks(target_id_map, anno_img):
+    """target stats computed from a full volume mask of every target"""
+    target_ids = np.unique(target_id_map[target_id_map > 0])
+    stats = {'target_ids': target_ids, 'target_labels': [], 'target_centers': [], 'target_voxel_counts': [],
+             'target_bboxes': []}
+    for target_id in target_ids:
+        mask = target_id_map == target_id
+        coords = np.nonzero(mask)
+        stats['target_labels'].append(anno_img[coords[0][0], coords[1][0], coords[2][0]])
+        # the slice of each axis with the most voxels
+        stats['target_centers'].append([np.argmax(mask.sum(axis=tuple(j for j in range(3) if j != i)))
+                                        for i in range(3)])
+        stats['target_voxel_counts'].append(len(coords[0]))
+        stats['target_bboxes'].append([[coords[i].min(), coords[i].max()] for i in range(3)])
+    return {k: np.array(v) for k, v in stats.items()}
+
+
+def new_model(anno_img, tmp_path):
+    """model with an empty raw image and anno_img loaded, and its target stats computed"""
+    model = Model()
+    size = list(anno_img.shape[::-1])
+    model.set_img(str(tmp_path / 'raw.nii.gz'), 'raw', np.zeros(anno_img.shape, np.int16),
+                  {'size': size, 'min_val': 0, 'max_val': 0})
+    model.set_img(str(tmp_path / 'anno.nii.gz'), 'anno', anno_img,
+                  {'size': size, 'min_val': 0, 'max_val': anno_img.max().item()})
+    model.compute_img_stats('anno')
+    return model
+
+
+@pytest.mark.parametrize('max_hist_entries', [2 ** 24, 100])
+def test_targets_stats_equal_stats_by_masks(max_hist_entries):
+    anno_img = make_anno_img(SHAPE, 30)
+    anno_stats = Model.compute_anno_stats(anno_img)
+    target_stats = Model.get_targets_stats(anno_stats['target_id_map'], anno_img, max_hist_entries)
+    expected = get_targets_stats_by_masks(anno_stats['target_id_map'], anno_img)
+    assert len(expected['target_ids']) > 1
+    for k, v in expected.items():
+        assert np.array_equal(target_stats[k], v), k
+        assert np.array_equal(anno_stats[k], v), k
+    assert anno_stats['num_positive_labels'] == anno_img.max()
+    assert anno_stats['max_target_id'] == expected['target_ids'].max()
+
+
+def test_stats_of_empty_label_map():
+    anno_stats = Model.compute_anno_stats(np.zeros(SHAPE, np.int8))
+    assert len(anno_stats['target_ids']) == 0
+    assert anno_stats['num_positive_labels'] == 0 and anno_stats['max_target_id'] == 0
+
+
+def assert_stats_equal(anno_stats, full_stats):
+    """the same targets, though of other ids"""
+    def get_targets(stats):
+        return sorted(zip(stats['target_labels'].tolist(), stats['target_voxel_counts'].tolist(),
+                          map(tuple, stats['target_centers'].tolist()),
+                          map(lambda bbox: tuple(np.ravel(bbox)), stats['target_bboxes'].tolist())))
+
+    assert get_targets(anno_stats) == get_targets(full_stats)
+    assert anno_stats['num_positive_labels'] == full_stats['num_positive_labels']
+    # the id maps split the foreground into the same targets
+    id_map, full_id_map = anno_stats['target_id_map'], full_stats['target_id_map']
+    assert np.array_equal(id_map > 0, full_id_map > 0)
+    id_pairs = np.unique(np.stack([id_map[id_map > 0], full_id_map[full_id_map > 0]]), axis=1)
+    assert id_pairs.shape[1] == len(anno_stats['target_ids']) == len(full_stats['target_ids'])
+    assert set(np.unique(id_map[id_map > 0]).tolist()) == set(anno_stats['target_ids'].tolist())
+
+
+def test_incremental_stats_equal_full_recompute(tmp_path):
+    model = new_model(make_anno_img(SHAPE, 30), tmp_path)
+    rng = np.random.RandomState(1)
+    brush_types = [BRUSH_TYPE_CIRCLE_BRUSH, BRUSH_TYPE_RECT_BRUSH, BRUSH_TYPE_SPHERE_BRUSH]
+    for i in range(60):
+        points = [(rng.randint(0, SHAPE[2]), rng.randint(0, SHAPE[1]), rng.randint(0, SHAPE[0]))
+                  for _ in range(rng.randint(1, 4))]
+        model.anno_paint_stroke(points, 'xyz'[i % 3], rng.randint(1, 4), brush_types[i % 3], rng.randint(1, 8),
+                                erase=rng.randint(3) == 0, new_step=True)
+        if i % 7 == 0:
+            model.update_anno_stats()
+            target_ids = model.get_anno_target_ids()
+            if len(target_ids) > 0:
+                model.delete_target(int(rng.choice(target_ids)))
+        if i % 3 == 0:
+            model.update_anno_stats()
+            assert_stats_equal(model._anno_img_stats, Model.compute_anno_stats(model._anno_img_edit))
+
+
+def test_incremental_stats_fall_back_on_id_overflow(tmp_path):
+    model = new_model(make_anno_img(SHAPE, 10), tmp_path)
+    id_map_dtype = model._anno_img_stats['target_id_map'].dtype
+    model._anno_img_stats['max_target_id'] = int(np.iinfo(id_map_dtype).max)
+    model.anno_paint(5, 5, 5, 'z', 1, BRUSH_TYPE_RECT_BRUSH, 3, new_step=True)
+    model.anno_paint(30, 40, 5, 'z', 2, BRUSH_TYPE_RECT_BRUSH, 3, new_step=True)
+    model.update_anno_stats()
+    assert model._anno_img_stats['max_target_id'] <= len(model.get_anno_target_ids())
+    assert_stats_equal(model._anno_img_stats, Model.compute_anno_stats(model._anno_img_edit))
+
+
+def test_delete_unknown_target_raises_key_error(tmp_path):
+    model = new_model(make_anno_img(SHAPE, 10), tmp_path)
+    anno_img = model._anno_img_edit.copy()
+    with pytest.raises(KeyError):
+        model.delete_target(int(model._anno_img_stats['max_target_id']) + 1)
+    assert np.array_equal(model._anno_img_edit, anno_img)
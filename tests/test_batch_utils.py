@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+from utils.batch_utils import CaseResultFile, run_cases
+
+FIELDNAMES = ['label', 'voxels']
+
+
+def write_results(filepath):
+    """case a of 2 rows, b failed, c of no rows and d cut off while written"""
+    with CaseResultFile(filepath, FIELDNAMES) as result_file:
+        result_file.write('a', [{'label': 1, 'voxels': 10}, {'label': 2, 'voxels': 20}])
+        result_file.write('b', error='ValueError: broken')
+        result_file.write('c', [])
+        result_file.write('d', [{'label': 1, 'voxels': 5}, {'label': 2, 'voxels': 6}])
+    with open(filepath, 'r') as f:
+        lines = f.readlines()
+    with open(filepath, 'w') as f:
+        # interrupted while writing the last line
+        f.writelines(lines[:-1] + [lines[-1][:3]] if filepath.endswith('.csv') else lines[:-1] + ['{"case": "e'])
+
+
+@pytest.mark.parametrize('ext', ['.csv', '.jsonl'])
+def test_resume_keeps_cases_done_without_error(tmp_path, ext):
+    filepath = str(tmp_path / ('results' + ext))
+    write_results(filepath)
+    with CaseResultFile(filepath, FIELDNAMES, resume=True) as result_file:
+        assert result_file.done_cases == {'a', 'c'}
+        result_file.write('b', [{'label': 3, 'voxels': 30}])
+    with CaseResultFile(filepath, FIELDNAMES, resume=True) as result_file:
+        assert result_file.done_cases == {'a', 'b', 'c'}
+    if ext == '.jsonl':
+        with open(filepath, 'r') as f:
+            assert [json.loads(line)['case'] for line in f] == ['a', 'c', 'b']
+
+
+def test_resume_is_refused_for_other_columns(tmp_path):
+    filepath = str(tmp_path / 'results.csv')
+    write_results(filepath)
+    with pytest.raises(AttributeError):
+        CaseResultFile(filepath, ['label'], resume=True)
+
+
+def divide(case, a, b):
+    return a // b
+
+
+def test_run_cases_reports_errors_per_case():
+    results = sorted(run_cases(divide, [('x', 4, 2), ('y', 1, 0)], num_workers=1))
+    assert results[0] == (('x', 4, 2), 2, None)
+    assert results[1][1] is None and results[1][2].startswith('ZeroDivisionError')
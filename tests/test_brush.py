@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from model.brush import BRUSH_TYPE_CIRCLE_BRUSH, BRUSH_TYPE_RECT_BRUSH, BRUSH_TYPE_SPHERE_BRUSH, \
+    BRUSH_TYPE_CUBE_BRUSH, PLANE_BRUSH_TYPES, ROUND_BRUSH_TYPES, STAMP_SUBDIVISIONS, sweep_brush
+
+
+def sweep_brush_by_centers(shape, segment_starts, segment_ends, brush_type, brush_size, axis_dim):
+    """sweep_brush computed voxel by voxel over the whole mask for every center"""
+    coords = np.indices(shape).reshape(3, -1).T
+    mask = np.zeros(len(coords), bool)
+    for start, end in zip(np.asarray(segment_starts, np.float64), np.asarray(segment_ends, np.float64)):
+        num_steps = max(int(np.ceil(np.abs(end - start).max())), 1)
+        for step in range(num_steps + 1):
+            center = start + step / num_steps * (end - start)
+            center_voxel = np.rint(center)
+            if brush_type in ROUND_BRUSH_TYPES:
+                center = center_voxel + np.rint((center - center_voxel) * STAMP_SUBDIVISIONS) / STAMP_SUBDIVISIONS
+                covered = 4 * ((coords - center) ** 2).sum(axis=1) <= brush_size ** 2
+            else:
+                low = brush_size // 2
+                covered = np.all((coords >= center_voxel - low) & (coords <= center_voxel + brush_size - 1 - low),
+                                 axis=1)
+            if brush_type in PLANE_BRUSH_TYPES:
+                covered &= coords[:, axis_dim] == center_voxel[axis_dim]
+            mask |= covered
+    return mask.reshape(shape)
+
+
+@pytest.mark.parametrize('brush_type', [BRUSH_TYPE_CIRCLE_BRUSH, BRUSH_TYPE_RECT_BRUSH, BRUSH_TYPE_SPHERE_BRUSH,
+                                        BRUSH_TYPE_CUBE_BRUSH])
+def test_sweep_brush_equals_stamps_by_centers(brush_type):
+    rng = np.random.RandomState(brush_type)
+    for _ in range(30):
+        shape = tuple(rng.randint(3, 16, 3))
+        axis_dim = rng.randint(3)
+        brush_size = rng.randint(1, 9)
+        points = rng.randint(-3, 18, (rng.randint(1, 5), 3)).astype(np.float64)
+        if brush_type in PLANE_BRUSH_TYPES:
+            points[:, axis_dim] = rng.randint(shape[axis_dim])
+        segment_starts, segment_ends = points[:-1], points[1:]
+        if len(points) == 1:
+            segment_starts = segment_ends = points
+        mask = sweep_brush(shape, segment_starts, segment_ends, brush_type, brush_size, axis_dim)
+        expected = sweep_brush_by_centers(shape, segment_starts, segment_ends, brush_type, brush_size, axis_dim)
+        assert np.array_equal(mask, expected)
+
+
+@pytest.mark.parametrize('brush_size', [2, 3, 4, 5])
+def test_round_brush_is_symmetric_around_half_voxel_center(brush_size):
+    shape = (1, 16, 16)
+    mask = sweep_brush(shape, [[0, 8, 7.5]], [[0, 8, 7.5]], BRUSH_TYPE_CIRCLE_BRUSH, brush_size, 0)
+    assert np.array_equal(mask, mask[:, :, ::-1])  # mirrored about w = 7.5
+    assert mask[0, 8, 7] and mask[0, 8, 8]
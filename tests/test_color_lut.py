@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from model.model import Model, MAX_LABEL
+
+
+def color_anno_img_by_labels(anno_img, alpha, colors, num_positive_labels):
+    """RGBA [h, w, 4] of label map anno_img [h, w] colored one label after another, as before the lookup table"""
+    num_colors = max(min(len(colors), num_positive_labels), 1)
+    color_img = np.zeros(anno_img.shape + (4,), np.uint8)
+    for label in range(1, MAX_LABEL + 1):
+        color = colors[(label - 1) % num_colors]
+        color_img[anno_img == label, :3] = [(color >> 16) & 255, (color >> 8) & 255, color & 255]
+    color_img[..., 3] = 255 if alpha is None else np.where(anno_img == 0, 0, round(alpha * 255))
+    return color_img
+
+
+@pytest.mark.parametrize('num_positive_labels', [1, 3, MAX_LABEL])
+@pytest.mark.parametrize('alpha', [None, 0.5])
+def test_lut_colors_equal_per_label_colors(num_positive_labels, alpha):
+    model = Model()
+    model._anno_img_stats['num_positive_labels'] = num_positive_labels
+    anno_img = np.random.RandomState(0).randint(0, num_positive_labels + 1, (37, 53)).astype(np.int8)
+    expected = color_anno_img_by_labels(anno_img, alpha, model.label_colors, num_positive_labels)
+    assert np.array_equal(model.color_anno_img(anno_img, alpha), expected)
+    out = np.empty(anno_img.shape + (4,), np.uint8)
+    assert model.color_anno_img(anno_img, alpha, out=out) is out
+    assert np.array_equal(out, expected)
@@ -0,0 +1,55 @@
+import numpy as np
+
+from model.edit_history import EditHistory
+
+SHAPE = (4, 8, 8)
+
+
+def paint_steps(history, img, num_steps, seed=0):
+    """random changes of img recorded as num_steps steps. return img after every step, the first is before them"""
+    rng = np.random.RandomState(seed)
+    states = [img.copy()]
+    for _ in range(num_steps):
+        history.new_step()
+        for _ in range(rng.randint(1, 3)):
+            new_img = img.copy()
+            new_img.ravel()[rng.choice(img.size, 10, replace=False)] = rng.randint(0, 4)
+            whole_bbox = [[0, n - 1] for n in SHAPE]
+            history.record_region(SHAPE, whole_bbox, img.copy(), new_img)
+            img[...] = new_img
+        states.append(img.copy())
+    return states
+
+
+def test_undo_redo_round_trip():
+    history = EditHistory()
+    img = np.zeros(SHAPE, np.int8)
+    states = paint_steps(history, img, 10)
+    for state in reversed(states[:-1]):
+        assert history.undo(img) is not None
+        assert np.array_equal(img, state)
+    assert history.undo(img) is None
+    for state in states[1:]:
+        assert history.redo(img) is not None
+        assert np.array_equal(img, state)
+    assert history.redo(img) is None
+
+
+def test_history_keeps_within_byte_budget():
+    step_nbytes = 10 * (4 + 1 + 1)  # uint32 indices, int8 old and new values of 10 voxels
+    history = EditHistory(budget_bytes=3 * step_nbytes + 1)
+    img = np.zeros(SHAPE, np.int8)
+    for i in range(5):
+        history.new_step()
+        indices = np.arange(10 * i, 10 * (i + 1), dtype=np.uint32)
+        coords = np.unravel_index(indices, SHAPE)
+        history.record(indices, img.ravel()[indices], np.full(10, i + 1, np.int8),
+                       [[int(coords[k].min()), int(coords[k].max())] for k in range(3)])
+        img.ravel()[indices] = i + 1
+    assert history.nbytes == 3 * step_nbytes
+    # the newest step is kept even beyond the budget
+    history.budget_bytes = 0
+    assert history.nbytes == step_nbytes
+    assert history.undo(img) is not None
+    assert history.undo(img) is None
+    assert np.count_nonzero(img) == 40 and not np.any(img == 5)
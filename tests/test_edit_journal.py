@@ -0,0 +1,147 @@
+import os
+
+import numpy as np
+import pytest
+
+from model.edit_history import EditHistory
+from model.edit_journal import EditJournal, JOURNAL_MAGIC
+from model.model import Model
+from utils.exception_utils import JournalError
+
+SHAPE = (4, 8, 8)
+
+
+def write_journal(journal_dir, raw_filepath, base_filepath, num_records):
+    """journal of num_records edits, each setting 5 voxels to its number. return the journal file path"""
+    journal = EditJournal(journal_dir)
+    journal.start(raw_filepath, base_filepath, SHAPE)
+    for i in range(num_records):
+        journal.append(np.arange(5 * i, 5 * (i + 1), dtype=np.uint32), np.full(5, i + 1, np.int8))
+    filepath = journal.filepath
+    journal.close()
+    return filepath
+
+
+def replay(journal_dir, raw_filepath, base_filepath):
+    journal = EditJournal(journal_dir)
+    journal.start(raw_filepath, base_filepath, SHAPE)
+    img = np.zeros(SHAPE, np.int8)
+    num_records = journal.replay(img)
+    journal.close()
+    return num_records, img
+
+
+def test_replay_round_trip(tmp_path):
+    journal_dir, raw_filepath = str(tmp_path / 'journals'), str(tmp_path / 'raw.nii.gz')
+    write_journal(journal_dir, raw_filepath, None, 3)
+    num_records, img = replay(journal_dir, raw_filepath, None)
+    assert num_records == 3
+    assert img.ravel()[:15].tolist() == [1] * 5 + [2] * 5 + [3] * 5
+    assert np.count_nonzero(img) == 15
+
+
+def test_replay_drops_records_failing_crc(tmp_path):
+    journal_dir, raw_filepath = str(tmp_path / 'journals'), str(tmp_path / 'raw.nii.gz')
+    filepath = write_journal(journal_dir, raw_filepath, None, 3)
+    with open(filepath, 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        last_byte = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last_byte[0] ^ 0xff]))
+    num_records, img = replay(journal_dir, raw_filepath, None)
+    assert num_records == 2
+    assert np.count_nonzero(img) == 10 and not np.any(img == 3)
+    # the broken record is cut off, so the journal is valid again
+    assert replay(journal_dir, raw_filepath, None)[0] == 2
+
+
+def test_replay_rejects_broken_header(tmp_path):
+    journal_dir, raw_filepath = str(tmp_path / 'journals'), str(tmp_path / 'raw.nii.gz')
+    filepath = write_journal(journal_dir, raw_filepath, None, 2)
+    with open(filepath, 'r+b') as f:
+        f.write(b'X' * len(JOURNAL_MAGIC))
+    with pytest.raises(JournalError):
+        replay(journal_dir, raw_filepath, None)
+
+
+def test_replay_rejects_changed_base_annotation(tmp_path):
+    journal_dir, raw_filepath = str(tmp_path / 'journals'), str(tmp_path / 'raw.nii.gz')
+    base_filepath = str(tmp_path / 'anno.nii.gz')
+    with open(base_filepath, 'wb') as f:
+        f.write(b'base')
+    write_journal(journal_dir, raw_filepath, base_filepath, 2)
+    with open(base_filepath, 'wb') as f:
+        f.write(b'changed base')
+    with pytest.raises(JournalError):
+        replay(journal_dir, raw_filepath, base_filepath)
+
+
+def paint(history, img, num_steps):
+    """random changes of img recorded as num_steps steps"""
+    rng = np.random.RandomState(0)
+    whole_bbox = [[0, n - 1] for n in SHAPE]
+    for _ in range(num_steps):
+        history.new_step()
+        new_img = img.copy()
+        new_img.ravel()[rng.choice(img.size, 10, replace=False)] = rng.randint(0, 4)
+        history.record_region(SHAPE, whole_bbox, img.copy(), new_img)
+        img[...] = new_img
+
+
+def test_journal_replays_history(tmp_path):
+    journal = EditJournal(str(tmp_path / 'journals'))
+    journal.start(str(tmp_path / 'raw.nii.gz'), None, SHAPE)
+    history = EditHistory(journal=journal)
+    img = np.zeros(SHAPE, np.int8)
+    paint(history, img, 6)
+    history.undo(img)
+    history.undo(img)
+    history.redo(img)
+    journal.close()
+
+    journal = EditJournal(str(tmp_path / 'journals'))
+    journal.start(str(tmp_path / 'raw.nii.gz'), None, SHAPE)
+    replayed_img = np.zeros(SHAPE, np.int8)
+    assert journal.replay(replayed_img) > 0
+    assert np.array_equal(replayed_img, img)
+
+
+def open_model(tmp_path):
+    """model of an empty raw image and an annotation of 2 targets, which is not saved yet"""
+    model = Model()
+    img_info = {'size': [8, 8, 4], 'spacing': [1.0, 1.0, 1.0], 'origin': [0.0, 0.0, 0.0],
+                'direction': [1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0], 'min_val': 0, 'max_val': 0}
+    anno_img = np.zeros(SHAPE, np.int8)
+    anno_img[0, :2, :2] = 1
+    anno_img[2:, 4:, 4:] = 2
+    model.set_img(str(tmp_path / 'raw.nii.gz'), 'raw', np.zeros(SHAPE, np.int16), img_info)
+    model.set_img(str(tmp_path / 'anno.nii.gz'), 'anno', anno_img, dict(img_info, max_val=2))
+    model.compute_img_stats('anno')
+    return model
+
+
+def test_failed_save_keeps_journal(tmp_path, monkeypatch):
+    model = open_model(tmp_path)
+    model.delete_target(model.get_anno_target_ids()[0])
+    edited_img = model.get_anno_img_snapshot()
+
+    def fail(*args, **kwargs):
+        raise OSError('No space left on device')
+
+    monkeypatch.setattr(Model, 'write_anno', staticmethod(fail))
+    with pytest.raises(OSError):
+        model.save_anno(str(tmp_path / 'anno.nii.gz'))
+    model.clear()
+
+    model = open_model(tmp_path)
+    assert model.get_unsaved_edits_info() is not None
+    assert model.recover_unsaved_edits() == 1
+    assert np.array_equal(model.get_anno_img_snapshot(), edited_img)
+
+
+def test_save_compacts_journal(tmp_path):
+    pytest.importorskip('SimpleITK')
+    model = open_model(tmp_path)
+    model.delete_target(model.get_anno_target_ids()[0])
+    model.save_anno(str(tmp_path / 'anno.nii.gz'))
+    assert model.get_unsaved_edits_info() is None
@@ -0,0 +1,124 @@
+import gzip
+import struct
+
+import numpy as np
+import pytest
+
+from model.volume_cache import VolumeCache
+from utils.nifti_utils import NIFTI_DTYPES, read_nifti_header, read_nifti_voxels
+
+sitk = pytest.importorskip('SimpleITK')
+
+SHAPE = (3, 4, 5)
+
+
+def make_img(dtype):
+    info = np.iinfo(dtype) if np.issubdtype(dtype, np.integer) else np.finfo(dtype)
+    img = np.arange(np.prod(SHAPE)).reshape(SHAPE).astype(dtype)
+    img.ravel()[:2] = [info.min, info.max]  # whole range, so that swapped or shifted bytes show
+    return img
+
+
+def write_nifti(filepath, img, endian='<', dim=None, scl_slope=0.0, scl_inter=0.0, extension=b''):
+    """Single file NIfTI-1 of img (d, h, w) written by hand. dim defaults to that of img, extension is the
+    content of one header extension"""
+    datatype = next(code for code, dtype in NIFTI_DTYPES.items() if np.dtype(dtype) == img.dtype)
+    if dim is None:
+        dim = [3] + list(img.shape[::-1])
+    dim = dim + [1] * (8 - len(dim))
+    if extension:
+        extension += b'\x00' * (-(len(extension) + 8) % 16)
+        extension = b'\x01\x00\x00\x00' + struct.pack(endian + '2i', len(extension) + 8, 0) + extension
+    else:
+        extension = b'\x00' * 4
+    header = bytearray(348)
+    struct.pack_into(endian + 'i', header, 0, 348)
+    struct.pack_into(endian + '8h', header, 40, *dim)
+    struct.pack_into(endian + '2h', header, 70, datatype, img.dtype.itemsize * 8)
+    struct.pack_into(endian + '8f', header, 76, 1, 1, 1, 1, 1, 1, 1, 1)
+    struct.pack_into(endian + '3f', header, 108, 348 + len(extension), scl_slope, scl_inter)
+    header[123] = 2  # mm
+    header[344:348] = b'n+1\x00'
+    data = bytes(header) + extension + img.astype(img.dtype.newbyteorder(endian)).tobytes()
+    with (gzip.open if filepath.endswith('.gz') else open)(filepath, 'wb') as f:
+        f.write(data)
+
+
+def read_by_sitk(filepath):
+    return sitk.GetArrayFromImage(sitk.ReadImage(filepath))
+
+
+def assert_read_as_sitk(filepath, dtype=None):
+    expected = read_by_sitk(filepath)
+    img, min_val, max_val, file_dtype = read_nifti_voxels(filepath, dtype)
+    assert img.dtype == (expected.dtype if dtype is None else dtype) and file_dtype == expected.dtype
+    assert np.array_equal(img, expected if dtype is None else expected.astype(dtype))
+    assert (min_val, max_val) == (expected.min().item(), expected.max().item())
+
+
+@pytest.mark.parametrize('dtype', sorted(set(NIFTI_DTYPES.values()), key=lambda dtype: np.dtype(dtype).str))
+@pytest.mark.parametrize('filename', ['img.nii', 'img.nii.gz'])
+def test_dtypes_read_as_sitk(tmp_path, dtype, filename):
+    filepath = str(tmp_path / filename)
+    sitk.WriteImage(sitk.GetImageFromArray(make_img(dtype)), filepath)
+    assert_read_as_sitk(filepath)
+
+
+@pytest.mark.parametrize('dtype', sorted(set(NIFTI_DTYPES.values()), key=lambda dtype: np.dtype(dtype).str))
+def test_big_endian_read_as_sitk(tmp_path, dtype):
+    filepath = str(tmp_path / 'img.nii')
+    write_nifti(filepath, make_img(dtype), '>')
+    with open(filepath, 'rb') as f:
+        assert read_nifti_header(f)['endian'] == '>'
+    assert_read_as_sitk(filepath)
+
+
+@pytest.mark.parametrize('endian', '<>')
+def test_extensions_are_skipped(tmp_path, endian):
+    filepath = str(tmp_path / 'img.nii.gz')
+    write_nifti(filepath, make_img(np.int16), endian, extension=b'{"comment": "%s"}' % (b'x' * 100))
+    with gzip.open(filepath, 'rb') as f:
+        # header, extension flag, extension of 8 header bytes and 120 padded content bytes
+        assert read_nifti_header(f)['vox_offset'] == 348 + 4 + 128
+    assert_read_as_sitk(filepath)
+
+
+def test_cast_read_as_sitk(tmp_path):
+    filepath = str(tmp_path / 'img.nii.gz')
+    img = make_img(np.int16) % 50
+    write_nifti(filepath, img, '>')
+    assert_read_as_sitk(filepath, np.int8)
+
+
+@pytest.mark.parametrize('filename', ['img.nii', 'img.nii.gz'])
+def test_4d_falls_back_to_sitk(tmp_path, filename):
+    filepath = str(tmp_path / filename)
+    img = make_img(np.int16)
+    write_nifti(filepath, img, dim=[4] + list(img.shape[::-1]) + [1])
+    assert read_nifti_voxels(filepath) is None
+    read_img, _ = VolumeCache.read_file(filepath)
+    assert np.array_equal(read_img, read_by_sitk(filepath).reshape(read_img.shape))
+
+
+@pytest.mark.parametrize('scl_slope, scl_inter', [(2.0, 0.0), (1.0, -1024.0), (0.5, 3.0)])
+def test_scaled_falls_back_to_sitk(tmp_path, scl_slope, scl_inter):
+    filepath = str(tmp_path / 'img.nii.gz')
+    write_nifti(filepath, make_img(np.int16) % 1000, scl_slope=scl_slope, scl_inter=scl_inter)
+    assert read_nifti_voxels(filepath) is None
+    read_img, img_info = VolumeCache.read_file(filepath)
+    expected = read_by_sitk(filepath)
+    assert np.array_equal(read_img, expected) and read_img.dtype == expected.dtype
+    assert img_info['dtype'] == expected.dtype.name
+
+
+def test_unscaled_slope_is_streamed(tmp_path):
+    filepath = str(tmp_path / 'img.nii')
+    write_nifti(filepath, make_img(np.uint16), scl_slope=1.0)
+    assert_read_as_sitk(filepath)
+
+
+def test_other_formats_fall_back_to_sitk(tmp_path):
+    filepath = str(tmp_path / 'img.mha')
+    sitk.WriteImage(sitk.GetImageFromArray(make_img(np.int16)), filepath)
+    assert read_nifti_voxels(filepath) is None
+    assert np.array_equal(VolumeCache.read_file(filepath)[0], read_by_sitk(filepath))
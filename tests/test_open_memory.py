@@ -0,0 +1,39 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('SimpleITK')
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+SHAPE = (64, 512, 512)
+
+
+def can_reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+@pytest.mark.skipif(not can_reset_peak_rss(), reason='peak RSS of a step is measured on linux only')
+@pytest.mark.parametrize('cache_budget', [0, 8 * 1024 ** 3])
+def test_peak_rss_of_opening_anno(tmp_path, cache_budget):
+    from scripts.measure_update_scenes import write_case
+
+    raw_filepath, anno_filepath = write_case(str(tmp_path), SHAPE)
+    cache_dir = str(tmp_path / 'cache')
+    # a new process, as the peak RSS of a process never decreases
+    for _ in range(2 if cache_budget else 1):
+        output = subprocess.check_output(
+            [sys.executable, '-m', 'scripts.measure_open_memory', '--open', raw_filepath, anno_filepath, cache_dir,
+             str(cache_budget)], cwd=SRC_DIR)
+    steps = {step: peak_increase for step, peak_increase, _ in json.loads(output.decode('utf-8').splitlines()[-1])}
+    label_map_nbytes = SHAPE[0] * SHAPE[1] * SHAPE[2]
+    print('peak RSS of reading the anno: %.2f label maps' % (steps['read anno'] / label_map_nbytes))
+    # the int8 label map, not an int16 copy read by ITK and then cast
+    assert steps['read anno'] < 2.5 * label_map_nbytes
@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+import pytest
+
+from model.volume_cache import VolumeCache
+
+sitk = pytest.importorskip('SimpleITK')
+
+
+def write_img(filepath, img, mtime_ns):
+    sitk.WriteImage(sitk.GetImageFromArray(img), filepath)
+    os.utime(filepath, ns=(mtime_ns, mtime_ns))
+
+
+def test_cache_entry_is_invalidated_by_mtime(tmp_path):
+    filepath = str(tmp_path / 'raw.nii')
+    img = np.arange(4 * 5 * 6, dtype=np.int16).reshape(4, 5, 6)
+    write_img(filepath, img, 10 ** 18)
+    cache = VolumeCache(str(tmp_path / 'volumes'), 1024 ** 2)
+    cached_img, img_info = cache.read_img(filepath)
+    assert np.array_equal(cached_img, img) and isinstance(cached_img, np.memmap)
+    assert cache.load(filepath) is not None
+
+    # same path and size, other voxels and mtime
+    write_img(filepath, img[::-1].copy(), 10 ** 18 + 1)
+    assert cache.load(filepath) is None
+    new_img, new_img_info = cache.read_img(filepath)
+    assert np.array_equal(new_img, img[::-1])
+
+
+def test_disabled_cache_stores_nothing(tmp_path):
+    filepath = str(tmp_path / 'raw.nii')
+    write_img(filepath, np.ones((2, 3, 4), np.int16), 10 ** 18)
+    cache = VolumeCache(str(tmp_path / 'volumes'), 0)
+    img, _ = cache.read_img(filepath)
+    assert not isinstance(img, np.memmap)
+    assert cache.load(filepath) is None and cache.get_nbytes() == 0
+
+
+@pytest.mark.parametrize('filename', ['raw.nii', 'raw.nii.gz', 'raw.mha'])
+def test_lossy_cast_is_not_cached(tmp_path, filename):
+    filepath = str(tmp_path / filename)
+    img = np.array([2.03, 2.03, 2.61, 2.72, 0.47], np.float32).reshape(1, 1, 5)
+    write_img(filepath, img, 10 ** 18)
+    cache = VolumeCache(str(tmp_path / 'volumes'), 1024 ** 2)
+    anno_img, _ = cache.read_img(filepath, np.int8)
+    assert anno_img.tolist() == [[[2, 2, 2, 2, 0]]]
+    assert cache.load(filepath) is None
+    raw_img, _ = cache.read_img(filepath)
+    assert np.array_equal(raw_img, img)
+
+
+def test_lossless_cast_is_cached(tmp_path):
+    filepath = str(tmp_path / 'anno.nii.gz')
+    img = np.array([0, 1, 2, 3, 300], np.int16).reshape(1, 1, 5)
+    write_img(filepath, img[..., :4], 10 ** 18)
+    cache = VolumeCache(str(tmp_path / 'volumes'), 1024 ** 2)
+    cache.read_img(filepath, np.int8)
+    raw_img, _ = cache.read_img(filepath)
+    assert np.array_equal(raw_img, img[..., :4])
+
+    # values out of the int8 range
+    write_img(filepath, img, 10 ** 18 + 1)
+    assert cache.read_img(filepath, np.int8)[0].tolist() == [[[0, 1, 2, 3, 44]]]
+    assert cache.load(filepath) is None
+    assert np.array_equal(cache.read_img(filepath)[0], img)
@@ -0,0 +1,44 @@
+import os
+
+import numpy as np
+import pytest
+
+from model.model import Model
+import utils.gzip_utils
+
+sitk = pytest.importorskip('SimpleITK')
+
+IMG_INFO = {'size': [6, 5, 4], 'spacing': [1.0, 1.0, 2.0], 'origin': [0.0, 0.0, 0.0],
+            'direction': [1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0]}
+
+
+def make_anno_img(value):
+    anno_img = np.zeros((4, 5, 6), np.int8)
+    anno_img[1:3, 2:4, 1:5] = value
+    return anno_img
+
+
+@pytest.mark.parametrize('filename', ['anno.nii', 'anno.nii.gz'])
+def test_write_anno_is_fsynced(tmp_path, monkeypatch, filename):
+    filepath = str(tmp_path / filename)
+    fsynced = []
+    fsync = os.fsync
+    monkeypatch.setattr(os, 'fsync', lambda fd: fsynced.append(os.fstat(fd).st_ino) or fsync(fd))
+    Model.write_anno(filepath, make_anno_img(2), IMG_INFO)
+    assert np.array_equal(sitk.GetArrayFromImage(sitk.ReadImage(filepath)), make_anno_img(2))
+    # the file before it replaced filepath, then the directory
+    assert fsynced[-2:] == [os.stat(filepath).st_ino, os.stat(str(tmp_path)).st_ino]
+
+
+def test_failed_write_anno_keeps_file(tmp_path, monkeypatch):
+    filepath = str(tmp_path / 'anno.nii.gz')
+    Model.write_anno(filepath, make_anno_img(1), IMG_INFO)
+
+    def fail(*args, **kwargs):
+        raise OSError('No space left on device')
+
+    monkeypatch.setattr(utils.gzip_utils, 'gzip_block', fail)
+    with pytest.raises(OSError):
+        Model.write_anno(filepath, make_anno_img(2), IMG_INFO)
+    assert np.array_equal(sitk.GetArrayFromImage(sitk.ReadImage(filepath)), make_anno_img(1))
+    assert os.listdir(str(tmp_path)) == ['anno.nii.gz']